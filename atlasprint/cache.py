@@ -0,0 +1,314 @@
+"""Cache of rendered documents, outside of the QGIS Server context.
+
+Small documents are kept in a bounded in-process LRU, large documents are kept
+in a size-capped directory which can be shared between QGIS Server processes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from collections import OrderedDict
+from contextlib import suppress
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+from uuid import uuid4
+
+from .pdf import HAS_PYPDF
+from .tools import to_bool
+
+from . import logger
+
+ENV_CACHE = "QGIS_SERVER_ATLASPRINT_CACHE"
+ENV_CACHE_DIR = "QGIS_SERVER_ATLASPRINT_CACHE_DIR"
+ENV_CACHE_MEMORY_SIZE = "QGIS_SERVER_ATLASPRINT_CACHE_MEMORY_SIZE"
+ENV_CACHE_MEMORY_ITEM_SIZE = "QGIS_SERVER_ATLASPRINT_CACHE_MEMORY_ITEM_SIZE"
+ENV_CACHE_DISK_SIZE = "QGIS_SERVER_ATLASPRINT_CACHE_DISK_SIZE"
+
+ENV_PAGE_CACHE = "QGIS_SERVER_ATLASPRINT_PAGE_CACHE"
+ENV_PAGE_CACHE_DIR = "QGIS_SERVER_ATLASPRINT_PAGE_CACHE_DIR"
+ENV_PAGE_CACHE_DISK_SIZE = "QGIS_SERVER_ATLASPRINT_PAGE_CACHE_DISK_SIZE"
+ENV_PAGE_CACHE_TTL = "QGIS_SERVER_ATLASPRINT_PAGE_CACHE_TTL"
+
+ENV_PREVIEW_CACHE_SIZE = "QGIS_SERVER_ATLASPRINT_PREVIEW_CACHE_SIZE"
+
+MEGABYTE = 1024 * 1024
+
+DEFAULT_MEMORY_SIZE = 64 * MEGABYTE
+DEFAULT_MEMORY_ITEM_SIZE = 1 * MEGABYTE
+DEFAULT_DISK_SIZE = 1024 * MEGABYTE
+DEFAULT_PREVIEW_CACHE_SIZE = 16 * MEGABYTE
+
+# Seconds, for pages using layers without a known data version
+DEFAULT_PAGE_CACHE_TTL = 300
+
+
+def fingerprint(**values: Any) -> str:
+    """Compute a stable key from the given values."""
+    data = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf8")).hexdigest()
+
+
+def project_path(project: Any) -> str:
+    """Path of the project file without any symbolic link, the same project for every `MAP`.
+
+    A project not stored in a file is returned as is.
+    """
+    path = project.fileName()
+    if path and os.path.isfile(path):
+        return os.path.realpath(path)
+    return path
+
+
+def print_key(
+    project: Any,
+    parameters: Dict[str, Any],
+    lizmap_user: str,
+    lizmap_user_groups: Sequence[str],
+) -> str:
+    """Key of the document of a `GetPrint` request in the output cache.
+
+    The key changes with the version of the data of the layers. Without a known version, a layer not
+    stored in a local file, the key changes every `page_cache_ttl()` seconds.
+
+    :param parameters: The parameters of the request, read by `parse_print_parameters`.
+    """
+    # Avoid a circular import
+    from .context import project_context
+
+    data_version = project_context(project).layout_data_version(parameters["layout_name"])
+    return fingerprint(
+        project=project_path(project),
+        project_modified=project.lastModified().toMSecsSinceEpoch(),
+        data_version=data_version or int(time.time() // page_cache_ttl()),
+        layout=parameters["layout_name"],
+        filter=parameters["normalized_filter"],
+        feature_ids=parameters["feature_ids"],
+        scale=parameters["scale"],
+        scales=parameters["scales"],
+        format=parameters["output_format"].name,
+        params=parameters["additional_params"],
+        lizmap_user=lizmap_user,
+        lizmap_user_groups=lizmap_user_groups,
+    )
+
+
+class OutputCache:
+    """Two-tier cache of rendered documents.
+
+    Documents up to `memory_item_size` bytes are kept in memory, the others are stored in `disk_dir`.
+    Both tiers are evicted in a least recently used order. Without `disk_dir`, only the memory tier is used.
+    """
+
+    def __init__(
+        self,
+        disk_dir: Optional[Path],
+        *,
+        memory_size: int = DEFAULT_MEMORY_SIZE,
+        memory_item_size: int = DEFAULT_MEMORY_ITEM_SIZE,
+        disk_size: int = DEFAULT_DISK_SIZE,
+    ) -> None:
+        self.disk_dir = disk_dir
+        self.memory_size = memory_size
+        self.memory_item_size = min(memory_item_size, memory_size)
+        self.disk_size = disk_size if disk_dir else 0
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._disk_used = sum(f.stat().st_size for f in self._disk_files())
+
+    @classmethod
+    def from_environment(cls, memory: bool = True) -> Optional["OutputCache"]:
+        """Build the cache from environment variables, None if the cache is disabled.
+
+        :param memory: False to store every document on disk, for a process not serving the documents.
+        """
+        if not to_bool(os.getenv(ENV_CACHE)):
+            return None
+
+        disk_dir = os.getenv(ENV_CACHE_DIR)
+        cache = cls(
+            Path(disk_dir) if disk_dir else Path(tempfile.gettempdir()).joinpath("atlasprint_cache"),
+            memory_size=int(os.getenv(ENV_CACHE_MEMORY_SIZE, DEFAULT_MEMORY_SIZE)) if memory else 0,
+            memory_item_size=int(os.getenv(ENV_CACHE_MEMORY_ITEM_SIZE, DEFAULT_MEMORY_ITEM_SIZE)),
+            disk_size=int(os.getenv(ENV_CACHE_DISK_SIZE, DEFAULT_DISK_SIZE)),
+        )
+        logger.info("Output cache enabled in %s", cache.disk_dir)
+        return cache
+
+    def stats(self) -> Dict[str, int]:
+        """Counters about the cache usage."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "memory_items": len(self._memory),
+            "memory_bytes": self._memory_used,
+            "disk_bytes": self._disk_used,
+        }
+
+    def get(self, key: str) -> Optional[Union[bytes, Path]]:
+        """Return the cached document, either as bytes or as a path in the disk tier."""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return data
+
+        if not self.disk_dir:
+            self.misses += 1
+            return None
+
+        path = self.disk_dir.joinpath(key)
+        try:
+            # Refresh the modification time, used as the LRU order
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def contains(self, key: str) -> bool:
+        """If the document is in the cache, without counting a hit nor refreshing its order."""
+        if key in self._memory:
+            return True
+        return bool(self.disk_dir and self.disk_dir.joinpath(key).is_file())
+
+    def put(self, key: str, path: Path) -> None:
+        """Store the document from the given file, the file is left untouched."""
+        size = path.stat().st_size
+        if size <= self.memory_item_size:
+            self._put_memory(key, path.read_bytes())
+            return
+
+        if not self.disk_dir or size > self.disk_size:
+            return
+
+        tmp = self.disk_dir.joinpath(f".{key}.{uuid4()}")
+        try:
+            os.link(path, tmp)
+        except OSError:
+            # Not on the same file system
+            shutil.copyfile(path, tmp)
+        self._put_disk(key, tmp, size)
+
+    def put_bytes(self, key: str, data: bytes) -> None:
+        """Store the document from memory."""
+        size = len(data)
+        if size <= self.memory_item_size:
+            self._put_memory(key, data)
+            return
+
+        if not self.disk_dir or size > self.disk_size:
+            return
+
+        tmp = self.disk_dir.joinpath(f".{key}.{uuid4()}")
+        tmp.write_bytes(data)
+        self._put_disk(key, tmp, size)
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_used -= len(previous)
+
+        self._memory[key] = data
+        self._memory_used += len(data)
+        while self._memory_used > self.memory_size:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+            self.evictions += 1
+
+    def _put_disk(self, key: str, tmp: Path, size: int) -> None:
+        target = tmp.with_name(key)
+        with suppress(OSError):
+            # The previous document of the same key is replaced
+            self._disk_used -= target.stat().st_size
+        # Atomic, a concurrent reader gets either the previous or the new document
+        os.replace(tmp, target)
+
+        self._disk_used += size
+        if self._disk_used > self.disk_size:
+            self._evict_disk()
+
+    def clear(self) -> None:
+        """Remove all documents from both tiers."""
+        self._memory.clear()
+        self._memory_used = 0
+        for f in self._disk_files():
+            f.unlink(missing_ok=True)
+        self._disk_used = 0
+
+    def _disk_files(self) -> List[Path]:
+        if not self.disk_dir:
+            return []
+        return [f for f in self.disk_dir.iterdir() if f.is_file() and not f.name.startswith(".")]
+
+    def _evict_disk(self) -> None:
+        # The directory may be shared with other processes, scan it again
+        files = []
+        for f in self._disk_files():
+            try:
+                stat = f.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, f))
+
+        self._disk_used = sum(size for _, size, _ in files)
+        for _, size, f in sorted(files, key=lambda item: item[0]):
+            if self._disk_used <= self.disk_size:
+                break
+            f.unlink(missing_ok=True)
+            self._disk_used -= size
+            self.evictions += 1
+
+
+def page_cache_from_environment() -> Optional[OutputCache]:
+    """Build the cache of atlas pages from environment variables, None if the cache is disabled.
+
+    Each feature of an atlas is stored as a single PDF document, in the disk tier only.
+    """
+    if not to_bool(os.getenv(ENV_PAGE_CACHE)):
+        return None
+
+    if not HAS_PYPDF:
+        logger.warning("The cache of atlas pages requires the Python package 'pypdf', the cache is disabled")
+        return None
+
+    disk_dir = os.getenv(ENV_PAGE_CACHE_DIR)
+    cache = OutputCache(
+        Path(disk_dir) if disk_dir else Path(tempfile.gettempdir()).joinpath("atlasprint_pages"),
+        memory_size=0,
+        disk_size=int(os.getenv(ENV_PAGE_CACHE_DISK_SIZE, DEFAULT_DISK_SIZE)),
+    )
+    logger.info("Cache of atlas pages enabled in %s", cache.disk_dir)
+    return cache
+
+
+def preview_cache_from_environment() -> Optional[OutputCache]:
+    """Build the cache of previews from environment variables, None if the cache is disabled.
+
+    Previews are small images, kept in memory only.
+    """
+    size = int(os.getenv(ENV_PREVIEW_CACHE_SIZE, DEFAULT_PREVIEW_CACHE_SIZE))
+    if size <= 0:
+        return None
+
+    return OutputCache(None, memory_size=size, memory_item_size=size)
+
+
+def page_cache_ttl() -> int:
+    """Lifetime in seconds of pages which are using layers without a known data version."""
+    return int(os.getenv(ENV_PAGE_CACHE_TTL, DEFAULT_PAGE_CACHE_TTL))
@@ -0,0 +1,239 @@
+"""Objects computed once for a loaded project, outside of the QGIS Server context."""
+
+import os
+import weakref
+
+from typing import Any, Dict, List, Optional, Set
+
+from qgis.core import (
+    Qgis,
+    QgsExpressionContextScope,
+    QgsExpressionContextUtils,
+    QgsLayoutItemMap,
+    QgsMapLayer,
+    QgsMasterLayoutInterface,
+    QgsPrintLayout,
+    QgsProject,
+    QgsProviderRegistry,
+)
+from qgis.PyQt import sip
+
+from .cache import fingerprint
+from .tools import to_bool
+
+from . import logger
+
+ENV_LAYOUT_POOL_SIZE = "QGIS_SERVER_ATLASPRINT_LAYOUT_POOL_SIZE"
+
+DEFAULT_LAYOUT_POOL_SIZE = 1
+
+
+class ProjectContext:
+    """Cache attached to a project, invalidated by the project signals."""
+
+    def __init__(self, project: QgsProject) -> None:
+        self._project = weakref.ref(project)
+        self._layouts: Optional[Dict[str, QgsMasterLayoutInterface]] = None
+        self._pdf_export_options: Dict[str, Dict[str, Any]] = {}
+        self._map_scales: Optional[List[float]] = None
+        self._global_scope: Optional[QgsExpressionContextScope] = None
+        self._project_scope: Optional[QgsExpressionContextScope] = None
+        self._layout_pool: Dict[str, List[QgsPrintLayout]] = {}
+        self._layout_pool_names: Set[str] = set()
+        self.layout_pool_size = int(os.getenv(ENV_LAYOUT_POOL_SIZE, DEFAULT_LAYOUT_POOL_SIZE))
+
+        project.cleared.connect(self.invalidate)
+        project.readProject.connect(lambda *_: self.invalidate())
+        project.dirtySet.connect(self._invalidate_project_scope)
+        project.customVariablesChanged.connect(self._invalidate_project_scope)
+        project.viewSettings().mapScalesChanged.connect(self._invalidate_map_scales)
+
+        manager = project.layoutManager()
+        manager.layoutAdded.connect(lambda *_: self._invalidate_layouts())
+        manager.layoutRemoved.connect(lambda *_: self._invalidate_layouts())
+        manager.layoutRenamed.connect(lambda *_: self._invalidate_layouts())
+
+    @property
+    def project(self) -> QgsProject:
+        project = self._project()
+        if project is None:
+            raise RuntimeError("The project is not available anymore")
+        return project
+
+    def layout(self, name: str) -> Optional[QgsMasterLayoutInterface]:
+        """Layout by its name, print layouts are returned as QgsPrintLayout."""
+        if self._layouts is None:
+            manager = self.project.layoutManager()
+            self._layouts = {layout.name(): layout for layout in manager.layouts()}
+            # Typed as QgsPrintLayout, not only as the interface
+            self._layouts.update({layout.name(): layout for layout in manager.printLayouts()})
+        return self._layouts.get(name)
+
+    def layout_clone(self, name: str) -> Optional[QgsPrintLayout]:
+        """A private clone of the print layout, which can be modified for a single request.
+
+        The clone is taken from the warm pool if available, otherwise the layout is cloned now.
+        """
+        self._layout_pool_names.add(name)
+        pool = self._layout_pool.get(name)
+        if pool:
+            return pool.pop()
+
+        layout = self.layout(name)
+        if not isinstance(layout, QgsPrintLayout):
+            return None
+        logger.info("No clone available in the pool for the layout `%s`, cloning it now", name)
+        return layout.clone()
+
+    def refill_layout_pool(self) -> None:
+        """Clone again the layouts taken from the pool.
+
+        To be called once the response has been sent, to keep the cloning out of the request path.
+        """
+        for name in self._layout_pool_names:
+            layout = self.layout(name)
+            if not isinstance(layout, QgsPrintLayout):
+                continue
+            pool = self._layout_pool.setdefault(name, [])
+            while len(pool) < self.layout_pool_size:
+                pool.append(layout.clone())
+
+    def pdf_export_options(self, layout: QgsMasterLayoutInterface) -> Dict[str, Any]:
+        """PDF export settings read from the custom properties of the layout.
+
+        The keys are the names of the attributes in QgsLayoutExporter.PdfExportSettings.
+        """
+        options = self._pdf_export_options.get(layout.name())
+        if options is not None:
+            return options
+
+        TextRenderFormat = Qgis.TextRenderFormat
+        int_text_render_format = int(
+            layout.customProperty(
+                "pdfTextFormat",
+                int(TextRenderFormat.AlwaysText),
+            )
+        )
+        text_render_format_values = {
+            int(TextRenderFormat.AlwaysText): TextRenderFormat.AlwaysText,
+            int(TextRenderFormat.AlwaysOutlines): TextRenderFormat.AlwaysOutlines,
+        }
+        options = {
+            "forceVectorOutput": to_bool(layout.customProperty("forceVector", False)),
+            "exportMetadata": to_bool(layout.customProperty("pdfIncludeMetadata", False)),
+            "textRenderFormat": text_render_format_values.get(
+                int_text_render_format, TextRenderFormat.AlwaysText
+            ),
+            "simplifyGeometries": to_bool(layout.customProperty("pdfSimplify", False)),
+            "rasterizeWholeImage": to_bool(layout.customProperty("rasterize", False)),
+        }
+        self._pdf_export_options[layout.name()] = options
+        return options
+
+    @property
+    def map_scales(self) -> List[float]:
+        """Predefined map scales from the project, or from the global settings."""
+        if self._map_scales is None:
+            view_settings = self.project.viewSettings()
+            map_scales = view_settings.mapScales()
+            if not view_settings.useProjectScales() or len(map_scales) == 0:
+                logger.info(
+                    "Map scales not found in project, fetching predefined map scales in global config"
+                )
+                # Avoid a circular import
+                from .core import global_scales
+
+                map_scales = global_scales()
+            self._map_scales = map_scales
+        return self._map_scales
+
+    def global_scope(self) -> QgsExpressionContextScope:
+        """A copy of the global expression scope, the caller takes the ownership."""
+        if self._global_scope is None:
+            self._global_scope = QgsExpressionContextUtils.globalScope()
+        return QgsExpressionContextScope(self._global_scope)
+
+    def project_scope(self) -> QgsExpressionContextScope:
+        """A copy of the project expression scope, the caller takes the ownership."""
+        if self._project_scope is None:
+            self._project_scope = QgsExpressionContextUtils.projectScope(self.project)
+        return QgsExpressionContextScope(self._project_scope)
+
+    def data_version(self, *layers: QgsMapLayer) -> Optional[str]:
+        """Version of the data of the layers.
+
+        None if one of the layers is not stored in a local file, its version can not be known.
+        """
+        versions = {}
+        for layer in layers:
+            version = layer_data_version(layer)
+            if version is None:
+                return None
+            versions[layer.id()] = version
+        return fingerprint(**versions)
+
+    def layout_data_version(self, name: str) -> Optional[str]:
+        """Version of the data of the layers rendered by the maps of the print layout, and of its coverage layer.
+
+        The layers of a map locked or following a theme may be hidden in the project. None for a report, the
+        layers of its sections are not read, or if the version can not be known.
+        """
+        layout = self.layout(name)
+        if not isinstance(layout, QgsPrintLayout):
+            return None
+        layers: Dict[str, QgsMapLayer] = {}
+        for item in layout.items():
+            if isinstance(item, QgsLayoutItemMap):
+                layers.update((layer.id(), layer) for layer in item.layersToRender())
+        atlas = layout.atlas()
+        coverage = atlas.coverageLayer() if atlas.enabled() else None
+        if coverage:
+            layers[coverage.id()] = coverage
+        return self.data_version(*layers.values())
+
+    def invalidate(self) -> None:
+        """Drop everything computed for the project."""
+        self._invalidate_layouts()
+        self._invalidate_map_scales()
+        self._invalidate_project_scope()
+        self._global_scope = None
+
+    def _invalidate_layouts(self) -> None:
+        self._layouts = None
+        self._pdf_export_options = {}
+        self._layout_pool = {}
+
+    def _invalidate_map_scales(self) -> None:
+        self._map_scales = None
+
+    def _invalidate_project_scope(self) -> None:
+        self._project_scope = None
+
+
+def layer_data_version(layer: QgsMapLayer) -> Optional[int]:
+    """Modification time of the file storing the layer, None if the layer is not stored in a local file."""
+    path = QgsProviderRegistry.instance().decodeUri(layer.providerType(), layer.source()).get("path")
+    if not path:
+        return None
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+_contexts: Dict[int, ProjectContext] = {}
+
+
+def project_context(project: QgsProject) -> ProjectContext:
+    """Return the context of the project, created the first time."""
+    # The Python wrapper can be recreated for the same C++ object, use its address
+    key = sip.unwrapinstance(project)
+    context = _contexts.get(key)
+    if context is None:
+        logger.info("Creating the context of the project %s", project.fileName())
+        context = ProjectContext(project)
+        _contexts[key] = context
+        project.destroyed.connect(lambda *_: _contexts.pop(key, None))
+    else:
+        context._project = weakref.ref(project)
+    return context
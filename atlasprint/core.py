@@ -1,15 +1,25 @@
 """Core functions, outside of the QGIS Server context for printing atlas."""
 
-import tempfile
+import os
+import time
 import unicodedata
 
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from enum import Enum
 from pathlib import Path
 from typing import (
     TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
     List,
     Union,
     Optional,
+    Sequence,
+    Tuple,
     cast,
 )
 from uuid import uuid4
@@ -19,6 +29,14 @@ from qgis.core import (
     QgsExpression,
     QgsExpressionContext,
     QgsExpressionContextUtils,
+    QgsExpressionNode,
+    QgsExpressionNodeBinaryOperator,
+    QgsExpressionNodeColumnRef,
+    QgsExpressionNodeFunction,
+    QgsExpressionNodeInOperator,
+    QgsExpressionNodeLiteral,
+    QgsFeatureRequest,
+    QgsFeedback,
     QgsLayoutExporter,
     QgsLayoutItemLabel,
     QgsLayoutItemMap,
@@ -26,18 +44,33 @@ from qgis.core import (
     QgsProject,
     QgsSettings,
     QgsVectorLayer,
+    QgsVectorSimplifyMethod,
 )
-from qgis.gui import QgsLayerTreeMapCanvasBridge, QgsMapCanvas
-
+from qgis.PyQt.QtCore import QBuffer, QByteArray, QIODevice, QMetaType, QSize
+
+from .cache import OutputCache, fingerprint, page_cache_ttl, project_path
+from .context import project_context
+from .expressions import expression_cache
+from .limiter import LimiterTimeout, Priority, limiter
+from .metrics import phase
+from .spool import spool
+from .parallel import export_chunk, parallel_chunk_size, parallel_workers, reset_executor
+from .parallel import executor as parallel_executor
+from .pdf import HAS_PYPDF, merge_pdf
 from .tools import to_bool
 from . import logger
 
 if TYPE_CHECKING:
+    from concurrent.futures import Future
+
     from qgis.core import (
+        QgsAbstractReportSection,
+        QgsLayout,
         QgsLayoutAtlas,
-        QgsLayoutManager,
         QgsPrintLayout,
+        QgsReport,
     )
+    from qgis.PyQt.QtGui import QImage
 
 
 class OutputFormat(Enum):
@@ -47,10 +80,52 @@ class OutputFormat(Enum):
     Svg = "image/svg"
 
 
+ENV_MAX_PAGES = "QGIS_SERVER_ATLASPRINT_MAX_PAGES"
+DEFAULT_MAX_PAGES = 0
+
+# Custom property of a layout, its own maximum number of pages
+MAX_PAGES_PROPERTY = "atlasprintMaxPages"
+
+# Custom property of a layout, true if its pages do not show their position in the atlas
+PAGE_ANY_POSITION_PROPERTY = "atlasprintPageCacheAnyPosition"
+
+ENV_CACHE_CONTROL = "QGIS_SERVER_ATLASPRINT_CACHE_CONTROL"
+
+# Custom property of a layout, its own `Cache-Control` header
+CACHE_CONTROL_PROPERTY = "atlasprintCacheControl"
+
+# Project variable of the groups of the Lizmap user, an array
+LIZMAP_GROUPS_VARIABLE = "lizmap_user_groups"
+
+
 class AtlasPrintException(Exception):
     """A wrong input from the user."""
 
-    pass
+    # HTTP status code of the response
+    code = 400
+
+
+class AtlasPrintTooLarge(AtlasPrintException):
+    """The document would have more pages than allowed for the layout."""
+
+    code = 413
+
+
+class AtlasPrintBusy(AtlasPrintException):
+    """No slot of the limiter has been released in time."""
+
+    code = 503
+
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        # Seconds before the client should try again
+        self.retry_after = retry_after
+
+
+class AtlasPrintSpoolFull(AtlasPrintException):
+    """The size of the spool directory is above the quota."""
+
+    code = 507
 
 
 def global_scales() -> List[float]:
@@ -98,15 +173,169 @@ def _set_predefined_map_scales(
         reference_map.setAtlasScalingMode(QgsLayoutItemMap.AtlasScalingMode.Predefined)
         settings.predefinedMapScales = scales
     elif reference_map.atlasScalingMode() == QgsLayoutItemMap.AtlasScalingMode.Predefined:
-        use_project = project.viewSettings().useProjectScales()  # type: ignore [union-attr]
-        map_scales = project.viewSettings().mapScales()  # type: ignore [union-attr]
-        if not use_project or len(map_scales) == 0:
-            logger.info(
-                f"Request-ID {request_id}, map scales not found in project, fetching predefined map scales in "
-                f"global config"
-            )
-            map_scales = global_scales()
-        settings.predefinedMapScales = map_scales
+        settings.predefinedMapScales = project_context(project).map_scales
+
+
+def _atlas_expression_context(
+    project: QgsProject,
+    atlas_layout: "QgsPrintLayout",
+    atlas: "QgsLayoutAtlas",
+    layer: QgsVectorLayer,
+) -> QgsExpressionContext:
+    project_cache = project_context(project)
+    context = QgsExpressionContext()
+    context.appendScope(project_cache.global_scope())
+    context.appendScope(project_cache.project_scope())
+    context.appendScope(QgsExpressionContextUtils.layoutScope(atlas_layout))
+    context.appendScope(QgsExpressionContextUtils.atlasScope(atlas))
+    context.appendScope(QgsExpressionContextUtils.layerScope(layer))
+    return context
+
+
+def _set_atlas_filter(
+    request_id: str,
+    project: QgsProject,
+    atlas_layout: "QgsPrintLayout",
+    atlas: "QgsLayoutAtlas",
+    layer: QgsVectorLayer,
+    layout_name: str,
+    feature_filter: Optional[str],
+) -> "OptimizedFilter":
+    if feature_filter is None:
+        raise AtlasPrintException(
+            f"Request-ID {request_id}, EXP_FILTER is mandatory to print an atlas layout `{layout_name}`"
+        )
+
+    optimized = optimize_filter(layer, feature_filter, request_id)
+    if optimized.constant is False:
+        raise AtlasPrintException(
+            f"Request-ID {request_id}, the expression does not match any feature in the layout `{layout_name}`"
+        )
+    feature_filter = optimized.expression
+
+    def expression_context() -> QgsExpressionContext:
+        return _atlas_expression_context(project, atlas_layout, atlas, layer)
+
+    # Parsed and prepared once for the same filter on the same layer of the project
+    expression = expression_cache.prepare(project_path(project), layer, feature_filter, expression_context)
+    if expression.parser_error:
+        raise AtlasPrintException(
+            f"Request-ID {request_id}, expression is invalid, parser error: {expression.parser_error}"
+        )
+    if expression.eval_error:
+        raise AtlasPrintException(
+            f"Request-ID {request_id}, expression is invalid, eval error: {expression.eval_error}"
+        )
+
+    if optimized.constant:
+        # All features, without evaluating the expression for each of them
+        atlas.setFilterFeatures(False)
+    else:
+        atlas.setFilterFeatures(True)
+        atlas.setFilterExpression(feature_filter)
+    return optimized
+
+
+def max_pages(layout: "QgsLayout") -> int:
+    """Maximum number of pages of a document, from the custom property of the layout or from the
+    environment, 0 without any limit."""
+    value = layout.customProperty(MAX_PAGES_PROPERTY)
+    if value is None or value == "":
+        value = os.getenv(ENV_MAX_PAGES, DEFAULT_MAX_PAGES)
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        logger.warning('Invalid maximum number of pages "%s" for the layout `%s`', value, layout.name())
+        return 0
+
+
+def cache_control(project: QgsProject, layout_name: str) -> Optional[str]:
+    """Value of the `Cache-Control` header of the documents of the layout, from the custom property of the
+    layout or from the environment, None without any header."""
+    layout = project_context(project).layout(layout_name)
+    value = layout.customProperty(CACHE_CONTROL_PROPERTY) if layout else None
+    if value is None or value == "":
+        value = os.getenv(ENV_CACHE_CONTROL)
+    return str(value) if value else None
+
+
+def document_etag(project: QgsProject, layout_name: str, key: str) -> Optional[str]:
+    """Strong validator of a document, from the key of the request and the version of the data.
+
+    The version of the data is read from the files of the layers of the maps and of the coverage layer,
+    without rendering anything. None if a layer is not stored in a local file or for a report, the version
+    of the data can not be known.
+    """
+    data_version = project_context(project).layout_data_version(layout_name)
+    if data_version is None:
+        return None
+    return f'"{fingerprint(document=key, data_version=data_version)}"'
+
+
+def _count_atlas_features(
+    project: QgsProject,
+    atlas_layout: "QgsPrintLayout",
+    atlas: "QgsLayoutAtlas",
+    layer: QgsVectorLayer,
+    optimized: "OptimizedFilter",
+    limit: int,
+) -> int:
+    """Number of features matching the filter, up to `limit`, without rendering anything.
+
+    Without any filter, the count is given by the provider. Otherwise, the features are fetched without
+    geometry nor attributes, the provider can compile the filter and stops after `limit` features.
+    """
+    if optimized.constant is False:
+        return 0
+
+    if optimized.constant is True:
+        count = layer.featureCount()
+        if count >= 0:
+            return count
+
+    request = optimized.feature_request()
+    request.setFlags(QgsFeatureRequest.Flag.NoGeometry)
+    request.setNoAttributes()
+    request.setExpressionContext(_atlas_expression_context(project, atlas_layout, atlas, layer))
+    request.setLimit(limit)
+    return sum(1 for _ in layer.getFeatures(request))
+
+
+def _check_atlas_pages(
+    request_id: str,
+    project: QgsProject,
+    atlas_layout: "QgsPrintLayout",
+    atlas: "QgsLayoutAtlas",
+    layer: QgsVectorLayer,
+    optimized: "OptimizedFilter",
+    *,
+    layout_name: str,
+    budget: bool,
+) -> int:
+    """Fail before rendering if the atlas is empty, or if it has more pages than allowed for the layout.
+
+    Return the number of pages, counted up to two pages above the maximum.
+    """
+    limit = max_pages(atlas_layout) if budget else 0
+    pages_per_feature = max(1, atlas_layout.pageCollection().pageCount())
+    # One more feature than allowed is enough to know the budget is exceeded, two to know if the document
+    # has a single page
+    features = max(2, limit // pages_per_feature + 1 if limit else 0)
+
+    with phase("count"):
+        count = _count_atlas_features(project, atlas_layout, atlas, layer, optimized, features)
+    logger.debug("Request-ID %s, %s features counted, up to %s", request_id, count, features)
+
+    if count == 0:
+        raise AtlasPrintException(
+            f"Request-ID {request_id}, the filter does not match any feature in the layout `{layout_name}`"
+        )
+    if limit and count * pages_per_feature > limit:
+        raise AtlasPrintTooLarge(
+            f"Request-ID {request_id}, the document would have more than {limit} pages, the maximum for "
+            f"the layout `{layout_name}`, use a more selective filter"
+        )
+    return count * pages_per_feature
 
 
 def _prepare_atlas_layout(
@@ -119,8 +348,14 @@ def _prepare_atlas_layout(
     feature_filter: Optional[str],
     scales: Optional[list[float]],
     scale: Optional[int],
+    feature_ids: Optional[List[int]] = None,
+    budget: bool = True,
     **additional_params,
-) -> "QgsLayoutAtlas":
+) -> Tuple["QgsLayoutAtlas", int]:
+    """Set the filter, the scales and the labels of the request in the atlas.
+
+    Return the atlas and its number of pages, see `_check_atlas_pages`.
+    """
     atlas: "QgsLayoutAtlas" = atlas_layout.atlas()  # type: ignore [assignment]
     if not atlas.enabled():
         raise AtlasPrintException(
@@ -129,33 +364,34 @@ def _prepare_atlas_layout(
 
     layer: "QgsVectorLayer" = atlas.coverageLayer()  # type: ignore [assignment]
 
-    if feature_filter is None:
-        raise AtlasPrintException(
-            f"Request-ID {request_id}, EXP_FILTER is mandatory to print an atlas layout `{layout_name}`"
-        )
-
-    feature_filter = optimize_expression(layer, feature_filter, request_id)
-
-    expression = QgsExpression(feature_filter)
-    if expression.hasParserError():
-        raise AtlasPrintException(
-            f"Request-ID {request_id}, expression is invalid, parser error: {expression.parserErrorString()}"
-        )
-
-    context = QgsExpressionContext()
-    context.appendScope(QgsExpressionContextUtils.globalScope())
-    context.appendScope(QgsExpressionContextUtils.projectScope(project))
-    context.appendScope(QgsExpressionContextUtils.layoutScope(atlas_layout))
-    context.appendScope(QgsExpressionContextUtils.atlasScope(atlas))
-    context.appendScope(QgsExpressionContextUtils.layerScope(layer))
-    expression.prepare(context)
-    if expression.hasEvalError():
-        raise AtlasPrintException(
-            f"Request-ID {request_id}, expression is invalid, eval error: {expression.evalErrorString()}"
-        )
+    with phase("filter"):
+        if feature_ids:
+            # No user expression to parse nor to validate, but the atlas API only filters with an
+            # expression: it runs in the provider on an integer primary key, on each feature otherwise.
+            optimized = feature_ids_filter(layer, feature_ids)
+            logger.debug("Request-ID %s, printing the feature IDs %s", request_id, feature_ids)
+            atlas.setFilterFeatures(True)
+            atlas.setFilterExpression(optimized.expression)
+            if len(feature_ids) > 1:
+                # Keep the order given in the request, evaluated on the filtered features only
+                atlas.setSortFeatures(True)
+                atlas.setSortAscending(True)
+                atlas.setSortExpression(f"array_find(array({', '.join(str(i) for i in feature_ids)}), $id)")
+        else:
+            optimized = _set_atlas_filter(
+                request_id, project, atlas_layout, atlas, layer, layout_name, feature_filter
+            )
 
-    atlas.setFilterFeatures(True)
-    atlas.setFilterExpression(feature_filter)
+    pages = _check_atlas_pages(
+        request_id,
+        project,
+        atlas_layout,
+        atlas,
+        layer,
+        optimized,
+        layout_name=layout_name,
+        budget=budget,
+    )
 
     # Predefined map scales
     if reference_map := atlas_layout.referenceMap():
@@ -168,26 +404,153 @@ def _prepare_atlas_layout(
             scale=scale,
         )
 
-    logger.info(
-        f"Request-ID {request_id}, checking for additional parameters to set in the layout before printing…"
+    logger.debug(
+        "Request-ID %s, checking for additional parameters to set in the layout before printing…", request_id
     )
     for key, value in additional_params.items():
         found = False
         item = atlas_layout.itemById(key.lower())
         if isinstance(item, QgsLayoutItemLabel):
             item.setText(value)
-            logger.info(
-                f'Request-ID {request_id}, additional parameter "{key.lower()}" found in the layout, '
-                f'setting the value to "{value}"'
+            logger.debug(
+                'Request-ID %s, additional parameter "%s" found in the layout, setting the value to "%s"',
+                request_id,
+                key.lower(),
+                value,
             )
         if not found:
             logger.info(
-                f'Additional parameter "{key.lower()}" has not been found in the layout, the value was "{value}", '
-                f"skipping"
+                'Request-ID %s, additional parameter "%s" has not been found in the layout, '
+                'the value was "%s", skipping',
+                request_id,
+                key.lower(),
+                value,
             )
-    logger.info(f"Request-ID {request_id}, end of additional parameters")
+    logger.debug("Request-ID %s, end of additional parameters", request_id)
+
+    return atlas, pages
+
+
+def _prepare_layout(
+    project: QgsProject,
+    layout_name: str,
+    output_format: OutputFormat,
+    feature_filter: Optional[str],
+    scales: Optional[list],
+    scale: Optional[int],
+    request_id: str,
+    feature_ids: Optional[List[int]] = None,
+    variables: Optional[Dict[str, str]] = None,
+    budget: bool = True,
+    **additional_params,
+) -> Tuple[
+    ExportSettings,
+    Optional["QgsLayoutAtlas"],
+    Optional["QgsPrintLayout"],
+    Optional["QgsMasterLayoutInterface"],
+    int,
+]:
+    """Find the layout and prepare it with the export settings for the output format.
+
+    With `budget`, the number of pages of an atlas is checked against the maximum of the layout. The number
+    of pages returned is 0 if it is not known, for a report.
+    """
+    project_cache = project_context(project)
+
+    master_layout: Optional[QgsMasterLayoutInterface] = project_cache.layout(layout_name)
+    if not master_layout:
+        raise AtlasPrintException(f"Request-ID {request_id}, layout `{layout_name}` not found")
+
+    logger.debug('Request-ID %s, preparing settings for the output format "%s"', request_id, output_format)
+    if output_format == OutputFormat.Svg:
+        settings: "QgsLayoutExporter.SvgExportSettings" = QgsLayoutExporter.SvgExportSettings()
+    elif output_format in (OutputFormat.Png, OutputFormat.Jpeg):
+        settings: "QgsLayoutExporter.ImageExportSettings" = QgsLayoutExporter.ImageExportSettings()  # type: ignore [no-redef]
+    else:
+        # PDF by default
+        settings: "QgsLayoutExporter.PdfExportSettings" = QgsLayoutExporter.PdfExportSettings()  # type: ignore [no-redef]
+
+    # Set DPI to 100
+    settings.dpi = 100
+
+    atlas: Optional["QgsLayoutAtlas"] = None
+    atlas_layout: Optional["QgsPrintLayout"] = None
+    report_layout: Optional["QgsMasterLayoutInterface"] = None
+    pages = 0
+
+    if master_layout.layoutType() == QgsMasterLayoutInterface.Type.PrintLayout:
+        # The layout is modified below, work on a private clone, not on the layout of the project
+        with phase("layout"):
+            atlas_layout = project_cache.layout_clone(layout_name)
+        if not atlas_layout:
+            raise AtlasPrintException(f"Request-ID {request_id}, layout `{layout_name}` not found")
+        # In the layout scope of the private clone, before validating the filter
+        _set_layout_variables(atlas_layout, variables)
+        atlas, pages = _prepare_atlas_layout(
+            request_id,
+            project,
+            atlas_layout,
+            settings=settings,
+            layout_name=layout_name,
+            feature_filter=feature_filter,
+            scales=scales,
+            scale=scale,
+            feature_ids=feature_ids,
+            budget=budget,
+            **additional_params,
+        )
+    elif master_layout.layoutType() == QgsMasterLayoutInterface.Type.Report:
+        report_layout = master_layout
+        if variables:
+            # The report of the project is not modified
+            report_layout = master_layout.clone()
+            _set_report_variables(cast("QgsReport", report_layout), variables)
+    else:
+        raise AtlasPrintException(f"Request-ID {request_id}, the layout is not supported by the plugin")
+
+    return settings, atlas, atlas_layout, report_layout, pages
+
+
+@contextmanager
+def lizmap_groups(project: QgsProject, groups: Sequence[str]) -> Iterator[None]:
+    """Set `@lizmap_user_groups` in the project scope while printing, an empty array for an anonymous user.
+
+    Layout variables can only hold text, the groups are an array as used by the expressions of the
+    templates. The project variables are restored afterwards, and not modified if they already hold
+    these groups.
+    """
+    custom_variables = project.customVariables()
+    if custom_variables.get(LIZMAP_GROUPS_VARIABLE) == list(groups):
+        yield
+        return
+
+    # QGIS can't store a tuple
+    project.setCustomVariables({**custom_variables, LIZMAP_GROUPS_VARIABLE: list(groups)})  # type: ignore [arg-type]
+    try:
+        yield
+    finally:
+        project.setCustomVariables(custom_variables)  # type: ignore [arg-type]
 
-    return atlas
+
+def project_variables(project: QgsProject) -> Dict[str, Any]:
+    """The Lizmap variables of the project scope, for a worker process or a job."""
+    return {LIZMAP_GROUPS_VARIABLE: project.customVariables().get(LIZMAP_GROUPS_VARIABLE, [])}
+
+
+def _set_layout_variables(layout: "QgsLayout", variables: Optional[Dict[str, str]]) -> None:
+    """Set the variables of the request in the layout scope, the project is not modified."""
+    for name, value in (variables or {}).items():
+        QgsExpressionContextUtils.setLayoutVariable(layout, name, value)
+
+
+def _set_report_variables(section: "QgsAbstractReportSection", variables: Dict[str, str]) -> None:
+    """Set the variables of the request in the layouts of the report sections."""
+    body = getattr(section, "body", None)
+    for layout in (section.header(), body() if body else None, section.footer()):
+        if layout:
+            _set_layout_variables(layout, variables)
+    for child in section.childSections():
+        _set_report_variables(child, variables)
 
 
 def print_layout(
@@ -198,6 +561,12 @@ def print_layout(
     scales: Optional[list] = None,
     scale: Optional[int] = None,
     request_id: str = "",
+    feature_ids: Optional[List[int]] = None,
+    page_cache: Optional[OutputCache] = None,
+    workers: int = 0,
+    progress: Optional[Callable[[int, int], None]] = None,
+    variables: Optional[Dict[str, str]] = None,
+    limited: bool = True,
     **additional_params,
 ) -> Path:
     """Generate a PDF for an atlas or a report.
@@ -224,141 +593,663 @@ def print_layout(
 
     :param request_id: The X-Request-ID for a better debug.
 
+    :param feature_ids: IDs of the features to print, in this order, instead of `feature_filter`.
+    :type feature_ids: list
+
+    :param variables: Variables of the request, such as `lizmap_user`, set in the layout scope of a
+    private clone of the layout. The project is not modified.
+    :type variables: dict
+
+    :param page_cache: Cache of single feature PDF documents, to assemble an atlas from the features
+    already rendered by previous requests. Only for atlases exported as PDF.
+
+    :param workers: Number of worker processes to export an atlas as PDF in chunks of features,
+    0 to export in the current process.
+    :type workers: int
+
+    :param progress: Called with the number of pages done and the total number of pages,
+    while exporting as PDF.
+
+    :param limited: Wait for a slot of the limiter of the node before exporting. False for the chunks
+    exported by worker processes, the slot is held by the parent process.
+    :type limited: bool
+
     :return: Path to the PDF.
     :rtype: basestring
     """
+    settings, atlas, atlas_layout, report_layout, pages = _prepare_layout(
+        project,
+        layout_name,
+        output_format,
+        feature_filter,
+        scales,
+        scale,
+        request_id,
+        feature_ids=feature_ids,
+        variables=variables,
+        **additional_params,
+    )
 
-    canvas = QgsMapCanvas()
-    bridge = QgsLayerTreeMapCanvasBridge(project.layerTreeRoot(), canvas)
-    bridge.setCanvasLayers()
-    manager: Optional["QgsLayoutManager"] = project.layoutManager()
-    if not manager:
-        raise AtlasPrintException("No layout manager defined")
+    if spool.full():
+        raise AtlasPrintSpoolFull(f"Request-ID {request_id}, the spool directory is full, try again later")
+    file_name = f"{clean_string(layout_name)}_{uuid4()}.{output_format.name.lower()}"
+    export_path = spool.path(file_name)
 
-    master_layout: Optional[QgsMasterLayoutInterface] = manager.layoutByName(layout_name)
-    if not master_layout:
-        raise AtlasPrintException(f"Request-ID {request_id}, layout `{layout_name}` not found")
+    logger.info(
+        "Request-ID %s, exporting the request in %s using %s", request_id, export_path, output_format.value
+    )
 
-    logger.debug(f'Request-ID {request_id}, preparing settings for the output format "{output_format}"')
-    if output_format == OutputFormat.Svg:
-        settings: "QgsLayoutExporter.SvgExportSettings" = QgsLayoutExporter.SvgExportSettings()
-    elif output_format in (OutputFormat.Png, OutputFormat.Jpeg):
-        settings: "QgsLayoutExporter.ImageExportSettings" = QgsLayoutExporter.ImageExportSettings()  # type: ignore [no-redef]
-    else:
-        # PDF by default
-        settings: "QgsLayoutExporter.PdfExportSettings" = QgsLayoutExporter.PdfExportSettings()  # type: ignore [no-redef]
+    feedback = None
+    total = 1
+    if progress:
+        if atlas:
+            total = atlas.updateFeatures()
+        feedback = QgsFeedback()
+        feedback.progressChanged.connect(lambda percent: progress(int(percent * total / 100), total))
+        progress(0, total)
+
+    priority = Priority.Interactive if pages == 1 else Priority.Bulk
+    with _export_slot(priority, request_id, limited), phase("export"):
+        if output_format in (OutputFormat.Png, OutputFormat.Jpeg):
+            exporter = QgsLayoutExporter(atlas_layout or report_layout)  # type: ignore [arg-type]
+            result = exporter.exportToImage(str(export_path), settings)  # type: ignore [arg-type]
+            error = result_message(result)
+        elif output_format in (OutputFormat.Svg,):
+            exporter = QgsLayoutExporter(atlas_layout or report_layout)  # type: ignore [arg-type]
+            result = exporter.exportToSvg(str(export_path), settings)
+            error = result_message(result)
+        else:
+            # Default to PDF
+            # PDF settings
+            if atlas_layout:
+                settings = cast("QgsLayoutExporter.PdfExportSettings", settings)  # type: ignore
+
+                # Read once from the custom properties of the layout
+                for option, value in project_context(project).pdf_export_options(atlas_layout).items():
+                    setattr(settings, option, value)
+                logger.debug("Request-ID %s, rasterize = %s", request_id, settings.rasterizeWholeImage)  # type: ignore
+            # Export
+            atlas_feature_ids: List[int] = []
+            if (
+                atlas
+                and atlas_layout
+                and workers > 0
+                and HAS_PYPDF
+                and Path(project.fileName()).is_file()
+                # Seeking through the atlas is only worth it if the features do not fit in one chunk
+                and atlas.updateFeatures() > parallel_chunk_size()
+            ):
+                atlas_feature_ids = _atlas_feature_ids(atlas, atlas_layout)
+
+            if len(atlas_feature_ids) > parallel_chunk_size():
+                result = _export_atlas_parallel(
+                    project,
+                    layout_name,
+                    atlas_feature_ids,
+                    export_path,
+                    scales=scales,
+                    scale=scale,
+                    request_id=request_id,
+                    feedback=feedback,
+                    variables=variables,
+                    limited=limited,
+                    **additional_params,
+                )
+            elif atlas and atlas_layout and page_cache is not None:
+                page_key = {
+                    "project": project.fileName(),
+                    "project_modified": project.lastModified().toMSecsSinceEpoch(),
+                    "layout": layout_name,
+                    "scale": scale,
+                    "scales": scales,
+                    "params": additional_params,
+                    "variables": variables,
+                    "project_variables": project_variables(project),
+                    "data_version": project_context(project).layout_data_version(layout_name),
+                }
+                if page_key["data_version"] is None:
+                    # Pages can not be invalidated when the data changes, keep them for a limited time
+                    page_key["data_version"] = int(time.time() // page_cache_ttl())
+                result = _export_atlas_pages(
+                    atlas,
+                    atlas_layout,
+                    cast("QgsLayoutExporter.PdfExportSettings", settings),
+                    export_path,
+                    page_cache,
+                    page_key,
+                    request_id,
+                    feedback,
+                )
+            else:
+                # TODO: check out the typing error
+                result, error = QgsLayoutExporter.exportToPdf(  # type: ignore [call-overload]
+                    atlas or report_layout,
+                    str(export_path),
+                    settings,
+                    feedback,
+                )
+                # Let's override error message
+                _ = error
+            error = result_message(result)
 
-    # Set DPI to 100
-    settings.dpi = 100
+    logger.info("Request-ID %s, export done, result %s", request_id, result_message(result))
 
-    atlas: Optional["QgsLayoutAtlas"] = None
-    atlas_layout: Optional["QgsPrintLayout"] = None
-    report_layout: Optional["QgsMasterLayoutInterface"] = None
+    if progress and result == QgsLayoutExporter.ExportResult.Success:
+        progress(total, total)
 
-    if master_layout.layoutType() == QgsMasterLayoutInterface.Type.PrintLayout:
-        for pr_layout in manager.printLayouts():
-            if pr_layout.name() == layout_name:
-                atlas_layout = pr_layout
-                atlas = _prepare_atlas_layout(
-                    request_id,
+    if result != QgsLayoutExporter.ExportResult.Success:
+        # A partial document
+        export_path.unlink(missing_ok=True)
+        raise AtlasPrintException(
+            f"Request-ID {request_id}, export not generated in QGIS exporter {export_path} : {error}"
+        )
+
+    if not export_path.is_file():
+        logger.warning(
+            "Request-ID %s, \nNo error from QGIS Exporter, but the file does not exist.\n"
+            "Message from QGIS exporter : %s\nFile path : %s\n",
+            request_id,
+            error,
+            export_path,
+        )
+        raise AtlasPrintException(
+            f"Export OK from QGIS, but file not found on the file system : {export_path}"
+        )
+
+    return export_path
+
+
+def _atlas_feature_ids(atlas: "QgsLayoutAtlas", atlas_layout: "QgsPrintLayout") -> List[int]:
+    """IDs of the features of the atlas, in the atlas order."""
+    feature_ids: List[int] = []
+    if not atlas.beginRender():
+        return feature_ids
+    try:
+        for number in range(atlas.count()):
+            if atlas.seekTo(number):
+                feature_ids.append(atlas_layout.reportContext().feature().id())
+    finally:
+        atlas.endRender()
+    return feature_ids
+
+
+def _export_atlas_parallel(
+    project: QgsProject,
+    layout_name: str,
+    feature_ids: List[int],
+    export_path: Path,
+    *,
+    scales: Optional[list],
+    scale: Optional[int],
+    request_id: str,
+    feedback: Optional[QgsFeedback] = None,
+    variables: Optional[Dict[str, str]] = None,
+    limited: bool = True,
+    **additional_params,
+) -> QgsLayoutExporter.ExportResult:
+    """Export the atlas in chunks of features, in the worker processes, then assemble the chunks.
+
+    The slot of the request is held by `print_layout`, each other chunk running at once needs its own
+    bulk slot. If a worker process crashed, the pool is started again and the export is retried once.
+    """
+    chunk_size = parallel_chunk_size()
+    chunks = [feature_ids[i : i + chunk_size] for i in range(0, len(feature_ids), chunk_size)]
+
+    slots: List[BinaryIO] = []
+    running = min(parallel_workers(), len(chunks))
+    if limited and limiter.enabled(Priority.Bulk):
+        while len(slots) < running - 1:
+            slot = limiter.try_acquire(Priority.Bulk)
+            if not slot:
+                break
+            slots.append(slot)
+        running = len(slots) + 1
+    logger.info(
+        "Request-ID %s, exporting %s features in %s chunks with %s worker processes",
+        request_id,
+        len(feature_ids),
+        len(chunks),
+        running,
+    )
+
+    try:
+        for attempt in range(2):
+            try:
+                return _export_chunks(
                     project,
-                    pr_layout,
-                    settings=settings,
-                    layout_name=layout_name,
-                    feature_filter=feature_filter,
+                    layout_name,
+                    chunks,
+                    running,
+                    export_path,
                     scales=scales,
                     scale=scale,
-                    **additional_params,
+                    request_id=request_id,
+                    feedback=feedback,
+                    variables=variables or {},
+                    project_variables=project_variables(project),
+                    additional_params=additional_params,
                 )
-                break
-        else:
-            logger.warning(f"No layout found for {layout_name}")
+            except BrokenProcessPool:
+                # A worker process has crashed, every other call to the pool would fail
+                reset_executor()
+                logger.critical(
+                    "Request-ID %s, a worker process has crashed, attempt %s of the export",
+                    request_id,
+                    attempt + 1,
+                )
+        raise RuntimeError(f"Request-ID {request_id}, worker processes crashed while exporting the atlas")
+    finally:
+        for slot in slots:
+            slot.close()
 
-    elif master_layout.layoutType() == QgsMasterLayoutInterface.Type.Report:
-        report_layout = master_layout
-    else:
-        raise AtlasPrintException(f"Request-ID {request_id}, the layout is not supported by the plugin")
 
-    file_name = f"{clean_string(layout_name)}_{uuid4()}.{output_format.name.lower()}"
-    export_path = Path(tempfile.gettempdir()).joinpath(file_name)
+def _export_chunks(
+    project: QgsProject,
+    layout_name: str,
+    chunks: List[List[int]],
+    running: int,
+    export_path: Path,
+    *,
+    scales: Optional[list],
+    scale: Optional[int],
+    request_id: str,
+    feedback: Optional[QgsFeedback],
+    variables: Dict[str, str],
+    project_variables: Dict[str, Any],
+    additional_params: Dict[str, Any],
+) -> QgsLayoutExporter.ExportResult:
+    """Export the chunks, at most `running` at once, and assemble them in this order."""
+
+    def submit(chunk: List[int]) -> "Future[str]":
+        return parallel_executor().submit(
+            export_chunk,
+            project.fileName(),
+            layout_name,
+            chunk,
+            scales,
+            scale,
+            variables,
+            project_variables,
+            request_id,
+            additional_params,
+        )
 
-    logger.info(
-        f"Request-ID {request_id}, exporting the request in {export_path} using {output_format.value}"
+    futures = [submit(chunk) for chunk in chunks[:running]]
+    parts: List[Path] = []
+    try:
+        for number in range(len(chunks)):
+            # In the order of the chunks
+            parts.append(Path(futures[number].result()))
+            if len(futures) < len(chunks):
+                futures.append(submit(chunks[len(futures)]))
+            if feedback:
+                feedback.setProgress(100 * len(parts) / len(chunks))
+        merge_pdf(parts, export_path)
+    except (AtlasPrintException, BrokenProcessPool):
+        raise
+    except Exception as e:
+        logger.critical("Request-ID %s, error in a worker process: %s", request_id, e)
+        return QgsLayoutExporter.ExportResult.PrintError
+    finally:
+        for future in futures:
+            future.cancel()
+        for part in parts:
+            part.unlink(missing_ok=True)
+
+    return QgsLayoutExporter.ExportResult.Success
+
+
+def _export_atlas_pages(
+    atlas: "QgsLayoutAtlas",
+    atlas_layout: "QgsPrintLayout",
+    settings: "QgsLayoutExporter.PdfExportSettings",
+    export_path: Path,
+    page_cache: OutputCache,
+    page_key: Dict[str, Any],
+    request_id: str,
+    feedback: Optional[QgsFeedback] = None,
+) -> QgsLayoutExporter.ExportResult:
+    """Export the atlas feature by feature, reusing the features found in the cache.
+
+    A page showing its position, `@atlas_featurenumber` or `@atlas_totalfeatures`, is only reused at the
+    same position in an atlas of the same size, unless the layout allows any position.
+    """
+    if not atlas.beginRender():
+        return QgsLayoutExporter.ExportResult.IteratorError
+
+    any_position = to_bool(atlas_layout.customProperty(PAGE_ANY_POSITION_PROPERTY))
+    exporter = QgsLayoutExporter(atlas_layout)
+    rendered: List[Path] = []
+    parts: List[BinaryIO] = []
+    try:
+        for number in range(atlas.count()):
+            if feedback:
+                feedback.setProgress(100 * number / atlas.count())
+            if not atlas.seekTo(number):
+                return QgsLayoutExporter.ExportResult.IteratorError
+
+            feature_id = atlas_layout.reportContext().feature().id()
+            position = {} if any_position else {"number": number, "total": atlas.count()}
+            key = fingerprint(feature_id=feature_id, **position, **page_key)
+            cached = page_cache.get(key)
+            if isinstance(cached, Path):
+                try:
+                    # Keep the file open, even if it is evicted by another process in the meantime
+                    parts.append(cached.open("rb"))
+                    continue
+                except OSError:
+                    pass
+
+            page_path = export_path.with_name(f"{export_path.stem}_{number}.pdf")
+            rendered.append(page_path)
+            result = exporter.exportToPdf(str(page_path), settings)
+            if result != QgsLayoutExporter.ExportResult.Success:
+                return result
+            page_cache.put(key, page_path)
+            parts.append(page_path.open("rb"))
+
+        logger.info(
+            "Request-ID %s, %s features rendered, %s features from the cache of pages",
+            request_id,
+            len(rendered),
+            len(parts) - len(rendered),
+        )
+        merge_pdf(parts, export_path)
+    finally:
+        atlas.endRender()
+        for part in parts:
+            part.close()
+        for page_path in rendered:
+            page_path.unlink(missing_ok=True)
+
+    return QgsLayoutExporter.ExportResult.Success
+
+
+def print_layout_image(
+    project: QgsProject,
+    layout_name: str,
+    output_format: OutputFormat,
+    feature_filter: Optional[str] = None,
+    scales: Optional[list] = None,
+    scale: Optional[int] = None,
+    request_id: str = "",
+    feature_ids: Optional[List[int]] = None,
+    variables: Optional[Dict[str, str]] = None,
+    **additional_params,
+) -> bytes:
+    """Render the first page of the first feature of the atlas as PNG or JPEG, in memory.
+
+    Same parameters as `print_layout`, but the image is encoded in a buffer, without any temporary file.
+
+    :return: The encoded image.
+    :rtype: bytes
+    """
+    if output_format not in (OutputFormat.Png, OutputFormat.Jpeg):
+        raise AtlasPrintException(f"Request-ID {request_id}, {output_format.name} is not a raster format")
+
+    settings, atlas, atlas_layout, _, _ = _prepare_layout(
+        project,
+        layout_name,
+        output_format,
+        feature_filter,
+        scales,
+        scale,
+        request_id,
+        feature_ids=feature_ids,
+        variables=variables,
+        # Only the first page is rendered
+        budget=False,
+        **additional_params,
     )
+    if not atlas or not atlas_layout:
+        raise AtlasPrintException(f"Request-ID {request_id}, only print layouts can be exported as an image")
 
-    if output_format in (OutputFormat.Png, OutputFormat.Jpeg):
-        exporter = QgsLayoutExporter(atlas_layout or report_layout)  # type: ignore [arg-type]
-        result = exporter.exportToImage(str(export_path), settings)  # type: ignore [arg-type]
-        error = result_message(result)
-    elif output_format in (OutputFormat.Svg,):
-        exporter = QgsLayoutExporter(atlas_layout or report_layout)  # type: ignore [arg-type]
-        result = exporter.exportToSvg(str(export_path), settings)
-        error = result_message(result)
-    else:
-        # Default to PDF
-        # PDF settings
-        if atlas_layout:
-            settings = cast("QgsLayoutExporter.PdfExportSettings", settings)  # type: ignore
+    settings = cast("QgsLayoutExporter.ImageExportSettings", settings)
 
-            TextRenderFormat = Qgis.TextRenderFormat
+    logger.info("Request-ID %s, rendering the first page in memory using %s", request_id, output_format.value)
 
-            settings.forceVectorOutput = to_bool(
-                atlas_layout.customProperty("forceVector", False),
-            )
-            settings.exportMetadata = to_bool(
-                atlas_layout.customProperty("pdfIncludeMetadata", False),
+    _set_image_render_context(atlas_layout, settings)
+    # The first feature of the filter, with its extent and its scale
+    if not atlas.beginRender():
+        raise AtlasPrintException(f"Request-ID {request_id}, the atlas `{layout_name}` can not be rendered")
+    try:
+        if atlas.count() == 0 or not atlas.seekTo(0):
+            raise AtlasPrintException(
+                f"Request-ID {request_id}, the expression does not match any feature in the layout `{layout_name}`"
             )
-            intTextRenderFormat = int(
-                atlas_layout.customProperty(
-                    "pdfTextFormat",
-                    int(TextRenderFormat.AlwaysText),
-                )
-            )
-            textRenderFormatValues = {
-                int(TextRenderFormat.AlwaysText): TextRenderFormat.AlwaysText,
-                int(TextRenderFormat.AlwaysOutlines): TextRenderFormat.AlwaysOutlines,
-            }
-            settings.textRenderFormat = textRenderFormatValues.get(
-                intTextRenderFormat, TextRenderFormat.AlwaysText
-            )
-            settings.simplifyGeometries = to_bool(
-                atlas_layout.customProperty("pdfSimplify", False),
-            )
-            # NOTE: Why mypy ignore settings redefinition above ?
-            settings.rasterizeWholeImage = to_bool(  # type: ignore [attr-defined]
-                atlas_layout.customProperty("rasterize", False),
-            )
-            logger.info(f"Request-ID {request_id}, rasterize = {settings.rasterizeWholeImage}")  # type: ignore
-        # Export
-        # TODO: check out the typing error
-        result, error = QgsLayoutExporter.exportToPdf(  # type: ignore [call-overload]
-            atlas or report_layout,
-            str(export_path),
-            settings,
+        with _export_slot(Priority.Interactive, request_id), phase("render"):
+            image = QgsLayoutExporter(atlas_layout).renderPageToImage(0, settings.imageSize, settings.dpi)
+    finally:
+        atlas.endRender()
+
+    if image.isNull():
+        raise AtlasPrintException(
+            f"Request-ID {request_id}, the layout `{layout_name}` has no page to render"
         )
-        # Let's override error message
-        _ = error
-        error = result_message(result)
 
-    logger.info(f"Request-ID {request_id}, export done, result {result_message(result)}")
+    with phase("encode"):
+        data = _encode_image(image, output_format, request_id)
+    logger.info("Request-ID %s, rendering done, %s bytes", request_id, len(data))
+    return data
 
-    if result != QgsLayoutExporter.ExportResult.Success:
+
+def print_layout_preview(
+    project: QgsProject,
+    layout_name: str,
+    width: int,
+    output_format: OutputFormat = OutputFormat.Png,
+    feature_filter: Optional[str] = None,
+    request_id: str = "",
+    feature_ids: Optional[List[int]] = None,
+    variables: Optional[Dict[str, str]] = None,
+    **additional_params,
+) -> bytes:
+    """Render the first page of the first feature of the atlas as a small image, in memory.
+
+    The resolution is computed for the width in pixels, the layout is rendered without antialiasing,
+    without advanced effects and with simplified geometries.
+
+    :return: The encoded image.
+    :rtype: bytes
+    """
+    if output_format not in (OutputFormat.Png, OutputFormat.Jpeg):
+        raise AtlasPrintException(f"Request-ID {request_id}, {output_format.name} is not a raster format")
+
+    settings, atlas, atlas_layout, _, _ = _prepare_layout(
+        project,
+        layout_name,
+        output_format,
+        feature_filter,
+        None,
+        None,
+        request_id,
+        feature_ids=feature_ids,
+        variables=variables,
+        # Only the first page is rendered
+        budget=False,
+        **additional_params,
+    )
+    if not atlas or not atlas_layout:
+        raise AtlasPrintException(f"Request-ID {request_id}, only print layouts can be previewed")
+
+    page = atlas_layout.pageCollection().page(0)
+    if not page:
         raise AtlasPrintException(
-            f"Request-ID {request_id}, export not generated in QGIS exporter {export_path} : {error}"
+            f"Request-ID {request_id}, the layout `{layout_name}` has no page to render"
         )
+    page_width = (
+        atlas_layout.renderContext()
+        .measurementConverter()
+        .convert(page.sizeWithUnits(), Qgis.LayoutUnit.Inches)
+    )
+    dpi = width / page_width.width()
+
+    # Fast rendering, the layout is a clone
+    context = atlas_layout.renderContext()
+    context.setFlag(Qgis.LayoutRenderFlag.Antialiasing, False)
+    context.setFlag(Qgis.LayoutRenderFlag.UseAdvancedEffects, False)
+    simplify = QgsVectorSimplifyMethod()
+    simplify.setSimplifyHints(Qgis.VectorRenderingSimplificationFlag.GeometrySimplification)
+    simplify.setThreshold(1)
+    context.setSimplifyMethod(simplify)
+    context.setPredefinedScales(settings.predefinedMapScales)
+
+    if not atlas.beginRender():
+        raise AtlasPrintException(f"Request-ID {request_id}, the atlas `{layout_name}` can not be rendered")
+    try:
+        if atlas.count() == 0 or not atlas.seekTo(0):
+            raise AtlasPrintException(
+                f"Request-ID {request_id}, the expression does not match any feature in the layout `{layout_name}`"
+            )
+        with _export_slot(Priority.Interactive, request_id), phase("render"):
+            image = QgsLayoutExporter(atlas_layout).renderPageToImage(0, QSize(), dpi)
+    finally:
+        atlas.endRender()
 
-    if not export_path.is_file():
-        logger.warning(
-            f"Request-ID {request_id}, \n"
-            f"No error from QGIS Exporter, but the file does not exist.\n"
-            f"Message from QGIS exporter : {error}\n"
-            f"File path : {export_path}\n"
-        )
+    if image.isNull():
         raise AtlasPrintException(
-            f"Export OK from QGIS, but file not found on the file system : {export_path}"
+            f"Request-ID {request_id}, the layout `{layout_name}` has no page to render"
+        )
+
+    with phase("encode"):
+        data = _encode_image(image, output_format, request_id)
+    logger.info(
+        "Request-ID %s, preview of %sx%s pixels, %s bytes",
+        request_id,
+        image.width(),
+        image.height(),
+        len(data),
+    )
+    return data
+
+
+def print_layout_images(
+    project: QgsProject,
+    layout_name: str,
+    output_format: OutputFormat,
+    feature_filter: Optional[str] = None,
+    scales: Optional[list] = None,
+    scale: Optional[int] = None,
+    request_id: str = "",
+    feature_ids: Optional[List[int]] = None,
+    variables: Optional[Dict[str, str]] = None,
+    **additional_params,
+) -> Iterator[Tuple[str, bytes]]:
+    """Render every page of every feature of the atlas as PNG or JPEG, in memory.
+
+    Same parameters as `print_layout`. The layout is prepared and a slot of the limiter is taken at once,
+    errors are raised before the first image. The images are then rendered one by one while iterating, only
+    one image is kept in memory. The slot is released when the iterator is exhausted or closed.
+
+    :return: Iterator of file names and encoded images.
+    """
+    if output_format not in (OutputFormat.Png, OutputFormat.Jpeg):
+        raise AtlasPrintException(f"Request-ID {request_id}, {output_format.name} is not a raster format")
+
+    settings, atlas, atlas_layout, _, pages = _prepare_layout(
+        project,
+        layout_name,
+        output_format,
+        feature_filter,
+        scales,
+        scale,
+        request_id,
+        feature_ids=feature_ids,
+        variables=variables,
+        **additional_params,
+    )
+    if not atlas or not atlas_layout:
+        raise AtlasPrintException(f"Request-ID {request_id}, only print layouts can be exported as an image")
+
+    settings = cast("QgsLayoutExporter.ImageExportSettings", settings)
+    _set_image_render_context(atlas_layout, settings)
+    slot = _acquire_slot(Priority.Interactive if pages == 1 else Priority.Bulk, request_id)
+    return _atlas_images(atlas, atlas_layout, settings, layout_name, output_format, request_id, slot)
+
+
+def _atlas_images(
+    atlas: "QgsLayoutAtlas",
+    atlas_layout: "QgsPrintLayout",
+    settings: "QgsLayoutExporter.ImageExportSettings",
+    layout_name: str,
+    output_format: OutputFormat,
+    request_id: str,
+    slot: Optional[BinaryIO],
+) -> Iterator[Tuple[str, bytes]]:
+    if not atlas.beginRender():
+        if slot:
+            slot.close()
+        raise AtlasPrintException(f"Request-ID {request_id}, the atlas `{layout_name}` can not be rendered")
+
+    exporter = QgsLayoutExporter(atlas_layout)
+    extension = "jpg" if output_format == OutputFormat.Jpeg else "png"
+    try:
+        count = atlas.count()
+        logger.info(
+            "Request-ID %s, rendering %s features in memory using %s", request_id, count, output_format.value
+        )
+        for number in range(count):
+            if not atlas.seekTo(number):
+                raise AtlasPrintException(
+                    f"Request-ID {request_id}, the feature {number} can not be rendered"
+                )
+
+            # The atlas file name expression, numbered to keep the names unique
+            name = f"{number + 1:04d}_{clean_string(atlas.currentFilename() or layout_name)}"
+            page_count = atlas_layout.pageCollection().pageCount()
+            for page in range(page_count):
+                image = exporter.renderPageToImage(page, settings.imageSize, settings.dpi)
+                if image.isNull():
+                    continue
+                suffix = f"_{page + 1}" if page_count > 1 else ""
+                yield f"{name}{suffix}.{extension}", _encode_image(image, output_format, request_id)
+    finally:
+        atlas.endRender()
+        if slot:
+            slot.close()
+
+
+def _acquire_slot(priority: Priority, request_id: str, limited: bool = True) -> Optional[BinaryIO]:
+    """Wait for a slot of the limiter of the node, held until the returned file is closed."""
+    if not limited or not limiter.enabled(priority):
+        return None
+    try:
+        with phase("queue"):
+            return limiter.acquire(priority, request_id)
+    except LimiterTimeout as e:
+        raise AtlasPrintBusy(
+            f"Request-ID {request_id}, the server is busy, try again later: {e}", retry_after=e.retry_after
         )
 
-    return export_path
+
+@contextmanager
+def _export_slot(priority: Priority, request_id: str, limited: bool = True) -> Iterator[None]:
+    slot = _acquire_slot(priority, request_id, limited)
+    try:
+        yield
+    finally:
+        if slot:
+            slot.close()
+
+
+def _set_image_render_context(
+    layout: "QgsPrintLayout",
+    settings: "QgsLayoutExporter.ImageExportSettings",
+) -> None:
+    # Same as QgsLayoutExporter.exportToImage, the layout is a clone, the context is not restored
+    context = layout.renderContext()
+    context.setFlags(settings.flags)
+    context.setPredefinedScales(settings.predefinedMapScales)
+
+
+def _encode_image(image: "QImage", output_format: OutputFormat, request_id: str) -> bytes:
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    if not image.save(buffer, output_format.name.upper()):
+        raise AtlasPrintException(f"Request-ID {request_id}, the image could not be encoded")
+    buffer.close()
+    return data.data()
 
 
 def result_message(error: QgsLayoutExporter.ExportResult) -> str:
@@ -379,7 +1270,7 @@ def result_message(error: QgsLayoutExporter.ExportResult) -> str:
         return "Iterator error"
 
     logger.critical(
-        f"Check the PyQGIS documentation about this enum, maybe a new item in a newer QGIS version : {error}"
+        "Check the PyQGIS documentation about this enum, maybe a new item in a newer QGIS version : %s", error
     )
     return f"Unknown error : {error}"
 
@@ -418,40 +1309,245 @@ def parse_output_format(output: Union[str, None]) -> OutputFormat:
         return OutputFormat.Pdf
 
     # Default value
-    logger.info(f'Output format is invalid, default to PDF. It was "{output}"')
+    logger.info('Output format is invalid, default to PDF. It was "%s"', output)
     return OutputFormat.Pdf
 
 
-def optimize_expression(
+# Functions which do not return the same value at each call
+NON_DETERMINISTIC_FUNCTIONS = ("rand", "randf", "uuid", "now")
+
+
+class OptimizedFilter:
+    """A feature filter, with what could be found by reading its expression tree."""
+
+    def __init__(
+        self,
+        expression: str,
+        *,
+        feature_ids: Optional[List[int]] = None,
+        constant: Optional[bool] = None,
+        rewrite: str = "none",
+    ) -> None:
+        # The expression to give to the atlas
+        self.expression = expression
+        # The filter only matches these feature IDs
+        self.feature_ids = feature_ids
+        # The filter is always true or always false, whatever the feature
+        self.constant = constant
+        # Name of the optimization which has been applied
+        self.rewrite = rewrite
+
+    def feature_request(self) -> QgsFeatureRequest:
+        """Feature request to fetch the features matching the filter."""
+        request = QgsFeatureRequest()
+        if self.feature_ids is not None:
+            request.setFilterFids(self.feature_ids)
+        elif self.constant is False:
+            request.setFilterFids([])
+        elif self.constant is None:
+            request.setFilterExpression(self.expression)
+        return request
+
+
+def _function_name(node: QgsExpressionNode) -> Optional[str]:
+    if not isinstance(node, QgsExpressionNodeFunction):
+        return None
+    return QgsExpression.Functions()[node.fnIndex()].name()
+
+
+def _is_feature_id(node: QgsExpressionNode, primary_key: Optional[str]) -> bool:
+    """If the node is `$id`, `@id`, or the primary key when it is the feature ID."""
+    name = _function_name(node)
+    if name == "$id":
+        return True
+
+    if name == "var":
+        args = node.args().list()  # type: ignore [attr-defined]
+        return len(args) == 1 and isinstance(args[0], QgsExpressionNodeLiteral) and args[0].value() == "id"
+
+    if primary_key and isinstance(node, QgsExpressionNodeColumnRef):
+        return node.name() == primary_key
+
+    return False
+
+
+def _literal_feature_id(node: QgsExpressionNode) -> Optional[int]:
+    if not isinstance(node, QgsExpressionNodeLiteral):
+        return None
+
+    value = node.value()
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float) and not value.is_integer():
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _feature_ids(node: QgsExpressionNode, primary_key: Optional[str]) -> Optional[List[int]]:
+    """Feature IDs if the node only matches a list of IDs, like `$id = 1` or `"pk" IN (1, 2)`."""
+    if isinstance(node, QgsExpressionNodeInOperator):
+        if node.isNotIn() or not _is_feature_id(node.node(), primary_key):
+            return None
+        ids = [_literal_feature_id(item) for item in node.list().list()]
+        if None in ids:
+            return None
+        return list(dict.fromkeys(ids))  # type: ignore [arg-type]
+
+    if not isinstance(node, QgsExpressionNodeBinaryOperator):
+        return None
+
+    if node.op() == QgsExpressionNodeBinaryOperator.BinaryOperator.boEQ:
+        for id_node, value_node in ((node.opLeft(), node.opRight()), (node.opRight(), node.opLeft())):
+            if _is_feature_id(id_node, primary_key):
+                feature_id = _literal_feature_id(value_node)
+                return [feature_id] if feature_id is not None else None
+        return None
+
+    if node.op() == QgsExpressionNodeBinaryOperator.BinaryOperator.boOr:
+        left = _feature_ids(node.opLeft(), primary_key)
+        right = _feature_ids(node.opRight(), primary_key)
+        if left is None or right is None:
+            return None
+        return list(dict.fromkeys(left + right))
+
+    return None
+
+
+def _constant_value(expression: QgsExpression) -> Optional[bool]:
+    """The value of the expression if it does not depend on the feature."""
+    if expression.referencedColumns() or expression.referencedVariables() or expression.needsGeometry():
+        return None
+
+    for function in expression.referencedFunctions():
+        if function.startswith("$") or function in NON_DETERMINISTIC_FUNCTIONS:
+            return None
+
+    # Do not change the state of the cached expression
+    expression = QgsExpression(expression)
+    value = expression.evaluate()
+    if expression.hasEvalError():
+        return None
+    return bool(value)
+
+
+def _feature_ids_expression(column: str, feature_ids: List[int]) -> str:
+    if len(feature_ids) == 1:
+        return f"{column} = {feature_ids[0]}"
+    return f"{column} IN ({', '.join(str(i) for i in feature_ids)})"
+
+
+def _numeric_primary_key(layer: QgsVectorLayer) -> Optional[str]:
+    """The primary key if it is a single numeric field, `$id` is replaced by this field."""
+    primary_keys = layer.primaryKeyAttributes()
+    if len(primary_keys) != 1:
+        return None
+
+    field = layer.fields().at(primary_keys[0])
+    if not field.isNumeric():
+        return None
+
+    return field.name()
+
+
+def _integer_primary_key(layer: QgsVectorLayer) -> Optional[str]:
+    """The primary key if it is a single integer field, its values are then the feature IDs.
+
+    Other numeric primary keys, such as a double or a numeric column in PostgreSQL, are mapped to feature
+    IDs by the provider, their values are not the feature IDs.
+    """
+    primary_key = _numeric_primary_key(layer)
+    if primary_key is None:
+        return None
+
+    field = layer.fields().field(primary_key)
+    if field.type() not in (QMetaType.Type.Int, QMetaType.Type.LongLong):
+        return None
+
+    return primary_key
+
+
+def optimize_filter(
     layer: QgsVectorLayer,
     expression: str,
     request_id: str = "ND",
-) -> str:
-    """Check if we can optimize the expression.
+) -> OptimizedFilter:
+    """Read the expression tree of the filter to find a cheaper way to fetch the features.
+
+    * `$id`, `@id` and the primary key compared to literals are turned into a list of feature IDs.
+      If the layer has a single numeric primary key, `$id` and `@id` are replaced by this field, so the
+      filter can be compiled by the provider. Only the values of an integer primary key are feature IDs.
+    * Filters which do not depend on the feature are evaluated once, as constant true or false.
 
     https://github.com/3liz/qgis-atlasprint/issues/23
     """
-    if expression.find("$id") < 0:
-        logger.info(
-            f"Request-ID {request_id} : $id' not found in the expression, returning the input expression."
+    parsed = expression_cache.parse(expression)
+    if parsed.parser_error:
+        return OptimizedFilter(expression)
+
+    primary_key = _numeric_primary_key(layer)
+
+    # Only the values of an integer primary key are feature IDs
+    feature_ids = _feature_ids(parsed.expression.rootNode(), _integer_primary_key(layer))
+    if feature_ids is not None:
+        if primary_key is None:
+            logger.debug(
+                "Request-ID %s : feature IDs %s found in the expression, no numeric primary key in the layer '%s'",
+                request_id,
+                feature_ids,
+                layer.id(),
+            )
+            return OptimizedFilter(expression, feature_ids=feature_ids, rewrite="feature-ids")
+
+        optimized = _feature_ids_expression(QgsExpression.quotedColumnRef(primary_key), feature_ids)
+        logger.debug(
+            'Request-ID %s : the expression has been replaced by "%s" using the primary key in layer "%s"',
+            request_id,
+            optimized,
+            layer.id(),
+        )
+        return OptimizedFilter(optimized, feature_ids=feature_ids, rewrite="primary-key")
+
+    constant = _constant_value(parsed.expression)
+    if constant is not None:
+        logger.debug("Request-ID %s : the expression is always %s", request_id, str(constant).lower())
+        return OptimizedFilter(
+            expression,
+            constant=constant,
+            rewrite="constant-true" if constant else "constant-false",
         )
-        return expression
 
-    primary_keys = layer.primaryKeyAttributes()
-    if len(primary_keys) != 1:
-        logger.info(f"Request-ID {request_id} : Primary keys are not defined in the layer '{layer.id()}'.")
-        return expression
+    logger.debug("Request-ID %s : no optimization found, returning the input expression.", request_id)
+    return OptimizedFilter(expression)
 
-    field = layer.fields().at(0)
-    if not field.isNumeric():
-        logger.info(
-            f"Request-ID {request_id} : The field '{field.name()}' is not numeric in layer '{layer.id()}'."
+
+def feature_ids_filter(layer: QgsVectorLayer, feature_ids: List[int]) -> OptimizedFilter:
+    """Filter expression matching a list of feature IDs, built without parsing any expression.
+
+    The expression is on the primary key when it holds the feature IDs, so the provider can run it,
+    on `$id` otherwise, which is evaluated on each feature of the layer.
+    """
+    primary_key = _integer_primary_key(layer)
+    if primary_key is None:
+        return OptimizedFilter(
+            _feature_ids_expression("$id", feature_ids),
+            feature_ids=feature_ids,
+            rewrite="feature-ids",
         )
-        return expression
 
-    expression = expression.replace("$id", f'"{field.name()}"')
-    logger.info(
-        f'Request-ID {request_id} : $id has been replaced by "{field.name()}" in layer "{layer.id()}"'
+    return OptimizedFilter(
+        _feature_ids_expression(QgsExpression.quotedColumnRef(primary_key), feature_ids),
+        feature_ids=feature_ids,
+        rewrite="primary-key",
     )
 
-    return expression
+
+def optimize_expression(
+    layer: QgsVectorLayer,
+    expression: str,
+    request_id: str = "ND",
+) -> str:
+    """Check if we can optimize the expression, see `optimize_filter`."""
+    return optimize_filter(layer, expression, request_id).expression
@@ -0,0 +1,89 @@
+"""Cache of parsed and prepared expressions, shared between the service and the core functions."""
+
+import os
+
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from qgis.core import QgsExpression, QgsExpressionContext, QgsVectorLayer
+
+ENV_EXPRESSION_CACHE_SIZE = "QGIS_SERVER_ATLASPRINT_EXPRESSION_CACHE_SIZE"
+
+DEFAULT_EXPRESSION_CACHE_SIZE = 256
+
+
+class CachedExpression:
+    """An expression parsed once, with the errors found while parsing and preparing it."""
+
+    def __init__(self, expression: QgsExpression) -> None:
+        self.expression = expression
+        self.parser_error: Optional[str] = None
+        self.eval_error: Optional[str] = None
+        self.prepared = False
+        if self.expression.hasParserError():
+            self.parser_error = self.expression.parserErrorString()
+
+    def dump(self) -> str:
+        """Normalized text of the expression."""
+        return self.expression.dump()
+
+
+class ExpressionCache:
+    """LRU of expressions, keyed by the project path, the layer ID and the text of the expression.
+
+    Layer IDs are only unique in a project, the same ID can be found in many projects of the server.
+    """
+
+    def __init__(self, size: int = DEFAULT_EXPRESSION_CACHE_SIZE) -> None:
+        self.size = size
+        self._entries: "OrderedDict[Tuple[str, str, str], CachedExpression]" = OrderedDict()
+
+    def parse(self, text: str) -> CachedExpression:
+        """The parsed expression, without any layer."""
+        return self._get(("", "", text))
+
+    def prepare(
+        self,
+        project_path: str,
+        layer: QgsVectorLayer,
+        text: str,
+        context: Callable[[], QgsExpressionContext],
+    ) -> CachedExpression:
+        """The expression parsed and prepared for the layer of the project.
+
+        The expression context is built only if the expression is not in the cache yet.
+        """
+        cached = self._get((project_path, layer.id(), text))
+        if not cached.prepared and not cached.parser_error:
+            cached.expression.prepare(context())
+            if cached.expression.hasEvalError():
+                cached.eval_error = cached.expression.evalErrorString()
+            cached.prepared = True
+        return cached
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get(self, key: Tuple[str, str, str]) -> CachedExpression:
+        cached = self._entries.get(key)
+        if cached is not None:
+            self._entries.move_to_end(key)
+            return cached
+
+        _, layer_id, text = key
+        parsed = self._entries.get(("", "", text)) if layer_id else None
+        if parsed is not None:
+            # Copying a parsed expression does not parse it again
+            cached = CachedExpression(QgsExpression(parsed.expression))
+        else:
+            cached = CachedExpression(QgsExpression(text))
+        self._entries[key] = cached
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return cached
+
+
+expression_cache = ExpressionCache(int(os.getenv(ENV_EXPRESSION_CACHE_SIZE, DEFAULT_EXPRESSION_CACHE_SIZE)))
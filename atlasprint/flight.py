@@ -0,0 +1,200 @@
+"""Identical requests running at once share a single export, across the QGIS Server processes.
+
+The first request, the leader, takes an exclusive lock on a file named after the fingerprint of the
+request, in a sub-directory of the spool directory, not swept. The next identical requests, the followers, wait for the lock to be
+released, then send the document published by the leader. Without any document, because the leader
+failed or has been killed, or after the timeout, a follower exports the document itself.
+
+Followers hold a shared lock on another file while waiting: the last one to leave, leader or follower,
+removes the published document. Lock files are removed by their last user, a request opening a file removed
+in the meantime opens the new one.
+"""
+
+import fcntl
+import os
+import time
+
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple
+from uuid import uuid4
+
+from . import logger
+from .spool import spool
+from .tools import to_bool
+
+ENV_SINGLE_FLIGHT = "QGIS_SERVER_ATLASPRINT_SINGLE_FLIGHT"
+ENV_SINGLE_FLIGHT_TIMEOUT = "QGIS_SERVER_ATLASPRINT_SINGLE_FLIGHT_TIMEOUT"
+
+DEFAULT_SINGLE_FLIGHT_TIMEOUT = 60
+
+# Maximum delay between two checks of the lock of the leader, in seconds
+MAX_POLL_INTERVAL = 0.2
+
+# Sub-directory of the lock files, in the spool directory
+LOCKS_DIR = "flights"
+
+
+def _same_file(path: Path, f: BinaryIO) -> bool:
+    """If the open file is still the file at this path, not removed in the meantime."""
+    try:
+        return os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def _open_locked(path: Path, operation: int) -> Tuple[BinaryIO, bool]:
+    """Open and lock the file, false if the lock is not free with `LOCK_NB`, the file is kept open."""
+    while True:
+        f = path.open("ab")
+        try:
+            fcntl.flock(f, operation)
+        except BlockingIOError:
+            return f, False
+        if _same_file(path, f):
+            return f, True
+        # Removed by its last user before being locked
+        f.close()
+
+
+class Flight:
+    """An export shared by identical requests, a request is the leader if `leader` is true."""
+
+    def __init__(self, directory: Optional[Path], key: str, timeout: float, request_id: str) -> None:
+        self.timeout = timeout
+        self.request_id = request_id
+        self.leader = True
+        self._published = False
+        self._lock: Optional[BinaryIO] = None
+        if directory is None:
+            # Disabled, a leader without any follower
+            return
+
+        self._lock_path = directory.joinpath(LOCKS_DIR, f"{key}.flight")
+        self._waiters_path = directory.joinpath(LOCKS_DIR, f"{key}.waiters")
+        # Counted in the size of the spool directory and swept if left by a killed process
+        self._result_path = directory.joinpath(f"{key}.result")
+        self._lock, self.leader = _open_locked(self._lock_path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def wait(self) -> Optional[BinaryIO]:
+        """For a follower, wait for the leader and open its document, None if there is no document."""
+        if self.leader or not self._lock:
+            return None
+
+        waiters, _ = _open_locked(self._waiters_path, fcntl.LOCK_SH)
+        with waiters:
+            try:
+                deadline = time.monotonic() + self.timeout
+                interval = 0.01
+                while True:
+                    try:
+                        fcntl.flock(self._lock, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            logger.warning(
+                                "Request-ID %s, no document from the identical request after %s seconds",
+                                self.request_id,
+                                self.timeout,
+                            )
+                            return None
+                        time.sleep(min(interval, remaining))
+                        interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+                try:
+                    # Kept open, even if it is removed by the last follower
+                    return self._result_path.open("rb")
+                except FileNotFoundError:
+                    logger.info("Request-ID %s, the identical request has failed", self.request_id)
+                    return None
+                finally:
+                    fcntl.flock(self._lock, fcntl.LOCK_UN)
+            finally:
+                fcntl.flock(waiters, fcntl.LOCK_UN)
+                self._remove_if_last(waiters)
+
+    def _remove_if_last(self, waiters: BinaryIO) -> None:
+        try:
+            fcntl.flock(waiters, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Other followers are waiting for the document
+            return
+        if _same_file(self._waiters_path, waiters):
+            self._result_path.unlink(missing_ok=True)
+            self._waiters_path.unlink(missing_ok=True)
+        # Else followers of a new file may wait for the document
+        fcntl.flock(waiters, fcntl.LOCK_UN)
+
+    def publish(self, path: Path) -> None:
+        """For the leader, share the document, a link to the file in the spool directory."""
+        if not self.leader or not self._lock:
+            return
+        temp = self._result_path.with_name(f".{self._result_path.name}.{uuid4().hex}")
+        try:
+            os.link(path, temp)
+            os.replace(temp, self._result_path)
+            self._published = True
+        except OSError as e:
+            temp.unlink(missing_ok=True)
+            logger.warning(
+                "Request-ID %s, document not shared with identical requests: %s", self.request_id, e
+            )
+
+    def publish_bytes(self, data: bytes) -> None:
+        """For the leader, share a document rendered in memory."""
+        if not self.leader or not self._lock:
+            return
+        temp = self._result_path.with_name(f".{self._result_path.name}.{uuid4().hex}")
+        try:
+            temp.write_bytes(data)
+            os.replace(temp, self._result_path)
+            self._published = True
+        except OSError as e:
+            temp.unlink(missing_ok=True)
+            logger.warning(
+                "Request-ID %s, document not shared with identical requests: %s", self.request_id, e
+            )
+
+    def release(self) -> None:
+        """Release the lock, the followers can send the document, or export it if the leader failed."""
+        if not self._lock:
+            return
+        if self.leader:
+            if not self._published:
+                # Not a document of a previous leader
+                self._result_path.unlink(missing_ok=True)
+            # The next request is a new leader, the followers already have the file open
+            self._lock_path.unlink(missing_ok=True)
+        self._lock.close()
+        self._lock = None
+
+    def retire(self) -> None:
+        """For the leader, once its own response is sent, remove the document if no follower is waiting."""
+        if not self.leader or not self._published:
+            return
+        with self._waiters_path.open("ab") as waiters:
+            self._remove_if_last(waiters)
+
+
+class SingleFlight:
+    def __init__(self, directory: Path, enabled: bool, timeout: float) -> None:
+        self.directory = directory
+        self.enabled = enabled
+        self.timeout = timeout
+        if enabled:
+            directory.joinpath(LOCKS_DIR).mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_environment(cls) -> "SingleFlight":
+        return cls(
+            spool.directory,
+            enabled=to_bool(os.getenv(ENV_SINGLE_FLIGHT)),
+            timeout=float(os.getenv(ENV_SINGLE_FLIGHT_TIMEOUT, DEFAULT_SINGLE_FLIGHT_TIMEOUT)),
+        )
+
+    def join(self, key: str, request_id: str) -> Flight:
+        """Lead the export of the document, or follow an identical request already running."""
+        return Flight(self.directory if self.enabled else None, key, self.timeout, request_id)
+
+
+single_flight = SingleFlight.from_environment()
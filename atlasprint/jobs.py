@@ -0,0 +1,294 @@
+"""Asynchronous print jobs, rendered by worker processes.
+
+Each job is recorded in a journal on disk, a JSON file per job, so the queue survives a restart of
+QGIS Server. A job is run by a single worker process at once, protected by a lock on a file.
+"""
+
+import fcntl
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+from enum import Enum
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+from uuid import uuid4
+
+from .parallel import process_pool
+
+from . import logger
+
+ENV_JOBS_DIR = "QGIS_SERVER_ATLASPRINT_JOBS_DIR"
+ENV_JOBS_WORKERS = "QGIS_SERVER_ATLASPRINT_JOBS_WORKERS"
+ENV_JOBS_TTL = "QGIS_SERVER_ATLASPRINT_JOBS_TTL"
+
+DEFAULT_JOBS_WORKERS = 1
+DEFAULT_JOBS_TTL = 3600
+
+# Minimum delay between two expirations of the journal, in seconds
+EXPIRE_INTERVAL = 60
+
+JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class JobStatus(Enum):
+    Queued = "queued"
+    Running = "running"
+    Done = "done"
+    Failed = "failed"
+
+
+def read_job(directory: Path, job_id: str) -> Optional[Dict[str, Any]]:
+    """The record of the job from the journal, None if the job is unknown."""
+    if not JOB_ID.match(job_id):
+        return None
+    try:
+        with directory.joinpath(f"{job_id}.json").open() as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_job(directory: Path, record: Dict[str, Any]) -> None:
+    """Replace the record of the job in the journal, readers never see a partial record."""
+    path = directory.joinpath(f"{record['id']}.json")
+    temp = path.with_name(f".{path.name}.{uuid4().hex}")
+    with temp.open("w") as f:
+        json.dump(record, f)
+    os.replace(temp, path)
+
+
+def run_job(directory: str, job_id: str) -> None:
+    """Render the job in the worker process, the result is stored next to the journal."""
+    jobs_dir = Path(directory)
+    with jobs_dir.joinpath(f"{job_id}.lock").open("w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Already run by another worker process
+            return
+
+        record = read_job(jobs_dir, job_id)
+        if record is None or record["status"] not in (JobStatus.Queued.value, JobStatus.Running.value):
+            return
+
+        record["status"] = JobStatus.Running.value
+        record["started"] = time.time()
+        write_job(jobs_dir, record)
+
+        def progress(done: int, total: int) -> None:
+            if (done, total) != (record["pages_done"], record["pages_total"]):
+                record["pages_done"] = done
+                record["pages_total"] = total
+                write_job(jobs_dir, record)
+
+        try:
+            _render(jobs_dir, record, progress)
+            record["status"] = JobStatus.Done.value
+        except Exception as e:
+            # Avoid a circular import
+            from .core import AtlasPrintException
+
+            logger.critical("Request-ID %s, job %s failed: %s", record["request_id"], job_id, e)
+            record["status"] = JobStatus.Failed.value
+            record["error"] = str(e)
+            record["error_code"] = e.code if isinstance(e, AtlasPrintException) else 500
+        record["finished"] = time.time()
+        write_job(jobs_dir, record)
+
+
+def _render(jobs_dir: Path, record: Dict[str, Any], progress: Callable[[int, int], None]) -> None:
+    from .core import OutputFormat, print_layout, print_layout_image
+    from .parallel import set_project_variables, worker_project
+
+    project = worker_project(record["project"])
+    set_project_variables(project, record["project_variables"])
+
+    output_format = OutputFormat[record["format"]]
+    result = jobs_dir.joinpath(record["result"])
+    parameters = {
+        "project": project,
+        "layout_name": record["layout"],
+        "output_format": output_format,
+        "feature_filter": record["filter"],
+        "feature_ids": record["feature_ids"],
+        "scales": record["scales"],
+        "scale": record["scale"],
+        "request_id": record["request_id"],
+        "variables": record["variables"],
+        **record["params"],
+    }
+    if output_format in (OutputFormat.Png, OutputFormat.Jpeg):
+        progress(0, 1)
+        result.write_bytes(print_layout_image(**parameters))
+        progress(1, 1)
+    else:
+        path = print_layout(progress=progress, **parameters)
+        shutil.move(str(path), str(result))
+
+
+class JobQueue:
+    """Queue of print jobs, the journal directory can be shared between QGIS Server processes."""
+
+    def __init__(
+        self,
+        directory: Path,
+        workers: int = DEFAULT_JOBS_WORKERS,
+        ttl: int = DEFAULT_JOBS_TTL,
+    ) -> None:
+        self.directory = directory
+        self.workers = workers
+        self.ttl = ttl
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._expired = 0.0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_environment(cls) -> "JobQueue":
+        directory = os.getenv(ENV_JOBS_DIR)
+        return cls(
+            Path(directory) if directory else Path(tempfile.gettempdir()).joinpath("atlasprint_jobs"),
+            workers=int(os.getenv(ENV_JOBS_WORKERS, DEFAULT_JOBS_WORKERS)),
+            ttl=int(os.getenv(ENV_JOBS_TTL, DEFAULT_JOBS_TTL)),
+        )
+
+    @property
+    def executor(self) -> Executor:
+        """The pool of worker processes, started the first time."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = process_pool(self.workers)
+            return self._executor
+
+    def _reset(self, executor: Executor) -> None:
+        """Drop the pool broken after a worker process crashed, a new pool is started by the next job."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+            else:
+                # Already replaced
+                return
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.critical("A worker process of the print jobs has crashed, the pool is started again")
+
+    def submit(self, request_id: str, **job: Any) -> str:
+        """Record the job in the journal and queue it, return the job ID.
+
+        :param job: project, layout, format, filter, feature_ids, scales, scale, params, variables and
+        project_variables.
+        """
+        self._expire_if_due()
+        job_id = uuid4().hex
+        record = {
+            "id": job_id,
+            "request_id": request_id,
+            "status": JobStatus.Queued.value,
+            "submitted": time.time(),
+            "pages_done": 0,
+            "pages_total": None,
+            "result": f"{job_id}.{job['format'].lower()}",
+            **job,
+        }
+        write_job(self.directory, record)
+        self._queue(job_id)
+        logger.info("Request-ID %s, job %s submitted", request_id, job_id)
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The record of the job, None if the job is unknown or has expired."""
+        self._expire_if_due()
+        return read_job(self.directory, job_id)
+
+    def result(self, job_id: str) -> Optional[Path]:
+        """Path of the document of a finished job."""
+        record = self.status(job_id)
+        if record is None or record["status"] != JobStatus.Done.value:
+            return None
+        return self.directory.joinpath(record["result"])
+
+    def recover(self) -> int:
+        """Queue again the jobs not finished, after a restart.
+
+        The jobs still run by another process are skipped by the worker processes.
+        """
+        count = 0
+        for path in self.directory.glob("*.json"):
+            record = read_job(self.directory, path.stem)
+            if record and record["status"] in (JobStatus.Queued.value, JobStatus.Running.value):
+                self._queue(record["id"])
+                count += 1
+        if count:
+            logger.info("%s print jobs queued again from the journal %s", count, self.directory)
+        return count
+
+    def expire(self) -> None:
+        """Remove the jobs finished for longer than the lifetime, with their documents."""
+        now = time.time()
+        for path in self.directory.glob("*.json"):
+            record = read_job(self.directory, path.stem)
+            if not record or not record.get("finished") or now - record["finished"] < self.ttl:
+                continue
+            self.directory.joinpath(record["result"]).unlink(missing_ok=True)
+            self.directory.joinpath(f"{record['id']}.lock").unlink(missing_ok=True)
+            path.unlink(missing_ok=True)
+            logger.debug("Job %s expired", record["id"])
+
+    def _expire_if_due(self) -> None:
+        """Expire the journal, at most once per interval, without a request it is not needed."""
+        now = time.monotonic()
+        if self._expired and now - self._expired < EXPIRE_INTERVAL:
+            return
+        self._expired = now
+        self.expire()
+
+    def _queue(self, job_id: str) -> None:
+        executor = self.executor
+        try:
+            future = executor.submit(run_job, str(self.directory), job_id)
+        except BrokenProcessPool:
+            self._reset(executor)
+            executor = self.executor
+            future = executor.submit(run_job, str(self.directory), job_id)
+        future.add_done_callback(partial(self._done, executor, job_id))
+
+    def _done(self, executor: Executor, job_id: str, future: Future) -> None:
+        """Recover the job if its worker process has crashed.
+
+        Every job of the broken pool fails: a job not started yet is queued again in a new pool, a running
+        job is failed, it may crash the worker process again.
+        """
+        if future.cancelled() or not isinstance(future.exception(), BrokenProcessPool):
+            return
+        self._reset(executor)
+
+        record = read_job(self.directory, job_id)
+        if record is None:
+            return
+        if record["status"] == JobStatus.Queued.value:
+            self._queue(job_id)
+            return
+        if record["status"] != JobStatus.Running.value:
+            return
+
+        with self.directory.joinpath(f"{job_id}.lock").open("w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Run by the worker process of another QGIS Server process
+                return
+            logger.critical(
+                "Request-ID %s, job %s failed: the worker process has crashed", record["request_id"], job_id
+            )
+            record["status"] = JobStatus.Failed.value
+            record["error"] = "The worker process rendering the job has crashed"
+            record["error_code"] = 500
+            record["finished"] = time.time()
+            write_job(self.directory, record)
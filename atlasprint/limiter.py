@@ -0,0 +1,171 @@
+"""Limit of the exports running at once on the node, shared by the QGIS Server processes.
+
+A slot is a lock on a file, released by the system if the process is killed. Interactive exports, a single
+page, and bulk exports, many pages, have their own slots, so a burst of large atlases does not delay
+the small ones. A process waiting for a slot holds a lock on a file too, to count the queue of the node.
+"""
+
+import fcntl
+import math
+import os
+import random
+import tempfile
+import time
+
+from enum import Enum
+from pathlib import Path
+from typing import BinaryIO, Dict, Optional
+
+from . import logger
+
+ENV_LIMITER_DIR = "QGIS_SERVER_ATLASPRINT_LIMITER_DIR"
+ENV_INTERACTIVE_SLOTS = "QGIS_SERVER_ATLASPRINT_INTERACTIVE_SLOTS"
+ENV_BULK_SLOTS = "QGIS_SERVER_ATLASPRINT_BULK_SLOTS"
+ENV_INTERACTIVE_TIMEOUT = "QGIS_SERVER_ATLASPRINT_INTERACTIVE_TIMEOUT"
+ENV_BULK_TIMEOUT = "QGIS_SERVER_ATLASPRINT_BULK_TIMEOUT"
+
+DEFAULT_SLOTS = 0
+DEFAULT_INTERACTIVE_TIMEOUT = 10
+DEFAULT_BULK_TIMEOUT = 60
+
+# Maximum delay between two attempts to get a slot, in seconds
+MAX_POLL_INTERVAL = 0.5
+
+
+class Priority(Enum):
+    Interactive = "interactive"
+    Bulk = "bulk"
+
+
+class LimiterTimeout(Exception):
+    """No slot has been released before the timeout."""
+
+    def __init__(self, priority: Priority, timeout: float) -> None:
+        super().__init__(f"No {priority.value} export slot available after {timeout} seconds")
+        self.priority = priority
+        # Seconds before trying again
+        self.retry_after = max(1, math.ceil(timeout))
+
+
+def _is_locked(path: Path) -> Optional[bool]:
+    """If another process holds a lock on the file, None if the file does not exist anymore."""
+    try:
+        with path.open("rb") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            return False
+    except FileNotFoundError:
+        return None
+
+
+class Limiter:
+    def __init__(self, directory: Path, slots: Dict[Priority, int], timeouts: Dict[Priority, float]) -> None:
+        self.directory = directory
+        self.slots = slots
+        self.timeouts = timeouts
+        # Statistics of the process, by priority
+        self.queued = dict.fromkeys(Priority, 0)
+        self.rejected = dict.fromkeys(Priority, 0)
+        self.wait_seconds = dict.fromkeys(Priority, 0.0)
+        if any(slots.values()):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_environment(cls) -> "Limiter":
+        directory = os.getenv(ENV_LIMITER_DIR)
+        return cls(
+            Path(directory) if directory else Path(tempfile.gettempdir()).joinpath("atlasprint_slots"),
+            slots={
+                Priority.Interactive: int(os.getenv(ENV_INTERACTIVE_SLOTS, DEFAULT_SLOTS)),
+                Priority.Bulk: int(os.getenv(ENV_BULK_SLOTS, DEFAULT_SLOTS)),
+            },
+            timeouts={
+                Priority.Interactive: float(os.getenv(ENV_INTERACTIVE_TIMEOUT, DEFAULT_INTERACTIVE_TIMEOUT)),
+                Priority.Bulk: float(os.getenv(ENV_BULK_TIMEOUT, DEFAULT_BULK_TIMEOUT)),
+            },
+        )
+
+    def enabled(self, priority: Priority) -> bool:
+        return self.slots[priority] > 0
+
+    def _try_slots(self, priority: Priority) -> Optional[BinaryIO]:
+        count = self.slots[priority]
+        # Not always the first slot, to spread the processes on the files
+        start = random.randrange(count)
+        for i in range(count):
+            f = self.directory.joinpath(f"{priority.value}.{(start + i) % count}.slot").open("ab")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            return f
+        return None
+
+    def try_acquire(self, priority: Priority) -> Optional[BinaryIO]:
+        """A free slot without waiting, None if the priority is not limited or if every slot is in use."""
+        if not self.enabled(priority):
+            return None
+        return self._try_slots(priority)
+
+    def acquire(self, priority: Priority, request_id: str) -> Optional[BinaryIO]:
+        """Wait for a free slot, the slot is held until the returned file is closed.
+
+        None is returned if the priority is not limited. Raise `LimiterTimeout` if no slot has been
+        released before the timeout of the priority.
+        """
+        if not self.enabled(priority):
+            return None
+
+        slot = self._try_slots(priority)
+        if slot:
+            return slot
+
+        # In the queue of the node until a slot is free, the lock is taken before the file is visible
+        self.queued[priority] += 1
+        start = time.monotonic()
+        waiting = self.directory.joinpath(f"{priority.value}.wait.{os.getpid()}")
+        temp = waiting.with_name(f".{waiting.name}")
+        interval = 0.01
+        with temp.open("wb") as marker:
+            fcntl.flock(marker, fcntl.LOCK_EX)
+            os.replace(temp, waiting)
+            logger.info("Request-ID %s, waiting for a %s export slot", request_id, priority.value)
+            try:
+                while True:
+                    remaining = start + self.timeouts[priority] - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected[priority] += 1
+                        raise LimiterTimeout(priority, self.timeouts[priority])
+                    time.sleep(min(interval, remaining))
+                    interval = min(interval * 2, MAX_POLL_INTERVAL)
+                    slot = self._try_slots(priority)
+                    if slot:
+                        return slot
+            finally:
+                waiting.unlink(missing_ok=True)
+                self.wait_seconds[priority] += time.monotonic() - start
+
+    def _count_locked(self, pattern: str) -> int:
+        count = 0
+        for path in self.directory.glob(pattern):
+            locked = _is_locked(path)
+            if locked:
+                count += 1
+            elif locked is False and ".wait." in path.name:
+                # Left by a process killed while waiting
+                path.unlink(missing_ok=True)
+        return count
+
+    def queue_depth(self, priority: Priority) -> int:
+        """Number of exports of the node waiting for a slot."""
+        return self._count_locked(f"{priority.value}.wait.*") if self.enabled(priority) else 0
+
+    def busy(self, priority: Priority) -> int:
+        """Number of slots of the node in use."""
+        return self._count_locked(f"{priority.value}.*.slot") if self.enabled(priority) else 0
+
+
+limiter = Limiter.from_environment()
@@ -1,31 +1,142 @@
+"""Log messages of the plugin in the QGIS Server log.
+
+A message is formatted with its `%`-style arguments only if its level is enabled, a disabled message costs a
+single comparison. With the buffered mode, the messages of a request are kept in memory and written at the end
+of the request as a single JSON line, tagged with the request ID.
+"""
+
+import json
+import os
+import time
 import traceback
 
+from enum import IntEnum
+from typing import Any, List, Optional, Tuple
+
 from qgis.core import Qgis, QgsMessageLog
 
 PLUGIN = "AtlasPrint"
 
+ENV_LOG_LEVEL = "QGIS_SERVER_ATLASPRINT_LOG_LEVEL"
+ENV_LOG_BUFFER = "QGIS_SERVER_ATLASPRINT_LOG_BUFFER"
+DEFAULT_LOG_LEVEL = "info"
+
+
+class Level(IntEnum):
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    CRITICAL = 40
+
+
+# QGIS does not have a debug level, debug messages are written as information
+QGIS_LEVELS = {
+    Level.DEBUG: Qgis.MessageLevel.Info,
+    Level.INFO: Qgis.MessageLevel.Info,
+    Level.WARNING: Qgis.MessageLevel.Warning,
+    Level.CRITICAL: Qgis.MessageLevel.Critical,
+}
+
+
+def level_from_environment() -> Level:
+    """The minimum level of the messages written in the log, `info` by default."""
+    value = os.getenv(ENV_LOG_LEVEL, DEFAULT_LOG_LEVEL).strip().upper()
+    try:
+        return Level[value]
+    except KeyError:
+        QgsMessageLog.logMessage(
+            f'Invalid log level "{value}" in {ENV_LOG_LEVEL}, default to {DEFAULT_LOG_LEVEL}',
+            PLUGIN,
+            Qgis.MessageLevel.Warning,
+        )
+        return Level[DEFAULT_LOG_LEVEL.upper()]
+
+
+_level = level_from_environment()
+_buffered = os.getenv(ENV_LOG_BUFFER, "").lower() in ("yes", "true", "t", "1")
+
+# Messages of the request being executed, in the buffered mode: time since the start, level and message
+_records: Optional[List[Tuple[float, Level, str]]] = None
+_request_id = ""
+_start = 0.0
+
+
+def set_level(level: Level) -> None:
+    global _level
+    _level = level
 
-def info(message: str):
-    QgsMessageLog.logMessage(message, PLUGIN, Qgis.MessageLevel.Info)
 
+def is_enabled(level: Level) -> bool:
+    """Whether messages of this level are written, to skip the computation of costly arguments."""
+    return level >= _level
 
-def warning(message: str):
-    QgsMessageLog.logMessage(message, PLUGIN, Qgis.MessageLevel.Warning)
 
+def set_buffered(buffered: bool) -> None:
+    global _buffered
+    _buffered = buffered
 
-def critical(message: str):
-    QgsMessageLog.logMessage(message, PLUGIN, Qgis.MessageLevel.Critical)
+
+def _emit(level: Level, message: str, args: Tuple[Any, ...]) -> None:
+    if args:
+        message = message % args
+    if _records is not None:
+        _records.append((time.perf_counter() - _start, level, message))
+        return
+    QgsMessageLog.logMessage(message, PLUGIN, QGIS_LEVELS[level])
+
+
+def debug(message: str, *args: Any) -> None:
+    if _level <= Level.DEBUG:
+        _emit(Level.DEBUG, message, args)
+
+
+def info(message: str, *args: Any) -> None:
+    if _level <= Level.INFO:
+        _emit(Level.INFO, message, args)
+
+
+def warning(message: str, *args: Any) -> None:
+    if _level <= Level.WARNING:
+        _emit(Level.WARNING, message, args)
+
+
+def critical(message: str, *args: Any) -> None:
+    if _level <= Level.CRITICAL:
+        _emit(Level.CRITICAL, message, args)
 
 
-debug = info
 error = critical
 
 
 def log_exception(e: BaseException):
     """Log a Python exception."""
-    critical(
-        "Critical exception:\n{e}\n{traceback}".format(
-            e=e,
-            traceback=traceback.format_exc(),
-        ),
+    critical("Critical exception:\n%s\n%s", e, traceback.format_exc())
+
+
+def begin_request(request_id: str) -> None:
+    """Start buffering the messages of a request, if the buffered mode is enabled."""
+    global _records, _request_id, _start
+    if not _buffered:
+        return
+    _records = []
+    _request_id = request_id
+    _start = time.perf_counter()
+
+
+def end_request() -> None:
+    """Write the buffered messages of the request as a single line, with the highest level of its messages."""
+    global _records
+    records, _records = _records, None
+    if not records:
+        return
+    line = json.dumps(
+        {
+            "request_id": _request_id,
+            "duration_ms": round((time.perf_counter() - _start) * 1000, 1),
+            "records": [
+                {"time_ms": round(elapsed * 1000, 1), "level": level.name.lower(), "message": message}
+                for elapsed, level, message in records
+            ],
+        },
     )
+    QgsMessageLog.logMessage(line, PLUGIN, QGIS_LEVELS[max(level for _, level, _ in records)])
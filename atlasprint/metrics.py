@@ -0,0 +1,151 @@
+"""Timings of the requests, by phase, and their aggregation in histograms.
+
+The timings of the current request are returned in a `Server-Timing` header, the histograms are exposed
+in the Prometheus text format. Metrics are kept in memory, for each QGIS Server process: every sample has
+a `pid` label, the series of a process are not mixed with those of another process reached by a scrape.
+"""
+
+import os
+import time
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds of the buckets, in seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class Timings:
+    """Durations of the named phases of a single request, in the order they started."""
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """Value of the `Server-Timing` header, durations in milliseconds."""
+        entries = [f"{name};dur={duration * 1000:.1f}" for name, duration in self.phases]
+        entries.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+class Histogram:
+    """Cumulative histogram of durations, as in Prometheus."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def samples(self, name: str, labels: str) -> List[str]:
+        lines = [
+            f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+            for bound, count in zip(self.buckets, self.counts)
+        ]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Histograms of the requests and of their phases, by layout."""
+
+    def __init__(self) -> None:
+        self.requests: Dict[Tuple[str, str, int], Histogram] = {}
+        self.phases: Dict[Tuple[str, str], Histogram] = {}
+
+    def observe(self, request: str, layout: str, status: int, timings: Timings) -> None:
+        """Aggregate the timings of a finished request."""
+        self.requests.setdefault((request, layout, status), Histogram()).observe(timings.total)
+        for name, duration in timings.phases:
+            self.phases.setdefault((layout, name), Histogram()).observe(duration)
+
+    def prometheus(self, counters: Optional[Dict[str, Tuple[str, float]]] = None) -> str:
+        """The metrics in the Prometheus text format.
+
+        :param counters: Other values, by metric name, with their help text.
+        """
+        process = f'pid="{os.getpid()}"'
+        lines = [
+            "# HELP atlasprint_request_duration_seconds Duration of the requests.",
+            "# TYPE atlasprint_request_duration_seconds histogram",
+        ]
+        for (request, layout, status), histogram in sorted(self.requests.items()):
+            labels = f'{process},request="{_escape(request)}",layout="{_escape(layout)}",status="{status}"'
+            lines.extend(histogram.samples("atlasprint_request_duration_seconds", labels))
+
+        lines.extend(
+            [
+                "# HELP atlasprint_phase_duration_seconds Duration of the phases of the requests.",
+                "# TYPE atlasprint_phase_duration_seconds histogram",
+            ]
+        )
+        for (layout, phase), histogram in sorted(self.phases.items()):
+            labels = f'{process},layout="{_escape(layout)}",phase="{_escape(phase)}"'
+            lines.extend(histogram.samples("atlasprint_phase_duration_seconds", labels))
+
+        for name, (help_text, value) in sorted((counters or {}).items()):
+            metric_type = "counter" if name.endswith("_total") else "gauge"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name}{{{process}}} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+# Timings of the request being executed, QGIS Server executes a single request at once in a process
+_current: Optional[Timings] = None
+
+
+def start_request() -> Timings:
+    """Start recording the phases of a new request."""
+    global _current
+    _current = Timings()
+    return _current
+
+
+def end_request() -> None:
+    global _current
+    _current = None
+
+
+def server_timing() -> Optional[str]:
+    """Value of the `Server-Timing` header for the current request."""
+    return _current.server_timing() if _current else None
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Record the duration of a phase of the current request, if any."""
+    if _current is None:
+        yield
+        return
+    with _current.phase(name):
+        yield
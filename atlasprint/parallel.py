@@ -0,0 +1,148 @@
+"""Export an atlas in chunks of features, in a pool of worker processes.
+
+Each worker process runs its own QGIS application and loads its own copy of the project.
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ENV_PARALLEL_WORKERS = "QGIS_SERVER_ATLASPRINT_PARALLEL_WORKERS"
+ENV_PARALLEL_CHUNK_SIZE = "QGIS_SERVER_ATLASPRINT_PARALLEL_CHUNK_SIZE"
+ENV_PYTHON = "QGIS_SERVER_ATLASPRINT_PYTHON"
+
+DEFAULT_PARALLEL_WORKERS = 0
+DEFAULT_PARALLEL_CHUNK_SIZE = 25
+
+_executor: Optional[Executor] = None
+
+# In a worker process
+_application: Any = None
+_projects: Dict[str, Any] = {}
+
+
+def parallel_workers() -> int:
+    """Number of worker processes, 0 if the parallel export is disabled."""
+    return int(os.getenv(ENV_PARALLEL_WORKERS, DEFAULT_PARALLEL_WORKERS))
+
+
+def parallel_chunk_size() -> int:
+    """Number of features exported by a worker process at once."""
+    return max(1, int(os.getenv(ENV_PARALLEL_CHUNK_SIZE, DEFAULT_PARALLEL_CHUNK_SIZE)))
+
+
+def python_executable() -> str:
+    """The Python interpreter for the worker processes.
+
+    QGIS Server may embed Python, `sys.executable` is then not a Python interpreter.
+    """
+    python = os.getenv(ENV_PYTHON)
+    if python:
+        return python
+    if sys.executable and Path(sys.executable).name.startswith("python"):
+        return sys.executable
+    return shutil.which("python3") or "python3"
+
+
+def process_pool(max_workers: int) -> Executor:
+    """A new pool of worker processes, each one running its own QGIS application."""
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(python_executable())  # type: ignore [attr-defined]
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=context,
+        initializer=init_worker,
+    )
+
+
+def executor() -> Executor:
+    """The pool of worker processes, started the first time."""
+    global _executor
+    if _executor is None:
+        _executor = process_pool(parallel_workers())
+    return _executor
+
+
+def reset_executor() -> None:
+    """Drop the pool of worker processes, broken after a worker process crashed.
+
+    A new pool is started by the next call to `executor()`.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def init_worker() -> None:
+    """Start a QGIS application without any display, in the worker process."""
+    global _application
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    from qgis.core import QgsApplication
+
+    _application = QgsApplication([], False)
+    _application.initQgis()
+
+
+def worker_project(path: str) -> Any:
+    """The project loaded once by the worker process, loaded again if the file has been modified."""
+    from qgis.core import QgsProject
+
+    key = f"{path}:{os.stat(path).st_mtime_ns}"
+    project = _projects.get(key)
+    if project is None:
+        project = QgsProject()
+        if not project.read(path):
+            raise RuntimeError(f"Failed to read the project {path}")
+        _projects.clear()
+        _projects[key] = project
+    return project
+
+
+def set_project_variables(project: Any, variables: Dict[str, Any]) -> None:
+    """Replace the Lizmap variables of the project loaded by the worker process."""
+    custom_variables = {k: v for k, v in project.customVariables().items() if not k.startswith("lizmap_")}
+    custom_variables.update(variables)
+    project.setCustomVariables(custom_variables)
+
+
+def export_chunk(
+    project_path: str,
+    layout_name: str,
+    feature_ids: List[int],
+    scales: Optional[list],
+    scale: Optional[int],
+    variables: Dict[str, str],
+    project_variables: Dict[str, Any],
+    request_id: str,
+    additional_params: Dict[str, Any],
+) -> str:
+    """Export the features as a PDF in the worker process, return the path of the document.
+
+    The variables are set in the layout scope, the project variables in the private project of the worker.
+    """
+    from .core import OutputFormat, print_layout
+
+    project = worker_project(project_path)
+    set_project_variables(project, project_variables)
+
+    path = print_layout(
+        project,
+        layout_name,
+        OutputFormat.Pdf,
+        scales=scales,
+        scale=scale,
+        request_id=request_id,
+        feature_ids=feature_ids,
+        variables=variables,
+        # The slot of the limiter is held by the parent process
+        limited=False,
+        **additional_params,
+    )
+    return str(path)
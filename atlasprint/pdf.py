@@ -0,0 +1,27 @@
+"""Assemble PDF documents, outside of the QGIS Server context.
+
+QGIS can not concatenate PDF documents, the optional `pypdf` package is used.
+"""
+
+from pathlib import Path
+from typing import BinaryIO, Sequence, Union
+
+try:
+    from pypdf import PdfWriter
+
+    HAS_PYPDF = True
+except ImportError:
+    HAS_PYPDF = False
+
+
+def merge_pdf(parts: Sequence[Union[Path, BinaryIO]], output: Path) -> None:
+    """Concatenate the PDF documents, in this order, in a new document."""
+    if not HAS_PYPDF:
+        raise RuntimeError("The Python package 'pypdf' is required to assemble PDF documents")
+
+    writer = PdfWriter()
+    for part in parts:
+        writer.append(part)
+    with output.open("wb") as f:
+        writer.write(f)
+    writer.close()
@@ -0,0 +1,265 @@
+"""Pre-render the features of atlas layouts in the output cache, from the command line.
+
+    python3 -m atlasprint.prerender /srv/projects/municipalities.qgs --layout sheet --processes 4
+
+Each feature is rendered as the document of a `GetPrint` request with `FEATURE_IDS` set to the feature and
+without any other parameter, for an anonymous user, and stored in the output cache of QGIS Server: the
+first request of this feature is then served from the cache.
+
+The attributes and the geometry of each feature are hashed, the hashes are stored next to the cache. A
+later run renders only the features which have been added or modified, or whose document is no longer in the
+cache, evicted or with a new version of the data in its key, or all of them if the project has been modified.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+from concurrent.futures import Executor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from qgis.core import QgsFeatureRequest, QgsProject, QgsVectorLayer
+
+from .cache import OutputCache, fingerprint, print_key, project_path
+from .core import LIZMAP_GROUPS_VARIABLE, AtlasPrintException, OutputFormat, print_layout, print_layout_image
+from .parallel import init_worker, parallel_chunk_size, process_pool, set_project_variables, worker_project
+from .service import parse_print_parameters
+
+
+def _report(message: str) -> None:
+    sys.stdout.write(f"{message}\n")
+    sys.stdout.flush()
+
+
+def feature_hashes(layer: QgsVectorLayer, feature_ids: Optional[List[int]] = None) -> Dict[int, str]:
+    """Hash of the attributes and of the geometry of each feature of the layer."""
+    request = QgsFeatureRequest()
+    if feature_ids:
+        request.setFilterFids(feature_ids)
+
+    hashes = {}
+    for feature in layer.getFeatures(request):
+        content = hashlib.sha256(json.dumps(feature.attributes(), default=str).encode("utf8"))
+        if feature.hasGeometry():
+            content.update(bytes(feature.geometry().asWkb()))
+        hashes[feature.id()] = content.hexdigest()
+    return hashes
+
+
+def feature_parameters(layout_name: str, output_format: str, feature_id: int) -> Dict[str, Any]:
+    """Parameters of the `GetPrint` request of the feature, as read by `parse_print_parameters`."""
+    params = {"TEMPLATE": layout_name, "FEATURE_IDS": str(feature_id), "FORMAT": output_format}
+    return parse_print_parameters(params, "", ())
+
+
+def render_features(
+    project_path: str,
+    layout_name: str,
+    output_format: str,
+    feature_ids: List[int],
+) -> List[Tuple[int, Optional[str]]]:
+    """Render each feature in the worker process and store it in the output cache.
+
+    :return: The feature IDs, with an error message if the feature has not been rendered.
+    """
+    project = worker_project(project_path)
+    # An anonymous user, without any group
+    set_project_variables(project, {LIZMAP_GROUPS_VARIABLE: []})
+    cache = OutputCache.from_environment(memory=False)
+    if cache is None:
+        raise RuntimeError("The output cache is disabled")
+
+    results: List[Tuple[int, Optional[str]]] = []
+    for feature_id in feature_ids:
+        request_id = f"prerender-{layout_name}-{feature_id}"
+        try:
+            # The same parameters and the same key as a request
+            parameters = feature_parameters(layout_name, output_format, feature_id)
+            key = print_key(project, parameters, "", ())
+            kwargs = {
+                k: v
+                for k, v in parameters.items()
+                if k not in ("normalized_filter", "archive", "additional_params")
+            }
+            if parameters["output_format"] in (OutputFormat.Png, OutputFormat.Jpeg):
+                cache.put_bytes(key, print_layout_image(project=project, request_id=request_id, **kwargs))
+            else:
+                path = print_layout(project=project, request_id=request_id, **kwargs)
+                try:
+                    cache.put(key, path)
+                finally:
+                    path.unlink(missing_ok=True)
+        except (AtlasPrintException, OSError) as e:
+            results.append((feature_id, str(e)))
+            continue
+        results.append((feature_id, None))
+    return results
+
+
+def _state_path(cache: OutputCache, project: QgsProject, layout_name: str, output_format: str) -> Path:
+    key = fingerprint(project=project_path(project), layout=layout_name, format=output_format)
+    # Hidden files are not documents of the cache, they are never evicted
+    # The cache read from the environment always has a disk tier
+    return cache.disk_dir.joinpath(".prerender", f"{key}.json")  # type: ignore [union-attr]
+
+
+def _read_state(path: Path) -> Dict:
+    try:
+        with path.open() as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_state(path: Path, state: Dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f".{path.name}.{uuid4().hex}")
+    with temp.open("w") as f:
+        json.dump(state, f)
+    os.replace(temp, path)
+
+
+def prerender_layout(
+    executor: Executor,
+    cache: OutputCache,
+    project: QgsProject,
+    layout_name: str,
+    output_format: str,
+    feature_ids: Optional[List[int]],
+    force: bool,
+) -> int:
+    """Render the features of the layout which changed since the last run, return the number of errors."""
+    layout = project.layoutManager().layoutByName(layout_name)
+    if not layout or not hasattr(layout, "atlas") or not layout.atlas().enabled():
+        _report(f"{layout_name}: not an atlas layout, skipped")
+        return 1
+
+    project_modified = project.lastModified().toMSecsSinceEpoch()
+    state_path = _state_path(cache, project, layout_name, output_format)
+    state = _read_state(state_path)
+    previous: Dict[str, str] = {}
+    if not force and state.get("project_modified") == project_modified:
+        previous = state.get("features", {})
+
+    hashes = feature_hashes(layout.atlas().coverageLayer(), feature_ids)
+
+    def cached(feature_id: int) -> bool:
+        # The key changes with the version of the data, the document may also have been evicted
+        return cache.contains(
+            print_key(project, feature_parameters(layout_name, output_format, feature_id), "", ())
+        )
+
+    changed = [fid for fid, content in hashes.items() if previous.get(str(fid)) != content or not cached(fid)]
+    _report(f"{layout_name}: {len(changed)} features to render, {len(hashes) - len(changed)} unchanged")
+
+    if feature_ids is None:
+        # Without the features removed from the layer
+        previous = {fid: content for fid, content in previous.items() if int(fid) in hashes}
+
+    size = parallel_chunk_size()
+    futures = {
+        executor.submit(
+            render_features,
+            project.fileName(),
+            layout_name,
+            output_format,
+            changed[i : i + size],
+        ): changed[i : i + size]
+        for i in range(0, len(changed), size)
+    }
+    errors = 0
+    done = 0
+    for future in as_completed(futures):
+        try:
+            results = future.result()
+        except Exception as e:
+            # The worker process has been killed, the features are rendered again by the next run
+            results = [(feature_id, str(e)) for feature_id in futures[future]]
+        for feature_id, error in results:
+            done += 1
+            if error:
+                errors += 1
+                _report(f"{layout_name}: feature {feature_id} not rendered: {error}")
+            else:
+                previous[str(feature_id)] = hashes[feature_id]
+        _report(f"{layout_name}: {done}/{len(changed)} features")
+
+    _write_state(
+        state_path,
+        {
+            "project": project.fileName(),
+            "project_modified": project_modified,
+            "layout": layout_name,
+            "format": output_format,
+            "features": previous,
+        },
+    )
+    return errors
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python3 -m atlasprint.prerender",
+        description="Pre-render the features of atlas layouts in the output cache.",
+    )
+    parser.add_argument("project", type=Path, help="the QGIS project file")
+    parser.add_argument(
+        "--layout",
+        action="append",
+        help="name of an atlas layout, can be repeated, default to every atlas layout of the project",
+    )
+    parser.add_argument("--features", help="comma separated feature IDs, default to every feature")
+    parser.add_argument("--format", default="pdf", choices=("pdf", "png", "jpeg"), help="default to pdf")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes, default to the number of CPU",
+    )
+    parser.add_argument("--force", action="store_true", help="render every feature, even without any change")
+    args = parser.parse_args(argv)
+
+    cache = OutputCache.from_environment(memory=False)
+    if cache is None:
+        _report("The output cache is disabled, set QGIS_SERVER_ATLASPRINT_CACHE and its configuration")
+        return 2
+
+    feature_ids = None
+    if args.features:
+        try:
+            feature_ids = [int(i) for i in args.features.split(",")]
+        except ValueError:
+            _report("Invalid number in --features")
+            return 2
+
+    init_worker()
+    project = QgsProject()
+    if not project.read(str(args.project.resolve())):
+        _report(f"Failed to read the project {args.project}")
+        return 2
+
+    layouts = args.layout or [
+        layout.name() for layout in project.layoutManager().printLayouts() if layout.atlas().enabled()
+    ]
+
+    errors = 0
+    with process_pool(max(1, args.processes)) as executor:
+        for layout_name in layouts:
+            errors += prerender_layout(
+                executor,
+                cache,
+                project,
+                layout_name,
+                args.format,
+                feature_ids,
+                args.force,
+            )
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
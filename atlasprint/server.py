@@ -39,7 +39,7 @@ class AtlasPrintServer:
 
     def __init__(self, server_iface: QgsServerInterface) -> None:
         self.server_iface = server_iface
-        logger.info(f'Init server version "{version()}"')
+        logger.info('Init server version "%s"', version())
 
         # noinspection PyBroadException
         try:
@@ -54,12 +54,12 @@ class AtlasPrintServer:
             reg = cast("QgsServiceRegistry", server_iface.serviceRegistry())
             reg.registerService(AtlasPrintService())
         except Exception as e:
-            logger.critical(f"Error loading filter AtlasPrint : {e}")
+            logger.critical("Error loading filter AtlasPrint : %s", e)
             raise
 
         # Add filter
         try:
             server_iface.registerFilter(AtlasPrintFilter(self.server_iface), 50)
         except Exception as e:
-            logger.critical(f"Error loading filter AtlasPrint : {e}")
+            logger.critical("Error loading filter AtlasPrint : %s", e)
             raise
@@ -21,21 +21,84 @@ __email__ = 'info@3liz.org'
 
 """
 
+import io
 import json
+import os
+import time
 import traceback
+import zipfile
 
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
+from uuid import uuid4
 
-from qgis.core import QgsExpression, QgsProject
+from qgis.core import QgsProject
 from qgis.server import QgsServerRequest, QgsServerResponse, QgsService
 from qgis.utils import pluginMetadata
 
-from .core import AtlasPrintException, parse_output_format, print_layout
+from .cache import (
+    OutputCache,
+    fingerprint,
+    page_cache_from_environment,
+    page_cache_ttl,
+    preview_cache_from_environment,
+    print_key,
+    project_path,
+)
+from .context import project_context
+from .core import (
+    LIZMAP_GROUPS_VARIABLE,
+    AtlasPrintBusy,
+    AtlasPrintException,
+    OutputFormat,
+    cache_control,
+    clean_string,
+    document_etag,
+    lizmap_groups,
+    parse_output_format,
+    print_layout,
+    print_layout_image,
+    print_layout_images,
+    print_layout_preview,
+)
+from .expressions import expression_cache
+from .flight import single_flight
+from .jobs import JobQueue, JobStatus
+from .limiter import Priority, limiter
+from .spool import spool
+from .metrics import end_request, metrics, phase, server_timing, start_request
+from .parallel import parallel_workers
 from .tools import get_lizmap_groups, get_lizmap_user_login
 
 from . import logger
 
+ENV_BATCH_MAX_JOBS = "QGIS_SERVER_ATLASPRINT_BATCH_MAX_JOBS"
+
+DEFAULT_BATCH_MAX_JOBS = 100
+
+# Values of the REQUEST parameter, the others are aggregated in the metrics as "unknown"
+REQUESTS = (
+    "getcapabilities",
+    "getprint",
+    "getpreview",
+    "getprintbatch",
+    "submitprint",
+    "getprintstatus",
+    "getprintresult",
+    "getmetrics",
+)
+
+ENV_PREVIEW_MAX_WIDTH = "QGIS_SERVER_ATLASPRINT_PREVIEW_MAX_WIDTH"
+
+DEFAULT_PREVIEW_WIDTH = 400
+DEFAULT_PREVIEW_MAX_WIDTH = 1024
+
+# Archives for the raster atlases, one image per feature and per page
+ARCHIVE_FORMATS = ("zip", "multipart")
+
+# Size of the chunks when writing a document in the response
+CHUNK_SIZE = 64 * 1024
+
 
 def write_json_response(
     data: Dict[str, Any],
@@ -45,16 +108,238 @@ def write_json_response(
     """Write data as json response"""
     response.setStatusCode(code)
     response.setHeader("Content-Type", "application/json")
+    set_server_timing(response)
     response.write(json.dumps(data))
 
 
+def set_server_timing(response: QgsServerResponse) -> None:
+    """Timings of the phases of the request, before sending the headers."""
+    value = server_timing()
+    if value:
+        response.setHeader("Server-Timing", value)
+
+
+def write_file_response(file: BinaryIO, response: QgsServerResponse, chunk_size: int = CHUNK_SIZE) -> None:
+    """Write the file in the response, chunk by chunk to keep the memory bounded."""
+    while chunk := file.read(chunk_size):
+        response.write(chunk)
+        response.flush()
+
+
+def parse_print_parameters(
+    params: Dict[str, Any],
+    lizmap_user: str,
+    lizmap_user_group: tuple,
+) -> Dict[str, Any]:
+    """Read and validate the parameters of a print request.
+
+    The keys of the returned dictionary are the arguments of `print_layout`, with `additional_params`,
+    the normalized filter for the cache keys and the archive format for a raster atlas.
+    """
+    template = params.get("TEMPLATE")
+    feature_filter = params.get("EXP_FILTER")
+    feature_ids = params.get("FEATURE_IDS")
+    scale = params.get("SCALE")
+    scales = params.get("SCALES")
+    archive = params.get("ARCHIVE", "").lower() or None
+    output_format = parse_output_format(params.get("FORMAT", params.get("format")))
+
+    if not template:
+        raise AtlasPrintException("TEMPLATE is required")
+
+    if archive and archive not in ARCHIVE_FORMATS:
+        raise AtlasPrintException(f"ARCHIVE must be one of {', '.join(ARCHIVE_FORMATS)}.")
+
+    if archive and output_format not in (OutputFormat.Png, OutputFormat.Jpeg):
+        raise AtlasPrintException("ARCHIVE is only available for PNG and JPEG.")
+
+    normalized_filter = None
+    if feature_filter:
+        # Parsed once, the parsed expression is shared with the core functions
+        expression = expression_cache.parse(feature_filter)
+        if expression.parser_error:
+            raise AtlasPrintException(f"Expression is invalid: {expression.parser_error}")
+        normalized_filter = expression.dump()
+
+    if feature_filter and feature_ids:
+        raise AtlasPrintException("EXP_FILTER and FEATURE_IDS can not be used together.")
+
+    if feature_ids:
+        try:
+            # Without duplicates, in the given order
+            feature_ids = list(dict.fromkeys(int(i) for i in feature_ids.split(",")))
+        except ValueError:
+            raise AtlasPrintException("Invalid number in FEATURE_IDS.")
+
+    if scale and scales:
+        raise AtlasPrintException("SCALE and SCALES can not be used together.")
+
+    if scale:
+        try:
+            scale = int(scale)
+        except ValueError:
+            raise AtlasPrintException("Invalid number in SCALE.")
+
+    if scales:
+        try:
+            scales = [int(scale) for scale in scales.split(",")]
+        except ValueError:
+            raise AtlasPrintException("Invalid number in SCALES.")
+
+    additional_params = {
+        k: v
+        for k, v in params.items()
+        if k.upper()
+        not in (
+            "TEMPLATE",
+            "EXP_FILTER",
+            "FEATURE_IDS",
+            "SCALE",
+            "SCALES",
+            "FORMAT",
+            "MAP",
+            "REQUEST",
+            "SERVICE",
+            "DPI",
+            "EXCEPTIONS",
+            "LAYER",
+            "LIZMAP_OVERRIDE_FILTER",
+            "TRANSPARENT",
+            "VERSION",
+            "LIZMAP_USER",
+            "LIZMAP_USER_GROUPS",  # See below for these two
+        )
+    }
+
+    if lizmap_user:
+        # Only if the user is connected
+        additional_params["lizmap_user"] = lizmap_user
+        additional_params["lizmap_user_groups"] = ",".join(lizmap_user_group)
+
+    return {
+        "layout_name": template,
+        "output_format": output_format,
+        "feature_filter": feature_filter,
+        "normalized_filter": normalized_filter,
+        "feature_ids": feature_ids,
+        "scale": scale,
+        "scales": scales,
+        "archive": archive,
+        # Set in the layout scope, see `print_layout`. The groups are an array in the project scope.
+        "variables": {"lizmap_user": lizmap_user},
+        "additional_params": additional_params,
+    }
+
+
+def batch_parameter(value: Any) -> str:
+    """Value of a parameter of a batch job as in a query string, a JSON list is a comma-separated list."""
+    if isinstance(value, list):
+        return ",".join(str(v) for v in value)
+    return str(value)
+
+
+def write_archive_response(
+    files: Iterator[Tuple[str, bytes]],
+    archive: str,
+    output_format: OutputFormat,
+    response: QgsServerResponse,
+    request_id: str,
+) -> None:
+    """Write the files in a ZIP archive or in a multipart response, each file is sent once produced.
+
+    An error while producing the files can not change the status code anymore, it is written in the
+    archive as `errors.json`, or as a last JSON part.
+    """
+    set_server_timing(response)
+    if archive == "zip":
+        response.setHeader("Content-Type", "application/zip")
+        response.setHeader("Content-Disposition", 'attachment; filename="atlasprint.zip"')
+        response.setStatusCode(200)
+        writer = ResponseWriter(response)
+        # Images are already compressed
+        with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_STORED) as zip_file:
+            try:
+                for name, data in files:
+                    zip_file.writestr(name, data)
+                    writer.flush()
+            except Exception as e:
+                error = _archive_error(e, request_id)
+                zip_file.writestr("errors.json", json.dumps(error))
+        writer.flush()
+        return
+
+    boundary = uuid4().hex
+    response.setHeader("Content-Type", f"multipart/mixed; boundary={boundary}")
+    response.setStatusCode(200)
+    try:
+        for name, data in files:
+            _write_part(response, boundary, output_format.value, name, data)
+    except Exception as e:
+        error = _archive_error(e, request_id)
+        _write_part(response, boundary, "application/json", "errors.json", json.dumps(error).encode())
+    response.write(f"--{boundary}--\r\n".encode())
+    response.flush()
+
+
+def _write_part(
+    response: QgsServerResponse, boundary: str, content_type: str, name: str, data: bytes
+) -> None:
+    headers = (
+        f"--{boundary}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f'Content-Disposition: attachment; filename="{name}"\r\n'
+        f"Content-Length: {len(data)}\r\n"
+        f"\r\n"
+    )
+    response.write(headers.encode())
+    response.write(data)
+    response.write(b"\r\n")
+    response.flush()
+
+
+def _archive_error(error: Exception, request_id: str) -> Dict[str, str]:
+    if isinstance(error, AtlasPrintException):
+        message = str(error)
+    else:
+        logger.critical("Unhandled exception:\n%s", traceback.format_exc())
+        message = "Internal 'AtlasPrint' service error"
+    logger.critical("Request-ID %s, archive interrupted: %s", request_id, message)
+    return {"status": "fail", "request_id": request_id, "message": message}
+
+
+class ResponseWriter(io.RawIOBase):
+    """Write-only and not seekable file object writing in the response, for the streamed archives."""
+
+    def __init__(self, response: QgsServerResponse) -> None:
+        super().__init__()
+        self.response = response
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:  # type: ignore [override]
+        self.response.write(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        if not self.closed:
+            self.response.flush()
+
+
 class AtlasPrintError(Exception):
-    def __init__(self, code: int, msg: str, request_id: str) -> None:
+    def __init__(
+        self,
+        code: int,
+        msg: str,
+        request_id: str,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
         super().__init__(msg)
         self.msg = msg
         self.code = code
         self.request_id = request_id
-        logger.critical(f"Atlas print request error {code}, X-Request-ID {request_id}: {msg}")
+        self.headers = headers or {}
+        logger.critical("Atlas print request error %s, X-Request-ID %s: %s", code, request_id, msg)
 
     def format_response(self, response: QgsServerResponse) -> None:
         """Format error response"""
@@ -64,13 +349,57 @@ class AtlasPrintError(Exception):
             "message": self.msg,
         }
         response.clear()
+        for name, value in self.headers.items():
+            response.setHeader(name, value)
         write_json_response(body, response, self.code)
 
 
+def error_headers(error: AtlasPrintException) -> Dict[str, str]:
+    """Headers of the response for an error from `print_layout`."""
+    if isinstance(error, AtlasPrintBusy):
+        return {"Retry-After": str(error.retry_after)}
+    return {}
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If the `If-None-Match` header of the request matches the ETag of the document.
+
+    The comparison is weak, as required for `If-None-Match`: a tag sent as `W/"..."` matches too.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def write_document_headers(
+    response: QgsServerResponse,
+    output_format: OutputFormat,
+    size: int,
+    headers: Dict[str, str],
+) -> None:
+    """Headers of a document sent with the status 200, before writing its content."""
+    set_server_timing(response)
+    for name, value in headers.items():
+        response.setHeader(name, value)
+    response.setHeader("Content-Type", output_format.value)
+    response.setHeader("Content-Length", str(size))
+    response.setStatusCode(200)
+
+
 class AtlasPrintService(QgsService):
     def __init__(self, debug: bool = False) -> None:
         super().__init__()
         _ = debug
+        self.cache = OutputCache.from_environment()
+        self.page_cache = page_cache_from_environment()
+        self.preview_cache = preview_cache_from_environment()
+        self.jobs = JobQueue.from_environment()
+        # Jobs not finished before a restart
+        self.jobs.recover()
+        # Documents left by a process killed while exporting
+        spool.start_sweeper()
 
     # QgsService inherited
 
@@ -97,51 +426,80 @@ class AtlasPrintService(QgsService):
         headers = request.headers()
         request_id = headers.get("X-Request-Id", "ND")
         params = request.parameters()
+        request_param = params.get("REQUEST", "").lower()
+        timings = start_request()
+        logger.begin_request(request_id)
 
         # noinspection PyBroadException
         try:
-            request_param = params.get("REQUEST", "").lower()
-
             if request_param == "getcapabilities":
                 self.get_capabilities(params, response, project)
-            elif request_param == "getprint":
-                # Set current Lizmap user and groups in the project before printing
+            elif request_param in ("getprint", "getprintbatch", "getpreview"):
+                # The Lizmap user is set in the layout scope of the private clone of the layout
+                lizmap_user = get_lizmap_user_login(params, headers)
+                lizmap_group = get_lizmap_groups(params, headers)
+
+                # The groups are an array, only in the project scope, during the request
+                with lizmap_groups(project, lizmap_group):
+                    if request_param == "getprint":
+                        self.get_print(
+                            params,
+                            response,
+                            project,
+                            lizmap_user,
+                            lizmap_group,
+                            request_id,
+                            if_none_match=headers.get("If-None-Match"),
+                        )
+                    elif request_param == "getpreview":
+                        self.get_preview(params, response, project, lizmap_user, lizmap_group, request_id)
+                    else:
+                        self.get_print_batch(
+                            request, response, project, lizmap_user, lizmap_group, request_id
+                        )
+
+                # The response has been sent, prepare the layouts for the next request
+                project_context(project).refill_layout_pool()
+            elif request_param == "submitprint":
                 lizmap_user = get_lizmap_user_login(params, headers)
                 lizmap_group = get_lizmap_groups(params, headers)
-                custom_var = project.customVariables()
-                if custom_var.get("lizmap_user", None) != lizmap_user:
-                    logger.info("Adding user and group variables in the QGIS project")
-                    custom_var["lizmap_user"] = lizmap_user
-                    custom_var["lizmap_user_groups"] = list(lizmap_group)  # QGIS can't store a tuple
-                    project.setCustomVariables(custom_var)  # type: ignore [arg-type]
-
-                self.get_print(params, response, project, lizmap_user, lizmap_group, request_id)
+                self.submit_print(params, response, project, lizmap_user, lizmap_group, request_id)
+            elif request_param == "getprintstatus":
+                self.get_print_status(params, response, request_id)
+            elif request_param == "getprintresult":
+                self.get_print_result(params, response, request_id)
+            elif request_param == "getmetrics":
+                self.get_metrics(response)
             else:
                 raise AtlasPrintError(
                     400,
                     f"Invalid REQUEST parameter: must be one of 'GetCapabilities', "
-                    f"'GetPrint', Request-ID {request_id}, found '{request_param}'",
+                    f"'GetPrint', 'GetPreview', 'GetPrintBatch', 'SubmitPrint', 'GetPrintStatus', 'GetPrintResult', "
+                    f"'GetMetrics', "
+                    f"Request-ID {request_id}, found '{request_param}'",
                     request_id,
                 )
 
         except AtlasPrintError as err:
             err.format_response(response)
         except Exception:
-            logger.critical(
-                f"Unhandled exception:\n{traceback.format_exc()}, X-Request-ID {request_id}",
-            )
+            logger.critical("Unhandled exception:\n%s, X-Request-ID %s", traceback.format_exc(), request_id)
             AtlasPrintError(
                 500,
                 "Internal 'AtlasPrint' service error",
                 request_id,
             ).format_response(response)
         finally:
-            # Remove previous login
-            logger.info("Removing user and group variables from the QGIS project")
-            custom_var = project.customVariables()
-            custom_var.pop("lizmap_user", None)
-            custom_var.pop("lizmap_user_groups", None)
-            project.setCustomVariables(custom_var)  # type: ignore [arg-type]
+            status = response.statusCode()
+            metrics.observe(
+                request_param if request_param in REQUESTS else "unknown",
+                # Only existing layouts, not any value sent by a client
+                params.get("TEMPLATE", "") if status < 400 else "",
+                status,
+                timings,
+            )
+            end_request()
+            logger.end_request()
 
     @staticmethod
     def get_capabilities(params: Dict[str, str], response: QgsServerResponse, project: QgsProject) -> None:
@@ -166,96 +524,516 @@ class AtlasPrintService(QgsService):
         lizmap_user: str,
         lizmap_user_group: tuple,
         request_id: str,
+        if_none_match: Optional[str] = None,
     ) -> None:
-        """Get print document"""
+        """Get print document
 
-        template = params.get("TEMPLATE")
-        feature_filter = params.get("EXP_FILTER")
-        scale = params.get("SCALE")
-        scales = params.get("SCALES")
-        output_format = parse_output_format(params.get("FORMAT", params.get("format")))
+        With the ETag of the document in `if_none_match`, the response is a `304 Not Modified`, without
+        rendering the document.
+        """
 
         try:
-            if not template:
-                raise AtlasPrintException("TEMPLATE is required")
+            with phase("parameters"):
+                parameters = parse_print_parameters(params, lizmap_user, lizmap_user_group)
+            template = parameters["layout_name"]
+            output_format = parameters["output_format"]
+            feature_filter = parameters["feature_filter"]
+            feature_ids = parameters["feature_ids"]
+            scale = parameters["scale"]
+            scales = parameters["scales"]
+            additional_params = parameters["additional_params"]
+            variables = parameters["variables"]
+
+            if parameters["archive"]:
+                images = print_layout_images(
+                    project=project,
+                    layout_name=template,
+                    output_format=output_format,
+                    scale=scale,
+                    scales=scales,
+                    feature_filter=feature_filter,
+                    feature_ids=feature_ids,
+                    request_id=request_id,
+                    variables=variables,
+                    **additional_params,
+                )
+                write_archive_response(images, parameters["archive"], output_format, response, request_id)
+                return
 
-            if feature_filter:
-                expression = QgsExpression(feature_filter)
-                if expression.hasParserError():
-                    raise AtlasPrintException(f"Expression is invalid: {expression.parserErrorString()}")
+            # Same key for the output cache and for identical requests running at once
+            key = print_key(project, parameters, lizmap_user, lizmap_user_group)
 
-            if scale and scales:
-                raise AtlasPrintException("SCALE and SCALES can not be used together.")
+            with phase("etag"):
+                etag = document_etag(project, template, key)
+            document_headers = {"ETag": etag} if etag else {}
+            control = cache_control(project, template)
+            if control:
+                document_headers["Cache-Control"] = control
+            if etag and etag_matches(if_none_match, etag):
+                logger.info("Request-ID %s, document not modified", request_id)
+                set_server_timing(response)
+                for name, value in document_headers.items():
+                    response.setHeader(name, value)
+                response.setStatusCode(304)
+                return
 
-            if scale:
-                try:
-                    scale = int(scale)
-                except ValueError:
-                    raise AtlasPrintException("Invalid number in SCALE.")
+            if self.cache:
+                with phase("cache"):
+                    cached = self.cache.get(key)
+                    if isinstance(cached, Path):
+                        try:
+                            # Keep the file open, even if it is evicted by another process in the meantime
+                            cached_file = cached.open("rb")
+                        except OSError:
+                            cached = None
+                if cached is not None:
+                    logger.info("Request-ID %s, document found in the output cache", request_id)
+                    if isinstance(cached, bytes):
+                        write_document_headers(response, output_format, len(cached), document_headers)
+                        response.write(cached)
+                        response.flush()
+                    else:
+                        with cached_file:
+                            size = os.fstat(cached_file.fileno()).st_size
+                            write_document_headers(response, output_format, size, document_headers)
+                            write_file_response(cached_file, response)
+                    return
+                logger.info("Request-ID %s, document not found in the output cache", request_id)
+
+            flight = single_flight.join(key, request_id)
+            try:
+                if not flight.leader:
+                    logger.info("Request-ID %s, waiting for the document of an identical request", request_id)
+                    with phase("flight"):
+                        shared = flight.wait()
+                    if shared:
+                        with shared:
+                            size = os.fstat(shared.fileno()).st_size
+                            write_document_headers(response, output_format, size, document_headers)
+                            write_file_response(shared, response)
+                        return
 
-            if scales:
+                if output_format in (OutputFormat.Png, OutputFormat.Jpeg):
+                    # Raster formats are rendered in memory, without a temporary file
+                    image = print_layout_image(
+                        project=project,
+                        layout_name=params["TEMPLATE"],
+                        output_format=output_format,
+                        scale=scale,
+                        scales=scales,
+                        feature_filter=feature_filter,
+                        feature_ids=feature_ids,
+                        request_id=request_id,
+                        variables=variables,
+                        **additional_params,
+                    )
+                    flight.publish_bytes(image)
+                else:
+                    output_path = print_layout(
+                        project=project,
+                        layout_name=params["TEMPLATE"],
+                        output_format=output_format,
+                        scale=scale,
+                        scales=scales,
+                        feature_filter=feature_filter,
+                        feature_ids=feature_ids,
+                        request_id=request_id,
+                        variables=variables,
+                        page_cache=self.page_cache,
+                        workers=parallel_workers(),
+                        **additional_params,
+                    )
+                    flight.publish(output_path)
+            finally:
+                # The followers do not wait for the response of the leader
+                flight.release()
+
+            if output_format in (OutputFormat.Png, OutputFormat.Jpeg):
+                if self.cache:
+                    try:
+                        self.cache.put_bytes(key, image)
+                    except OSError as e:
+                        logger.warning(
+                            "Request-ID %s, document not stored in the output cache: %s", request_id, e
+                        )
+
+                write_document_headers(response, output_format, len(image), document_headers)
                 try:
-                    scales = [int(scale) for scale in scales.split(",")]
-                except ValueError:
-                    raise AtlasPrintException("Invalid number in SCALES.")
-
-            additional_params = {
-                k: v
-                for k, v in params.items()
-                if k.upper()
-                not in (
-                    "TEMPLATE",
-                    "EXP_FILTER",
-                    "SCALE",
-                    "SCALES",
-                    "FORMAT",
-                    "MAP",
-                    "REQUEST",
-                    "SERVICE",
-                    "DPI",
-                    "EXCEPTIONS",
-                    "LAYER",
-                    "LIZMAP_OVERRIDE_FILTER",
-                    "TRANSPARENT",
-                    "VERSION",
-                    "LIZMAP_USER",
-                    "LIZMAP_USER_GROUPS",  # See below for these two
-                )
-            }
-
-            if lizmap_user:
-                # Only if the user is connected
-                additional_params["lizmap_user"] = lizmap_user
-                additional_params["lizmap_user_groups"] = ",".join(lizmap_user_group)
-
-            output_path = print_layout(
-                project=project,
-                layout_name=params["TEMPLATE"],
-                output_format=output_format,
-                scale=scale,
-                scales=scales,
-                feature_filter=feature_filter,
-                request_id=request_id,
-                **additional_params,
-            )
+                    response.write(image)
+                    response.flush()
+                finally:
+                    flight.retire()
+                return
         except AtlasPrintException as e:
             raise AtlasPrintError(
-                400, f"ATLAS - Error from the user while generating the PDF: {e}", request_id
+                e.code,
+                f"ATLAS - Error from the user while generating the PDF: {e}",
+                request_id,
+                error_headers(e),
             )
         except Exception:
-            logger.critical(f"Unhandled exception:\n{traceback.format_exc()}")
+            logger.critical("Unhandled exception:\n%s", traceback.format_exc())
             raise AtlasPrintError(500, "Internal 'AtlasPrint' service error", request_id)
 
         path = Path(output_path)
         if not path.exists():
             raise AtlasPrintError(404, f"ATLAS {output_format.name} not found", request_id)
 
+        if self.cache:
+            try:
+                with phase("store"):
+                    self.cache.put(key, path)
+            except OSError as e:
+                logger.warning("Request-ID %s, document not stored in the output cache: %s", request_id, e)
+
         # Send PDF
-        response.setHeader("Content-Type", output_format.value)
-        response.setStatusCode(200)
+        write_document_headers(response, output_format, path.stat().st_size, document_headers)
         try:
-            response.write(path.read_bytes())
-            path.unlink()
+            with path.open("rb") as f:
+                write_file_response(f, response)
         except Exception:
-            logger.critical(f"Error occurred while reading {output_format.name} file")
+            logger.critical("Error occurred while reading %s file", output_format.name)
             raise
+        finally:
+            # Even if the client is gone while writing the response
+            path.unlink(missing_ok=True)
+            flight.retire()
+
+    def submit_print(
+        self,
+        params: Dict[str, Any],
+        response: QgsServerResponse,
+        project: QgsProject,
+        lizmap_user: str,
+        lizmap_user_group: tuple,
+        request_id: str,
+    ) -> None:
+        """Queue a print job, rendered in the background"""
+        try:
+            parameters = parse_print_parameters(params, lizmap_user, lizmap_user_group)
+            if not Path(project.fileName()).is_file():
+                raise AtlasPrintException("SubmitPrint is only available for a project stored in a file.")
+        except AtlasPrintException as e:
+            raise AtlasPrintError(
+                e.code,
+                f"ATLAS - Error from the user while submitting the job: {e}",
+                request_id,
+                error_headers(e),
+            )
+
+        job_id = self.jobs.submit(
+            request_id,
+            project=project.fileName(),
+            layout=parameters["layout_name"],
+            format=parameters["output_format"].name,
+            filter=parameters["feature_filter"],
+            feature_ids=parameters["feature_ids"],
+            scales=parameters["scales"],
+            scale=parameters["scale"],
+            params=parameters["additional_params"],
+            variables=parameters["variables"],
+            project_variables={LIZMAP_GROUPS_VARIABLE: list(lizmap_user_group)},
+        )
+        body = {
+            "status": "success",
+            "request_id": request_id,
+            "job": job_id,
+        }
+        write_json_response(body, response, 202)
+
+    def _job(self, params: Dict[str, Any], request_id: str) -> Dict[str, Any]:
+        job_id = params.get("JOB")
+        if not job_id:
+            raise AtlasPrintError(400, "ATLAS - JOB is required", request_id)
+        record = self.jobs.status(job_id)
+        if record is None:
+            raise AtlasPrintError(404, f"ATLAS - Job {job_id} not found", request_id)
+        return record
+
+    def get_print_status(self, params: Dict[str, Any], response: QgsServerResponse, request_id: str) -> None:
+        """Progress of a print job"""
+        record = self._job(params, request_id)
+        body = {
+            "status": "success",
+            "request_id": request_id,
+            "job": record["id"],
+            "state": record["status"],
+            "pages_done": record["pages_done"],
+            "pages_total": record["pages_total"],
+        }
+        if record["status"] == JobStatus.Failed.value:
+            body["message"] = record["error"]
+        write_json_response(body, response)
+
+    def get_print_result(self, params: Dict[str, Any], response: QgsServerResponse, request_id: str) -> None:
+        """Document of a finished print job"""
+        record = self._job(params, request_id)
+        if record["status"] == JobStatus.Failed.value:
+            raise AtlasPrintError(record["error_code"], f"ATLAS - Job failed: {record['error']}", request_id)
+
+        path = self.jobs.result(record["id"])
+        if path is None:
+            raise AtlasPrintError(409, f"ATLAS - Job {record['id']} is not finished yet", request_id)
+
+        try:
+            # Keep the file open, even if the job expires in the meantime
+            f = path.open("rb")
+        except OSError:
+            raise AtlasPrintError(404, f"ATLAS - Job {record['id']} not found", request_id)
+
+        with f:
+            response.setHeader("Content-Type", OutputFormat[record["format"]].value)
+            response.setHeader("Content-Length", str(os.fstat(f.fileno()).st_size))
+            response.setStatusCode(200)
+            write_file_response(f, response)
+
+    def get_print_batch(
+        self,
+        request: QgsServerRequest,
+        response: QgsServerResponse,
+        project: QgsProject,
+        lizmap_user: str,
+        lizmap_user_group: tuple,
+        request_id: str,
+    ) -> None:
+        """Get many print documents in a ZIP archive, streamed document by document"""
+        try:
+            try:
+                body = json.loads(bytes(request.data()).decode("utf-8"))
+                jobs = body["jobs"]
+            except (ValueError, KeyError, TypeError):
+                raise AtlasPrintException("GetPrintBatch requires a JSON body with a list of `jobs`.")
+            if not isinstance(jobs, list) or not jobs:
+                raise AtlasPrintException("GetPrintBatch requires a JSON body with a list of `jobs`.")
+
+            max_jobs = int(os.getenv(ENV_BATCH_MAX_JOBS, DEFAULT_BATCH_MAX_JOBS))
+            if len(jobs) > max_jobs:
+                raise AtlasPrintException(f"Too many jobs in the batch, {len(jobs)} > {max_jobs}.")
+
+            # Everything is validated before sending the first byte
+            batch = []
+            names = set()
+            for number, job in enumerate(jobs, start=1):
+                if not isinstance(job, dict):
+                    raise AtlasPrintException(f"Job {number} is not a JSON object.")
+                job_params = {str(k).upper(): batch_parameter(v) for k, v in job.items()}
+                name = job_params.pop("NAME", None)
+                try:
+                    parameters = parse_print_parameters(job_params, lizmap_user, lizmap_user_group)
+                except AtlasPrintException as e:
+                    raise AtlasPrintException(f"Job {number}: {e}")
+                name = clean_string(name or f"{number:03d}_{parameters['layout_name']}")
+                file_name = f"{name}.{parameters['output_format'].name.lower()}"
+                if file_name in names:
+                    raise AtlasPrintException(f"Job {number}: the name `{name}` is already used.")
+                names.add(file_name)
+                batch.append((file_name, parameters))
+        except AtlasPrintException as e:
+            raise AtlasPrintError(
+                e.code,
+                f"ATLAS - Error from the user while generating the batch: {e}",
+                request_id,
+                error_headers(e),
+            )
+
+        set_server_timing(response)
+        response.setHeader("Content-Type", "application/zip")
+        response.setHeader("Content-Disposition", 'attachment; filename="atlasprint.zip"')
+        response.setStatusCode(200)
+
+        errors = {}
+        writer = ResponseWriter(response)
+        # Documents are already compressed
+        with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_STORED) as archive:
+            for file_name, parameters in batch:
+                try:
+                    self._write_batch_document(archive, writer, file_name, project, parameters, request_id)
+                except AtlasPrintException as e:
+                    errors[file_name] = str(e)
+                except Exception:
+                    logger.critical("Unhandled exception:\n%s", traceback.format_exc())
+                    errors[file_name] = "Internal 'AtlasPrint' service error"
+            if errors:
+                # The status code has already been sent
+                archive.writestr("errors.json", json.dumps(errors))
+        writer.flush()
+
+    def _write_batch_document(
+        self,
+        archive: zipfile.ZipFile,
+        writer: ResponseWriter,
+        file_name: str,
+        project: QgsProject,
+        parameters: Dict[str, Any],
+        request_id: str,
+    ) -> None:
+        kwargs = {
+            k: v
+            for k, v in parameters.items()
+            if k not in ("normalized_filter", "archive", "additional_params")
+        }
+        kwargs.update(parameters["additional_params"])
+
+        if parameters["output_format"] in (OutputFormat.Png, OutputFormat.Jpeg):
+            archive.writestr(file_name, print_layout_image(project=project, request_id=request_id, **kwargs))
+            writer.flush()
+            return
+
+        path = print_layout(
+            project=project,
+            request_id=request_id,
+            page_cache=self.page_cache,
+            workers=parallel_workers(),
+            **kwargs,
+        )
+        try:
+            with path.open("rb") as f, archive.open(file_name, "w") as entry:
+                while chunk := f.read(CHUNK_SIZE):
+                    entry.write(chunk)
+                    writer.flush()
+        finally:
+            path.unlink(missing_ok=True)
+        writer.flush()
+
+    def get_preview(
+        self,
+        params: Dict[str, Any],
+        response: QgsServerResponse,
+        project: QgsProject,
+        lizmap_user: str,
+        lizmap_user_group: tuple,
+        request_id: str,
+    ) -> None:
+        """Get a small image of the first page of the atlas"""
+        params = dict(params)
+        width = params.pop("WIDTH", None)
+        try:
+            parameters = parse_print_parameters(params, lizmap_user, lizmap_user_group)
+            max_width = int(os.getenv(ENV_PREVIEW_MAX_WIDTH, DEFAULT_PREVIEW_MAX_WIDTH))
+            try:
+                width = int(width) if width else DEFAULT_PREVIEW_WIDTH
+            except ValueError:
+                raise AtlasPrintException("Invalid number in WIDTH.")
+            if not 0 < width <= max_width:
+                raise AtlasPrintException(f"WIDTH must be between 1 and {max_width}.")
+
+            output_format = parameters["output_format"]
+            if output_format not in (OutputFormat.Png, OutputFormat.Jpeg):
+                output_format = OutputFormat.Png
+
+            image: Optional[bytes] = None
+            cache_key = None
+            if self.preview_cache:
+                # With the coverage layer, not always visible
+                data_version = project_context(project).layout_data_version(parameters["layout_name"])
+                cache_key = fingerprint(
+                    project=project_path(project),
+                    project_modified=project.lastModified().toMSecsSinceEpoch(),
+                    # Without a known version of the data, previews are kept for a limited time
+                    data_version=data_version or int(time.time() // page_cache_ttl()),
+                    layout=parameters["layout_name"],
+                    filter=parameters["normalized_filter"],
+                    feature_ids=parameters["feature_ids"],
+                    width=width,
+                    format=output_format.name,
+                    params=parameters["additional_params"],
+                    lizmap_user=lizmap_user,
+                    lizmap_user_groups=lizmap_user_group,
+                )
+                with phase("cache"):
+                    cached = self.preview_cache.get(cache_key)
+                if isinstance(cached, bytes):
+                    logger.info("Request-ID %s, preview found in the cache", request_id)
+                    image = cached
+
+            if image is None:
+                image = print_layout_preview(
+                    project=project,
+                    layout_name=parameters["layout_name"],
+                    width=width,
+                    output_format=output_format,
+                    feature_filter=parameters["feature_filter"],
+                    feature_ids=parameters["feature_ids"],
+                    request_id=request_id,
+                    variables=parameters["variables"],
+                    **parameters["additional_params"],
+                )
+                if self.preview_cache and cache_key:
+                    self.preview_cache.put_bytes(cache_key, image)
+        except AtlasPrintException as e:
+            raise AtlasPrintError(
+                e.code,
+                f"ATLAS - Error from the user while generating the preview: {e}",
+                request_id,
+                error_headers(e),
+            )
+
+        set_server_timing(response)
+        response.setHeader("Content-Type", output_format.value)
+        response.setHeader("Content-Length", str(len(image)))
+        response.setStatusCode(200)
+        response.write(image)
+        response.flush()
+
+    def get_metrics(self, response: QgsServerResponse) -> None:
+        """Metrics of the QGIS Server process, in the Prometheus text format"""
+        counters: Dict[str, Tuple[str, float]] = {
+            "atlasprint_expression_cache_items": ("Expressions in the cache.", len(expression_cache)),
+        }
+        for name, cache in (
+            ("output", self.cache),
+            ("page", self.page_cache),
+            ("preview", self.preview_cache),
+        ):
+            if not cache:
+                continue
+            stats = cache.stats()
+            counters[f"atlasprint_{name}_cache_hits_total"] = (f"Hits in the {name} cache.", stats["hits"])
+            counters[f"atlasprint_{name}_cache_misses_total"] = (
+                f"Misses in the {name} cache.",
+                stats["misses"],
+            )
+            counters[f"atlasprint_{name}_cache_evictions_total"] = (
+                f"Evictions from the {name} cache.",
+                stats["evictions"],
+            )
+            counters[f"atlasprint_{name}_cache_disk_bytes"] = (
+                f"Size of the documents in the {name} cache on disk.",
+                stats["disk_bytes"],
+            )
+
+        counters["atlasprint_spool_bytes"] = ("Size of the documents in the spool directory.", spool.usage())
+        counters["atlasprint_spool_swept_total"] = ("Files removed from the spool directory.", spool.swept)
+        counters["atlasprint_spool_refused_total"] = (
+            "Exports refused with the spool directory above the quota.",
+            spool.refused,
+        )
+
+        for priority in Priority:
+            if not limiter.enabled(priority):
+                continue
+            name = priority.value
+            counters[f"atlasprint_{name}_queue_depth"] = (
+                f"Exports of the node waiting for a {name} slot.",
+                limiter.queue_depth(priority),
+            )
+            counters[f"atlasprint_{name}_slots_busy"] = (
+                f"{name.capitalize()} slots of the node in use.",
+                limiter.busy(priority),
+            )
+            counters[f"atlasprint_{name}_queued_total"] = (
+                f"Exports which waited for a {name} slot.",
+                limiter.queued[priority],
+            )
+            counters[f"atlasprint_{name}_queue_wait_seconds_total"] = (
+                f"Time spent waiting for a {name} slot.",
+                limiter.wait_seconds[priority],
+            )
+            counters[f"atlasprint_{name}_rejected_total"] = (
+                f"Exports rejected without a {name} slot before the timeout.",
+                limiter.rejected[priority],
+            )
+
+        response.setStatusCode(200)
+        response.setHeader("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        response.write(metrics.prometheus(counters))
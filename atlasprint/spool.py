@@ -0,0 +1,115 @@
+"""Directory of the documents being exported, before they are sent in the response.
+
+Documents are removed once sent, a background thread removes the files left by a process killed in the
+meantime. New exports are refused while the size of the directory is above the quota.
+"""
+
+import os
+import tempfile
+import threading
+import time
+
+from pathlib import Path
+from typing import Optional
+
+from . import logger
+
+ENV_SPOOL_DIR = "QGIS_SERVER_ATLASPRINT_SPOOL_DIR"
+ENV_SPOOL_QUOTA = "QGIS_SERVER_ATLASPRINT_SPOOL_QUOTA"
+ENV_SPOOL_MAX_AGE = "QGIS_SERVER_ATLASPRINT_SPOOL_MAX_AGE"
+ENV_SPOOL_SWEEP_INTERVAL = "QGIS_SERVER_ATLASPRINT_SPOOL_SWEEP_INTERVAL"
+
+DEFAULT_SPOOL_QUOTA = 0
+DEFAULT_SPOOL_MAX_AGE = 3600
+DEFAULT_SPOOL_SWEEP_INTERVAL = 300
+
+
+class Spool:
+    def __init__(self, directory: Path, quota: int, max_age: int, sweep_interval: int) -> None:
+        self.directory = directory
+        # Maximum size of the directory in bytes, 0 without any limit
+        self.quota = quota
+        # Files older than this number of seconds are removed by the sweeper
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        # Statistics of the process
+        self.swept = 0
+        self.refused = 0
+        self._sweeper: Optional[threading.Thread] = None
+        directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_environment(cls) -> "Spool":
+        directory = os.getenv(ENV_SPOOL_DIR)
+        return cls(
+            Path(directory) if directory else Path(tempfile.gettempdir()).joinpath("atlasprint_spool"),
+            quota=int(os.getenv(ENV_SPOOL_QUOTA, DEFAULT_SPOOL_QUOTA)),
+            max_age=int(os.getenv(ENV_SPOOL_MAX_AGE, DEFAULT_SPOOL_MAX_AGE)),
+            sweep_interval=int(os.getenv(ENV_SPOOL_SWEEP_INTERVAL, DEFAULT_SPOOL_SWEEP_INTERVAL)),
+        )
+
+    def path(self, name: str) -> Path:
+        return self.directory.joinpath(name)
+
+    def usage(self) -> int:
+        """Size of the files in the directory, in bytes, a file with several links is counted once."""
+        size = 0
+        linked = set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    if stat.st_nlink > 1:
+                        if stat.st_ino in linked:
+                            continue
+                        linked.add(stat.st_ino)
+                    size += stat.st_size
+                except FileNotFoundError:
+                    # Removed in the meantime
+                    continue
+        return size
+
+    def full(self) -> bool:
+        """If the size of the directory is above the quota, a new export must be refused."""
+        if not self.quota or self.usage() < self.quota:
+            return False
+        self.refused += 1
+        return True
+
+    def sweep(self) -> int:
+        """Remove the files older than the maximum age, return the number of files removed."""
+        limit = time.time() - self.max_age
+        count = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and entry.stat().st_mtime < limit:
+                        os.unlink(entry.path)
+                        count += 1
+                except FileNotFoundError:
+                    continue
+        if count:
+            logger.info("%s files removed from the spool directory %s", count, self.directory)
+        self.swept += count
+        return count
+
+    def start_sweeper(self) -> None:
+        """Sweep the directory in a background thread, every `sweep_interval` seconds."""
+        if self._sweeper or self.sweep_interval <= 0:
+            return
+
+        def run() -> None:
+            while True:
+                try:
+                    self.sweep()
+                except OSError as e:
+                    logger.warning("Error while sweeping the spool directory %s: %s", self.directory, e)
+                time.sleep(self.sweep_interval)
+
+        self._sweeper = threading.Thread(target=run, name="atlasprint-spool-sweeper", daemon=True)
+        self._sweeper.start()
+
+
+spool = Spool.from_environment()
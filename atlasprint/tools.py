@@ -58,20 +58,20 @@ def get_lizmap_groups(params: Dict[str, str], headers: Dict[str, str]) -> Tuple[
 
     # Get Lizmap User Groups in request headers
     if headers:
-        logger.info("Request headers provided")
+        logger.debug("Request headers provided")
         # Get Lizmap user groups defined in request headers
         user_groups = headers.get("X-Lizmap-User-Groups")
         if user_groups is not None:
             groups = [g.strip() for g in user_groups.split(",")]
-            logger.info("Lizmap user groups in request headers : {}".format(",".join(groups)))
+            logger.debug("Lizmap user groups in request headers : %s", ",".join(groups))
     else:
-        logger.info("No request headers provided")
+        logger.debug("No request headers provided")
 
     if len(groups) != 0:
         # noinspection PyTypeChecker
         return tuple(groups)
 
-    logger.info("No lizmap user groups in request headers")
+    logger.debug("No lizmap user groups in request headers")
 
     # Get group in parameters
     if params:
@@ -79,7 +79,7 @@ def get_lizmap_groups(params: Dict[str, str], headers: Dict[str, str]) -> Tuple[
         user_groups = params.get("LIZMAP_USER_GROUPS")
         if user_groups is not None:
             groups = [g.strip() for g in user_groups.split(",")]
-            logger.info("Lizmap user groups in parameters : {}".format(",".join(groups)))
+            logger.debug("Lizmap user groups in parameters : %s", ",".join(groups))
 
     # noinspection PyTypeChecker
     return tuple(groups)
@@ -97,19 +97,19 @@ def get_lizmap_user_login(params: Dict[str, str], headers: Dict[str, str]) -> st
 
     # Get Lizmap User Login in request headers
     if headers:
-        logger.info("Request headers provided")
+        logger.debug("Request headers provided")
         # Get Lizmap user login defined in request headers
         user_login = headers.get("X-Lizmap-User")
         if user_login is not None:
             login = user_login
-            logger.info(f"Lizmap user login in request headers : {login}")
+            logger.debug("Lizmap user login in request headers : %s", login)
     else:
-        logger.info("No request headers provided")
+        logger.debug("No request headers provided")
 
     if login:
         return login
 
-    logger.info("No lizmap user login in request headers")
+    logger.debug("No lizmap user login in request headers")
 
     # Get login in parameters
     if params:
@@ -117,6 +117,6 @@ def get_lizmap_user_login(params: Dict[str, str], headers: Dict[str, str]) -> st
         user_login = params.get("LIZMAP_USER")
         if user_login is not None:
             login = user_login
-            logger.info(f"Lizmap user login in parameters : {login}")
+            logger.debug("Lizmap user login in parameters : %s", login)
 
     return login
@@ -0,0 +1,227 @@
+"""Benchmark GetPrint with a synthetic project.
+
+Not collected with the tests, run it explicitly:
+
+    pytest tests/benchmarks/bench_getprint.py
+
+Compare two runs with `python tests/benchmarks/compare.py before.json after.json`.
+"""
+
+import resource
+import statistics
+import time
+
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from ..core.client import Client
+from .conftest import BENCHMARK_FEATURES, BENCHMARK_ROUNDS
+from .generator import layout_name
+
+PAGE_COUNTS = [n for n in (1, 10, 100) if n <= BENCHMARK_FEATURES]
+
+
+def _reset_peak_rss() -> int:
+    """Reset the peak resident memory of the process, on Linux, return the peak of the session if not possible.
+
+    Without a reset, the peak of a case is its increase of the peak of the session, 0 if it used less memory
+    than a previous case.
+    """
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+        return 0
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _peak_rss(start: int) -> int:
+    """Peak resident memory of the process since the reset, in KB, on Linux."""
+    if not start:
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+    return max(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start)
+
+
+def _run(
+    client: Client,
+    project: Path,
+    query: str,
+    content_type: str,
+) -> Tuple[List[float], int]:
+    """Timings of the runs, the first one to warm up, and the peak resident memory of the case in KB.
+
+    The memory of the worker processes is not included.
+    """
+    timings = []
+    start = _reset_peak_rss()
+    # The first run warms up the project context, the layouts and the expressions
+    for _ in range(BENCHMARK_ROUNDS + 1):
+        begin = time.perf_counter()
+        rv = client.get(query, str(project))
+        timings.append(time.perf_counter() - begin)
+        assert rv.status_code == 200, rv.content[:500]
+        assert rv.headers.get("Content-Type", "").find(content_type) == 0
+    return timings, _peak_rss(start)
+
+
+def _record(
+    results: List[Dict[str, Any]],
+    case: str,
+    run: Tuple[List[float], int],
+    **parameters: Any,
+) -> None:
+    timings, peak_rss = run
+    warmup, measured = timings[0], timings[1:]
+    results.append(
+        {
+            "case": case,
+            **parameters,
+            "warmup": warmup,
+            "min": min(measured),
+            "median": statistics.median(measured),
+            "max": max(measured),
+            "peak_rss_kb": peak_rss,
+        }
+    )
+
+
+@pytest.mark.parametrize("page_size", ["A4", "A3"])
+@pytest.mark.parametrize("pages", PAGE_COUNTS)
+@pytest.mark.parametrize("output_format", ["pdf", "png"])
+def test_getprint(
+    client: Client,
+    synthetic_project: Path,
+    benchmark_results: List[Dict[str, Any]],
+    output_format: str,
+    pages: int,
+    page_size: str,
+):
+    """Latency by format, number of pages and page size, with EXP_FILTER."""
+    query = (
+        f"?SERVICE=ATLAS&REQUEST=GetPrint&MAP={synthetic_project}&TEMPLATE={layout_name(page_size)}"
+        f"&FORMAT={output_format}&EXP_FILTER=id <= {pages}"
+    )
+    content_type = "application/pdf"
+    if output_format == "png":
+        # Every page of the atlas
+        query += "&ARCHIVE=zip"
+        content_type = "application/zip"
+
+    run = _run(client, synthetic_project, query, content_type)
+    _record(
+        benchmark_results,
+        f"getprint-{output_format}-{pages}p-{page_size}",
+        run,
+        format=output_format,
+        pages=pages,
+        page_size=page_size,
+    )
+
+
+@pytest.mark.parametrize("pages", PAGE_COUNTS)
+@pytest.mark.parametrize("selection", ["feature-ids", "id-filter"])
+def test_getprint_feature_ids(
+    client: Client,
+    synthetic_project: Path,
+    benchmark_results: List[Dict[str, Any]],
+    selection: str,
+    pages: int,
+):
+    """Latency with FEATURE_IDS, to compare with the same features selected by `$id IN (...)`."""
+    feature_ids = ",".join(str(i) for i in range(1, pages + 1))
+    query = f"?SERVICE=ATLAS&REQUEST=GetPrint&MAP={synthetic_project}&TEMPLATE={layout_name('A4')}&FORMAT=pdf"
+    if selection == "feature-ids":
+        query += f"&FEATURE_IDS={feature_ids}"
+    else:
+        query += f"&EXP_FILTER=$id IN ({feature_ids})"
+    run = _run(client, synthetic_project, query, "application/pdf")
+    _record(
+        benchmark_results,
+        f"getprint-{selection}-{pages}p-A4",
+        run,
+        format="pdf",
+        pages=pages,
+        page_size="A4",
+    )
+
+
+@pytest.mark.parametrize("canvas", ["before", "after"])
+def test_getprint_canvas(
+    client: Client,
+    synthetic_project: Path,
+    benchmark_results: List[Dict[str, Any]],
+    monkeypatch: pytest.MonkeyPatch,
+    canvas: str,
+):
+    """Latency of a single page, with the map canvas built for each request before, without it after."""
+    if canvas == "before":
+        from qgis.gui import QgsLayerTreeMapCanvasBridge, QgsMapCanvas
+
+        from atlasprint import core
+
+        prepare_layout = core._prepare_layout
+
+        def prepare_layout_with_canvas(project, *args, **kwargs):
+            map_canvas = QgsMapCanvas()
+            bridge = QgsLayerTreeMapCanvasBridge(project.layerTreeRoot(), map_canvas)
+            bridge.setCanvasLayers()
+            return prepare_layout(project, *args, **kwargs)
+
+        monkeypatch.setattr(core, "_prepare_layout", prepare_layout_with_canvas)
+
+    query = (
+        f"?SERVICE=ATLAS&REQUEST=GetPrint&MAP={synthetic_project}&TEMPLATE={layout_name('A4')}"
+        "&FORMAT=pdf&FEATURE_IDS=1"
+    )
+    run = _run(client, synthetic_project, query, "application/pdf")
+    _record(
+        benchmark_results,
+        f"getprint-canvas-{canvas}-1p-A4",
+        run,
+        format="pdf",
+        pages=1,
+        page_size="A4",
+    )
+
+
+@pytest.mark.parametrize("workers", [0, 2, 4])
+def test_getprint_parallel(
+    client: Client,
+    synthetic_project: Path,
+    benchmark_results: List[Dict[str, Any]],
+    monkeypatch: pytest.MonkeyPatch,
+    workers: int,
+):
+    """Latency of the largest atlas exported by worker processes, to compare with 0 workers."""
+    pytest.importorskip("pypdf")
+    from atlasprint.parallel import reset_executor
+
+    pages = PAGE_COUNTS[-1]
+    monkeypatch.setenv("QGIS_SERVER_ATLASPRINT_PARALLEL_WORKERS", str(workers))
+    monkeypatch.setenv("QGIS_SERVER_ATLASPRINT_PARALLEL_CHUNK_SIZE", str(max(1, pages // 4)))
+    query = (
+        f"?SERVICE=ATLAS&REQUEST=GetPrint&MAP={synthetic_project}&TEMPLATE={layout_name('A4')}"
+        f"&FORMAT=pdf&EXP_FILTER=id <= {pages}"
+    )
+    # The worker processes are started with the first run, as the warm up
+    reset_executor()
+    try:
+        run = _run(client, synthetic_project, query, "application/pdf")
+    finally:
+        reset_executor()
+    _record(
+        benchmark_results,
+        f"getprint-parallel-{workers}w-{pages}p-A4",
+        run,
+        format="pdf",
+        pages=pages,
+        page_size="A4",
+        workers=workers,
+    )
@@ -0,0 +1,61 @@
+"""Benchmark the cost of the log calls on the path of a request.
+
+pytest tests/benchmarks/bench_logger.py
+"""
+
+import timeit
+
+from typing import Any, Dict, List
+
+import pytest
+
+from atlasprint import logger
+
+CALLS = 100_000
+
+
+def _eager(message: str) -> None:
+    """The logger before the levels: the message is always sent."""
+    logger.QgsMessageLog.logMessage(message, logger.PLUGIN, logger.Qgis.MessageLevel.Info)
+
+
+@pytest.fixture
+def level():
+    previous = logger._level
+    yield
+    logger.set_level(previous)
+    logger.set_buffered(False)
+    # Drop the buffered messages
+    logger._records = None
+
+
+@pytest.mark.parametrize("mode", ["eager", "disabled", "enabled", "buffered"])
+def test_logger(level, benchmark_results: List[Dict[str, Any]], mode: str):
+    """Duration of a debug message with a few arguments, as in `print_layout`."""
+    request_id = "0123456789abcdef"
+    feature_ids = list(range(20))
+
+    if mode == "eager":
+
+        def call():
+            _eager(f"Request-ID {request_id}, printing the feature IDs {feature_ids}")
+
+    else:
+        logger.set_level(logger.Level.INFO if mode == "disabled" else logger.Level.DEBUG)
+        logger.set_buffered(mode == "buffered")
+        logger.begin_request(request_id)
+
+        def call():
+            logger.debug("Request-ID %s, printing the feature IDs %s", request_id, feature_ids)
+
+    timings = [t / CALLS for t in timeit.repeat(call, number=CALLS, repeat=5)]
+    benchmark_results.append(
+        {
+            "case": f"logger-{mode}",
+            "calls": CALLS,
+            "min": min(timings),
+            "median": sorted(timings)[len(timings) // 2],
+            "max": max(timings),
+            "peak_rss_kb": 0,
+        }
+    )
@@ -0,0 +1,62 @@
+"""Compare two benchmark results, exit with an error if a case is slower than the threshold.
+
+python tests/benchmarks/compare.py before.json after.json --threshold 10
+"""
+
+import argparse
+import json
+import sys
+
+from pathlib import Path
+from typing import Any, Dict
+
+
+def _cases(path: Path) -> Dict[str, Dict[str, Any]]:
+    with path.open() as f:
+        report = json.load(f)
+    return {result["case"]: result for result in report["results"]}
+
+
+def compare(before: Path, after: Path, threshold: float) -> int:
+    """Print the differences of the median latency and of the peak memory, return the number of regressions."""
+    old, new = _cases(before), _cases(after)
+    regressions = 0
+    print(f"{'case':<40} {'before (s)':>11} {'after (s)':>11} {'diff':>8} {'rss diff (MB)':>14}")
+    for case in sorted(old.keys() & new.keys()):
+        a, b = old[case], new[case]
+        diff = (b["median"] - a["median"]) / a["median"] * 100 if a["median"] else 0.0
+        rss = (b["peak_rss_kb"] - a["peak_rss_kb"]) / 1024
+        flag = ""
+        if diff > threshold:
+            regressions += 1
+            flag = " !"
+        print(f"{case:<40} {a['median']:>11.3f} {b['median']:>11.3f} {diff:>+7.1f}% {rss:>+14.1f}{flag}")
+
+    for case in sorted(old.keys() - new.keys()):
+        print(f"{case:<40} missing in {after}")
+    for case in sorted(new.keys() - old.keys()):
+        print(f"{case:<40} new in {after}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="slowdown of the median latency in percent to report a regression, default to 10",
+    )
+    args = parser.parse_args()
+
+    regressions = compare(args.before, args.after, args.threshold)
+    if regressions:
+        print(f"{regressions} cases slower than {args.threshold}%")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import pytest
+
+from qgis.core import Qgis
+
+from .generator import generate_project
+
+# Size of the synthetic project, the features are also the largest atlas printed
+BENCHMARK_FEATURES = int(os.getenv("ATLASPRINT_BENCHMARK_FEATURES", "100"))
+BENCHMARK_LAYERS = int(os.getenv("ATLASPRINT_BENCHMARK_LAYERS", "3"))
+BENCHMARK_LABELS = int(os.getenv("ATLASPRINT_BENCHMARK_LABELS", "5"))
+
+# Number of measured runs for each case, after a first run to warm up the caches
+BENCHMARK_ROUNDS = int(os.getenv("ATLASPRINT_BENCHMARK_ROUNDS", "3"))
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+@pytest.fixture(scope="session")
+def synthetic_project(output_dir: Path) -> Path:
+    """Path of the synthetic project, generated once."""
+    return generate_project(
+        output_dir.joinpath("benchmarks"),
+        features=BENCHMARK_FEATURES,
+        layers=BENCHMARK_LAYERS,
+        labels=BENCHMARK_LABELS,
+    )
+
+
+@pytest.fixture(scope="session")
+def benchmark_results(output_dir: Path) -> Iterator[List[Dict[str, Any]]]:
+    """Results of the cases, written as JSON at the end of the session."""
+    results: List[Dict[str, Any]] = []
+    yield results
+
+    output = Path(os.getenv("ATLASPRINT_BENCHMARK_OUTPUT", output_dir.joinpath("benchmarks.json")))
+    report = {
+        "metadata": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _commit(),
+            "qgis": Qgis.version(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "features": BENCHMARK_FEATURES,
+            "layers": BENCHMARK_LAYERS,
+            "labels": BENCHMARK_LABELS,
+            "rounds": BENCHMARK_ROUNDS,
+        },
+        "results": results,
+    }
+    with output.open("w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nBenchmark results written in {output}")
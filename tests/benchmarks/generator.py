@@ -0,0 +1,145 @@
+"""Generate synthetic projects for the benchmarks.
+
+A project has a coverage layer with N polygons, M other layers with lines, and one atlas layout per page
+size, each with K labels.
+"""
+
+import json
+import random
+
+from pathlib import Path
+from typing import Sequence
+
+from qgis.core import (
+    QgsLayoutItemLabel,
+    QgsLayoutItemMap,
+    QgsLayoutItemPage,
+    QgsLayoutPoint,
+    QgsLayoutSize,
+    QgsPrintLayout,
+    QgsProject,
+    QgsUnitTypes,
+    QgsVectorLayer,
+)
+
+# Size of a cell of the coverage grid, in degrees
+CELL = 0.01
+
+LINES_PER_LAYER = 500
+
+
+def layout_name(page_size: str) -> str:
+    """Name of the atlas layout for the page size."""
+    return f"atlas-{page_size}"
+
+
+def _write_geojson(path: Path, features: list) -> None:
+    with path.open("w") as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f)
+
+
+def _coverage(features: int) -> list:
+    columns = max(1, int(features**0.5))
+    cells = []
+    for i in range(features):
+        x, y = (i % columns) * CELL, (i // columns) * CELL
+        ring = [[x, y], [x + CELL, y], [x + CELL, y + CELL], [x, y + CELL], [x, y]]
+        cells.append(
+            {
+                "type": "Feature",
+                "properties": {"id": i + 1, "name": f"Cell {i + 1}"},
+                "geometry": {"type": "Polygon", "coordinates": [ring]},
+            }
+        )
+    return cells
+
+
+def _lines(extent: float, seed: int) -> list:
+    rng = random.Random(seed)
+    lines = []
+    for i in range(LINES_PER_LAYER):
+        coordinates = [[rng.uniform(0, extent), rng.uniform(0, extent)] for _ in range(10)]
+        lines.append(
+            {
+                "type": "Feature",
+                "properties": {"id": i + 1, "value": rng.randint(0, 100)},
+                "geometry": {"type": "LineString", "coordinates": coordinates},
+            }
+        )
+    return lines
+
+
+def _atlas_layout(
+    project: QgsProject, coverage: QgsVectorLayer, page_size: str, labels: int
+) -> QgsPrintLayout:
+    layout = QgsPrintLayout(project)
+    layout.initializeDefaults()
+    layout.setName(layout_name(page_size))
+
+    page = layout.pageCollection().page(0)
+    page.setPageSize(page_size, QgsLayoutItemPage.Orientation.Landscape)
+    width, height = page.pageSize().width(), page.pageSize().height()
+
+    item_map = QgsLayoutItemMap(layout)
+    item_map.attemptMove(QgsLayoutPoint(10, 10, QgsUnitTypes.LayoutMillimeters))
+    item_map.attemptResize(QgsLayoutSize(width - 20, height - 40, QgsUnitTypes.LayoutMillimeters))
+    item_map.setAtlasDriven(True)
+    item_map.setAtlasMargin(0.1)
+    layout.addLayoutItem(item_map)
+    layout.setReferenceMap(item_map)
+
+    for i in range(labels):
+        label = QgsLayoutItemLabel(layout)
+        label.setId(f"label_{i}")
+        label.setText(f'[% "name" %] - label {i}')
+        label.attemptMove(QgsLayoutPoint(10 + i * 30, height - 25, QgsUnitTypes.LayoutMillimeters))
+        label.attemptResize(QgsLayoutSize(28, 10, QgsUnitTypes.LayoutMillimeters))
+        layout.addLayoutItem(label)
+
+    atlas = layout.atlas()
+    atlas.setCoverageLayer(coverage)
+    atlas.setPageNameExpression('"name"')
+    atlas.setEnabled(True)
+    return layout
+
+
+def generate_project(
+    directory: Path,
+    features: int,
+    layers: int,
+    labels: int,
+    page_sizes: Sequence[str] = ("A4", "A3"),
+) -> Path:
+    """Write the data and the project in the directory, return the path of the project.
+
+    The project is generated again only if the parameters are different.
+    """
+    name = f"synthetic_{features}f_{layers}l_{labels}k_{'_'.join(page_sizes)}"
+    project_path = directory.joinpath(f"{name}.qgs")
+    if project_path.exists():
+        return project_path
+
+    data_dir = directory.joinpath(name)
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    project = QgsProject()
+    coverage_path = data_dir.joinpath("coverage.geojson")
+    _write_geojson(coverage_path, _coverage(features))
+
+    extent = max(1, int(features**0.5)) * CELL
+    for i in range(layers):
+        lines_path = data_dir.joinpath(f"lines_{i}.geojson")
+        _write_geojson(lines_path, _lines(extent, seed=i))
+        project.addMapLayer(QgsVectorLayer(str(lines_path), f"lines_{i}", "ogr"))
+
+    coverage = QgsVectorLayer(str(coverage_path), "coverage", "ogr")
+    if not coverage.isValid():
+        raise RuntimeError(f"Invalid coverage layer {coverage_path}")
+    project.addMapLayer(coverage)
+
+    for page_size in page_sizes:
+        project.layoutManager().addLayout(_atlas_layout(project, coverage, page_size, labels))
+
+    if not project.write(str(project_path)):
+        raise RuntimeError(f"Failed to write the project {project_path}")
+    return project_path
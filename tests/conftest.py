@@ -12,7 +12,7 @@ from typing import (
 import pytest
 
 
-from qgis.PyQt.QtCore import QT_VERSION_STR
+from qgis.PyQt.QtCore import QT_VERSION_STR, QByteArray
 
 from qgis.core import Qgis, QgsFontUtils, QgsProject
 from qgis.server import (
@@ -117,14 +117,34 @@ def client(data: Path, output_dir: Path, plugin: Any, server: QgsServer) -> Clie
             headers: Optional[dict[str, str]] = None,
         ) -> OWSResponse:
             """Return server response from query"""
+            return self._request(QgsServerRequest.Method.GetMethod, query, project, headers)
+
+        def post(
+            self,
+            query: str,
+            body: bytes,
+            project: Optional[str] = None,
+            headers: Optional[dict[str, str]] = None,
+        ) -> OWSResponse:
+            """Return server response from query with a body"""
+            return self._request(QgsServerRequest.Method.PostMethod, query, project, headers, body)
+
+        def _request(
+            self,
+            method: QgsServerRequest.Method,
+            query: str,
+            project: Optional[str],
+            headers: Optional[dict[str, str]],
+            body: Optional[bytes] = None,
+        ) -> OWSResponse:
             if headers is None:
                 headers = {}
 
             request = QgsBufferServerRequest(
                 query,
-                QgsServerRequest.Method.GetMethod,
+                method,
                 headers,  # type: ignore [arg-type]
-                None,
+                QByteArray(body) if body is not None else None,
             )
             response = QgsBufferServerResponse()
             if project is not None:
@@ -121,3 +121,10 @@ class Client(Protocol):
         project: Optional[str] = None,
         headers: Optional[Dict[str, str]] = None,
     ) -> OWSResponse: ...
+    def post(
+        self,
+        query: str,
+        body: bytes,
+        project: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> OWSResponse: ...
@@ -0,0 +1,198 @@
+"""Test the output cache."""
+
+import os
+import shutil
+
+from pathlib import Path
+
+
+def test_fingerprint():
+    """Test the key is stable and depends on every value."""
+    from atlasprint.cache import fingerprint
+
+    key = fingerprint(layout="a", filter="id = 1", lizmap_user="alice", lizmap_user_groups=("g1",))
+    assert key == fingerprint(lizmap_user_groups=("g1",), lizmap_user="alice", filter="id = 1", layout="a")
+    assert key != fingerprint(layout="a", filter="id = 1", lizmap_user="bob", lizmap_user_groups=("g1",))
+    assert key != fingerprint(layout="a", filter="id = 1", lizmap_user="alice", lizmap_user_groups=())
+
+
+def test_memory_tier(tmp_path: Path):
+    """Test small documents are kept in memory, in a LRU order."""
+    from atlasprint.cache import OutputCache
+
+    cache = OutputCache(tmp_path.joinpath("cache"), memory_size=10, memory_item_size=5, disk_size=100)
+
+    assert cache.get("a") is None
+    assert cache.misses == 1
+
+    cache.put_bytes("a", b"aaaa")
+    cache.put_bytes("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+    assert cache.hits == 1
+
+    # "b" is the least recently used
+    cache.put_bytes("c", b"cccc")
+    assert cache.evictions == 1
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+
+
+def test_memory_only(tmp_path: Path):
+    """Test a cache without a disk tier drops the large documents."""
+    from atlasprint.cache import OutputCache
+
+    cache = OutputCache(None, memory_size=10, memory_item_size=5)
+
+    cache.put_bytes("a", b"aaaa")
+    cache.put_bytes("b", b"b" * 8)
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("b") is None
+    assert not cache.contains("b")
+    assert cache.stats()["disk_bytes"] == 0
+
+    cache.clear()
+    assert not cache.contains("a")
+
+
+def test_disk_tier(tmp_path: Path):
+    """Test large documents are stored on disk, with a size cap."""
+    from atlasprint.cache import OutputCache
+
+    cache = OutputCache(tmp_path.joinpath("cache"), memory_size=10, memory_item_size=5, disk_size=25)
+
+    documents = {}
+    for key in ("a", "b", "c", "d"):
+        documents[key] = tmp_path.joinpath(f"{key}.pdf")
+        documents[key].write_bytes(key.encode() * 10)
+
+    cache.put("a", documents["a"])
+    cache.put("b", documents["b"])
+    assert documents["a"].exists()
+
+    cached = cache.get("a")
+    assert isinstance(cached, Path)
+    assert cached.read_bytes() == b"a" * 10
+
+    cache.put("c", documents["c"])
+    assert cache.evictions == 1
+    assert cache.stats()["disk_bytes"] <= 25
+    # "b" is the least recently used
+    assert not cache.contains("b")
+    assert cache.contains("c")
+    assert cache.hits == 1
+
+    # Replacing a document does not count it twice
+    disk_bytes = cache.stats()["disk_bytes"]
+    cache.put("c", documents["c"])
+    assert cache.stats()["disk_bytes"] == disk_bytes
+
+    # Too large for the disk tier
+    documents["d"].write_bytes(b"d" * 30)
+    cache.put("d", documents["d"])
+    assert cache.get("d") is None
+
+
+def test_print_key_data_version(tmp_path: Path, data: Path):
+    """Test a document is not found in the cache once the data of the coverage layer has changed."""
+    from qgis.core import QgsProject
+
+    from atlasprint.cache import OutputCache, print_key
+    from atlasprint.service import parse_print_parameters
+
+    shutil.copy(data.joinpath("atlas_simple.qgs"), tmp_path)
+    shutil.copy(data.joinpath("lines.geojson"), tmp_path)
+    project = QgsProject()
+    assert project.read(str(tmp_path.joinpath("atlas_simple.qgs")))
+
+    parameters = parse_print_parameters({"TEMPLATE": "layout1-atlas", "FEATURE_IDS": "1"}, "", ())
+    cache = OutputCache(tmp_path.joinpath("cache"))
+    key = print_key(project, parameters, "", ())
+    cache.put_bytes(key, b"document")
+    assert print_key(project, parameters, "", ()) == key
+
+    # The coverage layer is edited
+    stat = tmp_path.joinpath("lines.geojson").stat()
+    os.utime(tmp_path.joinpath("lines.geojson"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    key = print_key(project, parameters, "", ())
+    assert cache.get(key) is None
+    assert cache.misses == 1
+
+
+def test_print_key_symlink(tmp_path: Path, data: Path):
+    """Test a project opened with a symbolic link has the same key, like the pre-rendered documents."""
+    from qgis.core import QgsProject
+
+    from atlasprint.cache import print_key
+    from atlasprint.service import parse_print_parameters
+
+    shutil.copy(data.joinpath("atlas_simple.qgs"), tmp_path)
+    shutil.copy(data.joinpath("lines.geojson"), tmp_path)
+    tmp_path.joinpath("link.qgs").symlink_to(tmp_path.joinpath("atlas_simple.qgs"))
+
+    parameters = parse_print_parameters({"TEMPLATE": "layout1-atlas", "FEATURE_IDS": "1"}, "", ())
+    keys = []
+    for name in ("atlas_simple.qgs", "link.qgs"):
+        project = QgsProject()
+        assert project.read(str(tmp_path.joinpath(name)))
+        keys.append(print_key(project, parameters, "", ()))
+    assert keys[0] == keys[1]
+
+
+def test_layout_data_version(data: Path):
+    """Test the version of the data covers the layers of the maps, even hidden in the project."""
+    from qgis.core import QgsLayoutItemMap, QgsProject
+
+    from atlasprint.context import project_context
+
+    project = QgsProject()
+    assert project.read(str(data.joinpath("atlas_simple.qgs")))
+    context = project_context(project)
+    assert context.layout_data_version("layout1-atlas") is not None
+
+    # A map locked on the tiles, hidden in the project and not stored in a local file
+    tiles = next(layer for layer in project.mapLayers().values() if layer.providerType() == "wms")
+    layout = project.layoutManager().layoutByName("layout1-atlas")
+    map_item = next(item for item in layout.items() if isinstance(item, QgsLayoutItemMap))
+    map_item.setLayers([tiles])
+    map_item.setKeepLayerSet(True)
+    assert context.layout_data_version("layout1-atlas") is None
+
+
+def test_page_cache_assembly(tmp_path: Path, data: Path):
+    """Test an atlas is assembled from the pages of previous requests, at the same position only."""
+    from pypdf import PdfReader
+    from qgis.core import QgsProject
+
+    from atlasprint.cache import OutputCache
+    from atlasprint.core import PAGE_ANY_POSITION_PROPERTY, OutputFormat, print_layout
+
+    project = QgsProject()
+    assert project.read(str(data.joinpath("atlas_simple.qgs")))
+    page_cache = OutputCache(tmp_path.joinpath("pages"), memory_size=0)
+
+    def export(feature_ids):
+        path = print_layout(
+            project, "layout1-atlas", OutputFormat.Pdf, feature_ids=feature_ids, page_cache=page_cache
+        )
+        try:
+            return len(PdfReader(path).pages)
+        finally:
+            path.unlink()
+
+    assert export([1, 2]) == 2
+    assert (page_cache.hits, page_cache.misses) == (0, 2)
+
+    # Same features at the same positions
+    assert export([1, 2]) == 2
+    assert (page_cache.hits, page_cache.misses) == (2, 2)
+
+    # The feature 2 is now the first of a single page, its number is not the same
+    assert export([2]) == 1
+    assert (page_cache.hits, page_cache.misses) == (2, 3)
+
+    # Pages not showing their position are reused anywhere
+    project.layoutManager().layoutByName("layout1-atlas").setCustomProperty(PAGE_ANY_POSITION_PROPERTY, True)
+    assert export([2, 1]) == 2
+    assert export([1]) == 1
+    assert page_cache.hits == 3
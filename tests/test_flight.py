@@ -0,0 +1,62 @@
+"""Test identical requests sharing a single export."""
+
+from pathlib import Path
+
+from atlasprint.flight import SingleFlight
+
+
+def test_follower(tmp_path: Path):
+    """Test a follower sends the document of the leader."""
+    flights = SingleFlight(tmp_path, enabled=True, timeout=1)
+    leader = flights.join("key", "1")
+    follower = flights.join("key", "2")
+    assert leader.leader
+    assert not follower.leader
+
+    leader.publish_bytes(b"document")
+    leader.release()
+    shared = follower.wait()
+    assert shared is not None
+    with shared:
+        assert shared.read() == b"document"
+    # Removed by the last follower
+    assert not tmp_path.joinpath("key.result").exists()
+    leader.retire()
+    follower.release()
+    # No lock file left, not in the spool directory
+    assert not list(tmp_path.joinpath("flights").iterdir())
+    assert not tmp_path.joinpath("key.flight").exists()
+
+
+def test_leader_failed(tmp_path: Path):
+    """Test a follower without any document from the leader."""
+    flights = SingleFlight(tmp_path, enabled=True, timeout=1)
+    leader = flights.join("key", "1")
+    follower = flights.join("key", "2")
+    leader.release()
+    assert follower.wait() is None
+    follower.release()
+
+
+def test_next_leader(tmp_path: Path):
+    """Test a request after the leader is the next leader, with a single leader at once."""
+    flights = SingleFlight(tmp_path, enabled=True, timeout=1)
+    leader = flights.join("key", "1")
+    leader.publish_bytes(b"document")
+    leader.release()
+    leader.retire()
+    assert not tmp_path.joinpath("key.result").exists()
+
+    second = flights.join("key", "2")
+    third = flights.join("key", "3")
+    assert second.leader
+    assert not third.leader
+    second.release()
+    third.release()
+
+
+def test_disabled(tmp_path: Path):
+    """Test every request is a leader when disabled."""
+    flights = SingleFlight(tmp_path, enabled=False, timeout=1)
+    assert flights.join("key", "1").leader
+    assert flights.join("key", "2").leader
@@ -1,6 +1,10 @@
+import io
 import json
+import zipfile
 
 from pathlib import Path
+
+from PIL import Image
 from qgis.core import Qgis
 
 from .core.client import Client
@@ -200,6 +204,18 @@ def test_valid_getprint_atlas_png(client: Client, output_dir: Path):
     output_dir.joinpath("layout-1-atlas.png").write_bytes(rv.content)
 
 
+def test_getprint_png_feature(client: Client):
+    """Test a single PNG is the page of the first feature selected by the request."""
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrint&MAP={PROJECT_ATLAS_SIMPLE}&TEMPLATE=layout1-atlas&FORMAT=png"
+    images = []
+    for feature_id in (1, 2):
+        rv = client.get(f"{qs}&FEATURE_IDS={feature_id}", PROJECT_ATLAS_SIMPLE)
+        assert rv.status_code == 200
+        assert rv.headers.get("Content-Type", "") == "image/png"
+        images.append(rv.content)
+    assert images[0] != images[1]
+
+
 def test_valid_getprint_atlas_svg(client: Client, output_dir: Path):
     """Test Atlas GetPrint response for atlas as SVG."""
     # Default to PDF, not sure about the broken SVG for now ...
@@ -262,3 +278,198 @@ def test_valid_getprint_report(client: Client, output_dir: Path):
     assert rv.headers.get("Content-Type", "").find("application/pdf") == 0
 
     output_dir.joinpath("layout2-report.pdf").write_bytes(rv.content)
+
+
+def test_valid_getprint_atlas_feature_ids(client: Client):
+    """Test Atlas GetPrint with a list of feature IDs."""
+    qs = "?SERVICE=ATLAS&REQUEST=GetPrint&MAP={}&TEMPLATE=layout1-atlas&FEATURE_IDS=2,1".format(
+        PROJECT_ATLAS_SIMPLE
+    )
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 200
+
+    assert rv.headers.get("Content-Type", "") == "application/pdf"
+
+
+def test_invalid_feature_ids(client: Client):
+    """Test a failed request with invalid FEATURE_IDS, or with EXP_FILTER."""
+    qs = "?SERVICE=ATLAS&REQUEST=GetPrint&MAP={}&TEMPLATE=layout1-atlas&FEATURE_IDS=1,a".format(
+        PROJECT_ATLAS_SIMPLE
+    )
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 400
+    b = json.loads(rv.content.decode("utf-8"))
+    assert (
+        b["message"] == "ATLAS - Error from the user while generating the PDF: Invalid number in FEATURE_IDS."
+    )
+
+    qs = (
+        "?SERVICE=ATLAS&"
+        "REQUEST=GetPrint&"
+        "MAP={}&"
+        "TEMPLATE=layout1-atlas&"
+        "EXP_FILTER=id in (1, 2)&"
+        "FEATURE_IDS=1,2".format(PROJECT_ATLAS_SIMPLE)
+    )
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 400
+    b = json.loads(rv.content.decode("utf-8"))
+    assert b["message"] == (
+        "ATLAS - Error from the user while generating the PDF: EXP_FILTER and FEATURE_IDS can not be used together."
+    )
+
+
+def test_getprintbatch_without_body(client: Client):
+    """Test GetPrintBatch without any JSON body."""
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrintBatch&MAP={PROJECT_ATLAS_SIMPLE}"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 400
+    b = json.loads(rv.content.decode("utf-8"))
+    assert b["status"] == "fail"
+    assert b["message"] == (
+        "ATLAS - Error from the user while generating the batch: "
+        "GetPrintBatch requires a JSON body with a list of `jobs`."
+    )
+
+
+def test_getprintbatch(client: Client):
+    """Test GetPrintBatch streams a document by job, and the errors of the jobs which failed."""
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrintBatch&MAP={PROJECT_ATLAS_SIMPLE}"
+    body = {
+        "jobs": [
+            {"TEMPLATE": "layout1-atlas", "FEATURE_IDS": [1, 2], "NAME": "lines"},
+            {"TEMPLATE": "layout1-atlas", "FEATURE_IDS": 2, "FORMAT": "png"},
+            {"TEMPLATE": "layout1-atlas", "EXP_FILTER": "id = 999", "NAME": "nothing"},
+        ]
+    }
+    rv = client.post(
+        qs,
+        json.dumps(body).encode("utf-8"),
+        PROJECT_ATLAS_SIMPLE,
+        headers={"Content-Type": "application/json"},
+    )
+    assert rv.status_code == 200
+    assert rv.headers.get("Content-Type", "") == "application/zip"
+
+    with zipfile.ZipFile(io.BytesIO(rv.content)) as archive:
+        assert archive.namelist() == ["lines.pdf", "002_layout1-atlas.png", "errors.json"]
+        assert archive.read("lines.pdf").startswith(b"%PDF")
+        Image.open(io.BytesIO(archive.read("002_layout1-atlas.png"))).verify()
+        errors = json.loads(archive.read("errors.json"))
+    assert list(errors) == ["nothing.pdf"]
+
+
+def test_archive_pdf(client: Client):
+    """Test ARCHIVE is refused for PDF."""
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrint&MAP={PROJECT_ATLAS_SIMPLE}&TEMPLATE=layout1-atlas&FEATURE_IDS=1&ARCHIVE=zip"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 400
+    b = json.loads(rv.content.decode("utf-8"))
+    assert b["message"] == (
+        "ATLAS - Error from the user while generating the PDF: ARCHIVE is only available for PNG and JPEG."
+    )
+
+
+def test_archive_png_zip(client: Client):
+    """Test a raster atlas in a ZIP archive, one image per feature."""
+    qs = (
+        f"?SERVICE=ATLAS&REQUEST=GetPrint&MAP={PROJECT_ATLAS_SIMPLE}&TEMPLATE=layout1-atlas"
+        f"&FORMAT=png&FEATURE_IDS=1,2&ARCHIVE=zip"
+    )
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 200
+    assert rv.headers.get("Content-Type", "").find("application/zip") == 0
+
+    with zipfile.ZipFile(io.BytesIO(rv.content)) as archive:
+        names = archive.namelist()
+        assert len(names) == 2
+        assert all(name.endswith(".png") for name in names)
+
+
+def test_getpreview(client: Client):
+    """Test a preview at a given width."""
+    qs = (
+        f"?SERVICE=ATLAS&REQUEST=GetPreview&MAP={PROJECT_ATLAS_SIMPLE}&TEMPLATE=layout1-atlas"
+        f"&EXP_FILTER=id=1&WIDTH=200"
+    )
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 200
+    assert rv.headers.get("Content-Type", "") == "image/png"
+
+    image = Image.open(io.BytesIO(rv.content))
+    assert abs(image.width - 200) <= 1
+
+
+def test_getpreview_invalid_width(client: Client):
+    """Test a preview larger than the maximum width."""
+    qs = (
+        f"?SERVICE=ATLAS&REQUEST=GetPreview&MAP={PROJECT_ATLAS_SIMPLE}&TEMPLATE=layout1-atlas"
+        f"&EXP_FILTER=id=1&WIDTH=100000"
+    )
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 400
+    b = json.loads(rv.content.decode("utf-8"))
+    assert b["message"] == (
+        "ATLAS - Error from the user while generating the preview: WIDTH must be between 1 and 1024."
+    )
+
+
+def test_no_matching_feature(client: Client):
+    """Test a filter without any feature fails before the export."""
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrint&MAP={PROJECT_ATLAS_SIMPLE}&TEMPLATE=layout1-atlas&EXP_FILTER=id = -1"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 400
+    b = json.loads(rv.content.decode("utf-8"))
+    assert b["message"] == (
+        "ATLAS - Error from the user while generating the PDF: Request-ID ND, the filter does not match any "
+        "feature in the layout `layout1-atlas`"
+    )
+
+
+def test_max_pages(client: Client, monkeypatch):
+    """Test an atlas with more pages than allowed."""
+    monkeypatch.setenv("QGIS_SERVER_ATLASPRINT_MAX_PAGES", "1")
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrint&MAP={PROJECT_ATLAS_SIMPLE}&TEMPLATE=layout1-atlas&FEATURE_IDS=1,2"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 413
+    b = json.loads(rv.content.decode("utf-8"))
+    assert "more than 1 pages" in b["message"]
+
+    # A single page
+    qs = (
+        f"?SERVICE=ATLAS&REQUEST=GetPreview&MAP={PROJECT_ATLAS_SIMPLE}&TEMPLATE=layout1-atlas&FEATURE_IDS=1,2"
+    )
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 200
+
+
+def test_etag(client: Client, monkeypatch):
+    """Test a document with the ETag of the client is not rendered again."""
+    monkeypatch.setenv("QGIS_SERVER_ATLASPRINT_CACHE_CONTROL", "private, max-age=60")
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrint&MAP={PROJECT_ATLAS_SIMPLE}&TEMPLATE=layout1-atlas&FEATURE_IDS=1"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 200
+    etag = rv.headers.get("ETag")
+    assert etag and etag.startswith('"')
+    assert rv.headers.get("Cache-Control") == "private, max-age=60"
+
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE, headers={"If-None-Match": f'"other", W/{etag}'})
+    assert rv.status_code == 304
+    assert rv.headers.get("ETag") == etag
+    assert not rv.content
+
+    # Another user has another document
+    rv = client.get(f"{qs}&LIZMAP_USER=alice", PROJECT_ATLAS_SIMPLE, headers={"If-None-Match": etag})
+    assert rv.status_code == 200
+    assert rv.headers.get("ETag") != etag
+
+
+def test_etag_matches():
+    """Test the comparison of the If-None-Match header with the ETag."""
+    from atlasprint.service import etag_matches
+
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('"def", W/"abc"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches(None, '"abc"')
+    assert not etag_matches('"abcd"', '"abc"')
@@ -0,0 +1,121 @@
+"""Test the asynchronous print jobs."""
+
+import json
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import List
+
+from .core.client import Client
+
+PROJECT_ATLAS_SIMPLE = "atlas_simple.qgs"
+
+
+def test_journal(tmp_path: Path):
+    """Test the records of the journal and their expiration."""
+    from atlasprint.jobs import JobQueue, JobStatus, read_job, write_job
+
+    queue = JobQueue(tmp_path, ttl=60)
+    job_id = "0" * 32
+    write_job(tmp_path, {"id": job_id, "status": JobStatus.Queued.value, "result": f"{job_id}.pdf"})
+    record = queue.status(job_id)
+    assert record is not None
+    assert record["status"] == "queued"
+    assert queue.result(job_id) is None
+
+    # Not a job ID, no path outside of the journal
+    assert read_job(tmp_path, "../etc/passwd") is None
+
+    record["status"] = JobStatus.Done.value
+    record["finished"] = time.time() - 120
+    write_job(tmp_path, record)
+    tmp_path.joinpath(f"{job_id}.pdf").write_bytes(b"%PDF")
+    assert queue.result(job_id) == tmp_path.joinpath(f"{job_id}.pdf")
+
+    queue.expire()
+    assert queue.status(job_id) is None
+    assert not tmp_path.joinpath(f"{job_id}.pdf").exists()
+
+
+def test_broken_pool(tmp_path: Path, monkeypatch):
+    """Test the jobs of a pool broken by a crashed worker process."""
+    from atlasprint.jobs import JobQueue, JobStatus, write_job
+
+    queue = JobQueue(tmp_path)
+    queued: List[str] = []
+    monkeypatch.setattr(queue, "_queue", queued.append)
+
+    running, waiting = "1" * 32, "2" * 32
+    for job_id, status in ((running, JobStatus.Running), (waiting, JobStatus.Queued)):
+        write_job(tmp_path, {"id": job_id, "request_id": "test", "status": status.value})
+
+    broken = ThreadPoolExecutor()
+    queue._executor = broken
+    for job_id in (running, waiting):
+        future: Future = Future()
+        future.set_exception(BrokenProcessPool("A worker process crashed"))
+        queue._done(broken, job_id, future)
+
+    # A new pool for the next jobs
+    assert queue._executor is None
+    # The running job has crashed the worker process
+    record = queue.status(running)
+    assert record["status"] == "failed"
+    assert record["error_code"] == 500
+    # The job not started yet is queued again
+    assert queue.status(waiting)["status"] == "queued"
+    assert queued == [waiting]
+
+
+def test_submit_print(client: Client):
+    """Test a job from its submission to its document."""
+    qs = f"?SERVICE=ATLAS&REQUEST=SubmitPrint&MAP={PROJECT_ATLAS_SIMPLE}&TEMPLATE=layout1-atlas&EXP_FILTER=id in (1, 2)"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 202
+    job_id = json.loads(rv.content.decode("utf-8"))["job"]
+
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrintResult&MAP={PROJECT_ATLAS_SIMPLE}&JOB={job_id}"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code in (200, 409)
+
+    # Rendered by a worker process, starting its own QGIS application
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrintStatus&MAP={PROJECT_ATLAS_SIMPLE}&JOB={job_id}"
+    deadline = time.monotonic() + 120
+    while True:
+        rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+        assert rv.status_code == 200
+        b = json.loads(rv.content.decode("utf-8"))
+        assert b["job"] == job_id
+        assert b["state"] in ("queued", "running", "done"), b
+        if b["state"] == "done" or time.monotonic() > deadline:
+            break
+        time.sleep(0.5)
+    assert b["state"] == "done"
+    assert b["pages_done"] == b["pages_total"] == 2
+
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrintResult&MAP={PROJECT_ATLAS_SIMPLE}&JOB={job_id}"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 200
+    assert rv.headers.get("Content-Type", "").find("application/pdf") == 0
+    assert rv.content.startswith(b"%PDF")
+
+
+def test_submit_print_no_template(client: Client):
+    """Test the parameters are validated before queuing the job."""
+    qs = f"?SERVICE=ATLAS&REQUEST=SubmitPrint&MAP={PROJECT_ATLAS_SIMPLE}"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 400
+    b = json.loads(rv.content.decode("utf-8"))
+    assert b["status"] == "fail"
+    assert b["message"] == "ATLAS - Error from the user while submitting the job: TEMPLATE is required"
+
+
+def test_unknown_job(client: Client):
+    """Test the status of an unknown job."""
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrintStatus&MAP={PROJECT_ATLAS_SIMPLE}&JOB={'f' * 32}"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 404
+    b = json.loads(rv.content.decode("utf-8"))
+    assert b["status"] == "fail"
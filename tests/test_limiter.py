@@ -0,0 +1,56 @@
+"""Test the limiter of the exports."""
+
+from pathlib import Path
+
+import pytest
+
+from atlasprint.limiter import Limiter, LimiterTimeout, Priority
+
+
+def test_slots(tmp_path: Path):
+    """Test a slot is given back when its file is closed."""
+    limiter = Limiter(
+        tmp_path,
+        slots={Priority.Interactive: 0, Priority.Bulk: 1},
+        timeouts={Priority.Interactive: 0, Priority.Bulk: 0.1},
+    )
+    # Not limited
+    assert limiter.acquire(Priority.Interactive, "test") is None
+
+    slot = limiter.acquire(Priority.Bulk, "test")
+    assert slot is not None
+    assert limiter.busy(Priority.Bulk) == 1
+
+    with pytest.raises(LimiterTimeout) as e:
+        limiter.acquire(Priority.Bulk, "test")
+    assert e.value.retry_after == 1
+    assert limiter.rejected[Priority.Bulk] == 1
+    assert limiter.queue_depth(Priority.Bulk) == 0
+
+    slot.close()
+    assert limiter.busy(Priority.Bulk) == 0
+    slot = limiter.acquire(Priority.Bulk, "test")
+    assert slot is not None
+    slot.close()
+
+
+def test_try_acquire(tmp_path: Path):
+    """Test a free slot is taken without waiting."""
+    limiter = Limiter(
+        tmp_path,
+        slots={Priority.Interactive: 0, Priority.Bulk: 2},
+        timeouts={Priority.Interactive: 0, Priority.Bulk: 10},
+    )
+    assert limiter.try_acquire(Priority.Interactive) is None
+
+    first, second = limiter.try_acquire(Priority.Bulk), limiter.try_acquire(Priority.Bulk)
+    assert first is not None
+    assert second is not None
+    assert limiter.try_acquire(Priority.Bulk) is None
+    assert limiter.queued[Priority.Bulk] == 0
+
+    first.close()
+    slot = limiter.try_acquire(Priority.Bulk)
+    assert slot is not None
+    slot.close()
+    second.close()
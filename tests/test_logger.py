@@ -0,0 +1,70 @@
+"""Test the levels and the buffered mode of the logger."""
+
+import json
+
+from typing import ClassVar, List, Tuple
+
+import pytest
+
+from atlasprint import logger
+
+
+class MessageLog:
+    """Record the messages instead of sending them to QGIS."""
+
+    messages: ClassVar[List[Tuple[str, int]]] = []
+
+    @classmethod
+    def logMessage(cls, message, tag, level):
+        cls.messages.append((message, level))
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    MessageLog.messages = []
+    monkeypatch.setattr(logger, "QgsMessageLog", MessageLog)
+    level = logger._level
+    yield MessageLog.messages
+    logger.set_level(level)
+    logger.set_buffered(False)
+    logger.end_request()
+
+
+def test_level(messages):
+    """Test messages below the level are not formatted."""
+
+    class Costly:
+        def __str__(self):
+            raise AssertionError("Formatted")
+
+    logger.set_level(logger.Level.WARNING)
+    logger.debug("Debug %s", Costly())
+    logger.info("Info %s", Costly())
+    logger.warning("Warning %s", 1)
+    assert [message for message, _ in messages] == ["Warning 1"]
+    assert not logger.is_enabled(logger.Level.INFO)
+
+
+def test_buffered(messages):
+    """Test the messages of a request are written as a single line."""
+    logger.set_level(logger.Level.DEBUG)
+    logger.set_buffered(True)
+    logger.begin_request("abc")
+    logger.debug("Debug %s", 1)
+    logger.warning("Warning")
+    assert messages == []
+
+    logger.end_request()
+    assert len(messages) == 1
+    line, level = messages[0]
+    assert level == logger.QGIS_LEVELS[logger.Level.WARNING]
+    record = json.loads(line)
+    assert record["request_id"] == "abc"
+    assert [(r["level"], r["message"]) for r in record["records"]] == [
+        ("debug", "Debug 1"),
+        ("warning", "Warning"),
+    ]
+
+    # Not buffered outside a request
+    logger.info("Info")
+    assert messages[-1][0] == "Info"
@@ -0,0 +1,77 @@
+"""Test the timings and the metrics."""
+
+import os
+
+from .core.client import Client
+
+PROJECT_ATLAS_SIMPLE = "atlas_simple.qgs"
+
+
+def test_histogram():
+    """Test the buckets are cumulative."""
+    from atlasprint.metrics import Histogram
+
+    histogram = Histogram(buckets=(0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    assert histogram.counts == [1, 2]
+    assert histogram.count == 3
+    assert histogram.samples("m", 'a="b"')[:3] == [
+        'm_bucket{a="b",le="0.1"} 1',
+        'm_bucket{a="b",le="1.0"} 2',
+        'm_bucket{a="b",le="+Inf"} 3',
+    ]
+
+
+def test_server_timing():
+    """Test the phases are listed in the header."""
+    from atlasprint.metrics import Timings
+
+    timings = Timings()
+    with timings.phase("filter"):
+        pass
+    with timings.phase("export"):
+        pass
+    value = timings.server_timing()
+    assert [entry.split(";")[0] for entry in value.split(", ")] == ["filter", "export", "total"]
+
+
+def test_prometheus_pid():
+    """Test every sample has the label of the process."""
+    from atlasprint.metrics import Metrics, Timings
+
+    metrics = Metrics()
+    timings = Timings()
+    with timings.phase("export"):
+        pass
+    metrics.observe("getprint", "layout", 200, timings)
+    content = metrics.prometheus({"atlasprint_spool_swept_total": ("Files removed.", 2)})
+
+    pid = f'pid="{os.getpid()}"'
+    samples = [line for line in content.splitlines() if not line.startswith("#")]
+    assert samples
+    assert all(pid in line for line in samples)
+    assert f"atlasprint_spool_swept_total{{{pid}}} 2" in samples
+
+
+def test_getmetrics(client: Client):
+    """Test the Server-Timing header and the Prometheus output."""
+    qs = f"?SERVICE=ATLAS&REQUEST=GetPrint&MAP={PROJECT_ATLAS_SIMPLE}&TEMPLATE=layout1-atlas&FEATURE_IDS=1"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 200
+    assert "filter;dur=" in rv.headers.get("Server-Timing", "")
+
+    qs = f"?SERVICE=ATLAS&REQUEST=GetMetrics&MAP={PROJECT_ATLAS_SIMPLE}"
+    rv = client.get(qs, PROJECT_ATLAS_SIMPLE)
+    assert rv.status_code == 200
+    assert rv.headers.get("Content-Type", "").find("text/plain") == 0
+    content = rv.content.decode("utf-8")
+    pid = f'pid="{os.getpid()}"'
+    assert (
+        f'atlasprint_request_duration_seconds_count{{{pid},request="getprint",layout="layout1-atlas",status="200"}}'
+        in content
+    )
+    assert (
+        f'atlasprint_phase_duration_seconds_count{{{pid},layout="layout1-atlas",phase="export"}}' in content
+    )
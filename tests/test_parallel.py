@@ -0,0 +1,72 @@
+"""Test the export in worker processes."""
+
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import pytest
+
+from qgis.core import QgsLayoutExporter, QgsProject
+
+
+@pytest.fixture
+def export_chunks(monkeypatch):
+    """Record the calls to the export of the chunks and to the reset of the pool."""
+    from atlasprint import core
+
+    calls = {"export": [], "reset": 0, "failures": 0}
+
+    def export(project, layout_name, chunks, running, export_path, **kwargs):
+        calls["export"].append((chunks, running))
+        if calls["failures"]:
+            calls["failures"] -= 1
+            raise BrokenProcessPool("A worker process crashed")
+        return QgsLayoutExporter.ExportResult.Success
+
+    def reset():
+        calls["reset"] += 1
+
+    monkeypatch.setattr(core, "_export_chunks", export)
+    monkeypatch.setattr(core, "reset_executor", reset)
+    monkeypatch.setenv("QGIS_SERVER_ATLASPRINT_PARALLEL_WORKERS", "2")
+    monkeypatch.setenv("QGIS_SERVER_ATLASPRINT_PARALLEL_CHUNK_SIZE", "4")
+    return calls
+
+
+def test_broken_pool_retried(export_chunks, tmp_path: Path):
+    """Test the pool is started again after a worker process crashed, and the export retried."""
+    from atlasprint.core import _export_atlas_parallel
+
+    export_chunks["failures"] = 1
+    result = _export_atlas_parallel(
+        QgsProject(),
+        "atlas",
+        list(range(10)),
+        tmp_path.joinpath("atlas.pdf"),
+        scales=None,
+        scale=None,
+        request_id="test",
+    )
+    assert result == QgsLayoutExporter.ExportResult.Success
+    assert export_chunks["reset"] == 1
+    assert len(export_chunks["export"]) == 2
+    chunks, running = export_chunks["export"][0]
+    assert chunks == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert running == 2
+
+
+def test_broken_pool_failed(export_chunks, tmp_path: Path):
+    """Test the export fails if the worker processes crash again, without using the broken pool."""
+    from atlasprint.core import _export_atlas_parallel
+
+    export_chunks["failures"] = 2
+    with pytest.raises(RuntimeError):
+        _export_atlas_parallel(
+            QgsProject(),
+            "atlas",
+            list(range(10)),
+            tmp_path.joinpath("atlas.pdf"),
+            scales=None,
+            scale=None,
+            request_id="test",
+        )
+    assert export_chunks["reset"] == 2
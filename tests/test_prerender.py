@@ -0,0 +1,86 @@
+"""Test the pre-rendering of atlas features."""
+
+from pathlib import Path
+
+from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer
+
+
+def test_feature_hashes():
+    """Test the hash of a feature changes with its attributes and its geometry only."""
+    from atlasprint.prerender import feature_hashes
+
+    layer = QgsVectorLayer("Point?crs=EPSG:4326&field=name:string", "points", "memory")
+    features = []
+    for i, name in enumerate(("a", "b")):
+        feature = QgsFeature(layer.fields())
+        feature.setAttributes([name])
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(i, i)))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+
+    hashes = feature_hashes(layer)
+    assert len(hashes) == 2
+    assert feature_hashes(layer) == hashes
+
+    first, second = sorted(hashes)
+    assert feature_hashes(layer, [second]) == {second: hashes[second]}
+
+    layer.dataProvider().changeAttributeValues({first: {0: "c"}})
+    assert feature_hashes(layer)[first] != hashes[first]
+    assert feature_hashes(layer)[second] == hashes[second]
+
+    layer.dataProvider().changeGeometryValues({second: QgsGeometry.fromPointXY(QgsPointXY(5, 5))})
+    assert feature_hashes(layer)[second] != hashes[second]
+
+
+def test_state(tmp_path: Path):
+    """Test the state of a previous run is read back, a missing state is empty."""
+    from atlasprint.prerender import _read_state, _write_state
+
+    path = tmp_path.joinpath(".prerender", "state.json")
+    assert _read_state(path) == {}
+
+    _write_state(path, {"project_modified": 1, "features": {"1": "abc"}})
+    assert _read_state(path) == {"project_modified": 1, "features": {"1": "abc"}}
+    assert list(path.parent.iterdir()) == [path]
+
+
+def test_prerender_missing_document(tmp_path: Path, data: Path, monkeypatch):
+    """Test a feature not modified is rendered again if its document is no longer in the cache."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from qgis.core import QgsProject
+
+    from atlasprint import prerender
+    from atlasprint.cache import OutputCache, print_key
+
+    project = QgsProject()
+    assert project.read(str(data.joinpath("atlas_simple.qgs")))
+    cache = OutputCache(tmp_path.joinpath("cache"), memory_size=0)
+
+    rendered = []
+
+    def render_features(project_path, layout_name, output_format, feature_ids):
+        for feature_id in feature_ids:
+            parameters = prerender.feature_parameters(layout_name, output_format, feature_id)
+            cache.put_bytes(print_key(project, parameters, "", ()), b"document")
+            rendered.append(feature_id)
+        return [(feature_id, None) for feature_id in feature_ids]
+
+    monkeypatch.setattr(prerender, "render_features", render_features)
+
+    def run():
+        rendered.clear()
+        with ThreadPoolExecutor(1) as executor:
+            errors = prerender.prerender_layout(
+                executor, cache, project, "layout1-atlas", "pdf", [1, 2], False
+            )
+        assert errors == 0
+        return sorted(rendered)
+
+    assert run() == [1, 2]
+    assert run() == []
+
+    # Evicted, or with another version of the data
+    cache.clear()
+    assert run() == [1, 2]
@@ -0,0 +1,39 @@
+"""Test the spool directory."""
+
+import os
+import time
+
+from pathlib import Path
+
+from atlasprint.spool import Spool
+
+
+def test_quota_and_sweep(tmp_path: Path):
+    """Test the quota and the files removed by age."""
+    spool = Spool(tmp_path, quota=10, max_age=60, sweep_interval=0)
+    assert not spool.full()
+
+    old = spool.path("old.pdf")
+    old.write_bytes(b"0" * 10)
+    assert spool.usage() == 10
+    assert spool.full()
+    assert spool.refused == 1
+
+    recent = spool.path("recent.pdf")
+    recent.write_bytes(b"0")
+    timestamp = time.time() - 120
+    os.utime(old, (timestamp, timestamp))
+
+    assert spool.sweep() == 1
+    assert not old.exists()
+    assert recent.exists()
+    assert not spool.full()
+
+
+def test_usage_links(tmp_path: Path):
+    """Test a document shared with identical requests, a link to the file, is counted once."""
+    spool = Spool(tmp_path, quota=0, max_age=60, sweep_interval=0)
+    document = spool.path("document.pdf")
+    document.write_bytes(b"0" * 10)
+    os.link(document, spool.path("key.result"))
+    assert spool.usage() == 10
@@ -31,21 +31,144 @@ def test_optimize_filter():
     assert optimize_expression(layer, "$id in ('1','2')") == "$id in ('1','2')"
 
     # One primary key
-    layer.primaryKeyAttributes = lambda: ["primary"]
+    layer.primaryKeyAttributes = lambda: [0]
 
-    assert optimize_expression(layer, "$id=3") == '"primary"=3'
-    assert optimize_expression(layer, "$id in ('1','2')") == "\"primary\" in ('1','2')"
+    assert optimize_expression(layer, "$id=3") == '"primary" = 3'
+    assert optimize_expression(layer, "$id in ('1','2')") == '"primary" IN (1, 2)'
 
     # Two primary keys
-    layer.primaryKeyAttributes = lambda: ["primary", "name"]
+    layer.primaryKeyAttributes = lambda: [0, 1]
     assert optimize_expression(layer, "$id=3") == "$id=3"
 
     # One primary key but it's not integer
     layer = QgsVectorLayer("None?field=primary:string(20)&field=name:string(20)", "test", "memory")
-    layer.primaryKeyAttributes = lambda: ["primary"]
+    layer.primaryKeyAttributes = lambda: [0]
     assert optimize_expression(layer, "$id=3") == "$id=3"
 
     # One primary key type double
     layer = QgsVectorLayer("None?field=primary:double(20,20)&field=name:string(20)", "test", "memory")
-    layer.primaryKeyAttributes = lambda: ["primary"]
-    assert optimize_expression(layer, "$id=3") == '"primary"=3'
+    layer.primaryKeyAttributes = lambda: [0]
+    assert optimize_expression(layer, "$id=3") == '"primary" = 3'
+
+    # The primary key is not the first field
+    layer = QgsVectorLayer("None?field=name:string(20)&field=primary:integer", "test", "memory")
+    layer.primaryKeyAttributes = lambda: [1]
+    assert optimize_expression(layer, "$id=3") == '"primary" = 3'
+
+
+def test_optimize_filter_tree():
+    """Test what is found in the expression tree of the filter."""
+    from atlasprint.core import optimize_filter
+
+    layer = QgsVectorLayer("None?field=primary:integer&field=name:string(20)", "test", "memory")
+
+    optimized = optimize_filter(layer, "$id = 3 OR @id IN (4, 5)")
+    assert optimized.feature_ids == [3, 4, 5]
+    assert optimized.rewrite == "feature-ids"
+
+    optimized = optimize_filter(layer, "$id NOT IN (4, 5)")
+    assert optimized.feature_ids is None
+    assert optimized.rewrite == "none"
+
+    optimized = optimize_filter(layer, "\"name\" = 'abc'")
+    assert optimized.feature_ids is None
+    assert optimized.constant is None
+
+    layer.primaryKeyAttributes = lambda: [0]
+    optimized = optimize_filter(layer, '"primary" IN (2, 1, 2)')
+    assert optimized.feature_ids == [2, 1]
+    assert optimized.expression == '"primary" IN (2, 1)'
+    assert optimized.rewrite == "primary-key"
+
+    optimized = optimize_filter(layer, "1 = 1")
+    assert optimized.constant is True
+    assert optimized.rewrite == "constant-true"
+
+    optimized = optimize_filter(layer, "false")
+    assert optimized.constant is False
+    assert optimized.rewrite == "constant-false"
+
+    # The values of a double primary key are not the feature IDs
+    layer = QgsVectorLayer("None?field=primary:double(20,20)&field=name:string(20)", "test", "memory")
+    layer.primaryKeyAttributes = lambda: [0]
+    optimized = optimize_filter(layer, '"primary" = 3')
+    assert optimized.feature_ids is None
+    assert optimized.expression == '"primary" = 3'
+    assert optimized.rewrite == "none"
+    assert not optimized.feature_request().filterFids()
+
+
+def test_layout_variables(data):
+    """Test the Lizmap user and its groups, as an array, reach a label of the layout while printing."""
+    from qgis.core import QgsLayoutItemLabel, QgsProject
+
+    from atlasprint.core import OutputFormat, _prepare_layout, lizmap_groups
+    from atlasprint.service import parse_print_parameters
+
+    project = QgsProject()
+    assert project.read(str(data.joinpath("atlas_simple.qgs")))
+    custom_variables = project.customVariables()
+
+    def label_text(lizmap_user, groups):
+        parameters = parse_print_parameters(
+            {"TEMPLATE": "layout1-atlas", "FEATURE_IDS": "1"}, lizmap_user, groups
+        )
+        with lizmap_groups(project, groups):
+            _, _, atlas_layout, _, _ = _prepare_layout(
+                project,
+                "layout1-atlas",
+                OutputFormat.Pdf,
+                None,
+                None,
+                None,
+                "test",
+                feature_ids=parameters["feature_ids"],
+                variables=parameters["variables"],
+            )
+            label = QgsLayoutItemLabel(atlas_layout)
+            label.setText(
+                "[% @lizmap_user %]: [% array_to_string(@lizmap_user_groups, '/') %] "
+                "[% array_contains(@lizmap_user_groups, 'g2') %] [% array_length(@lizmap_user_groups) %]"
+            )
+            atlas_layout.addLayoutItem(label)
+            return label.currentText()
+
+    assert label_text("alice", ("g1", "g2")) == "alice: g1/g2 true 2"
+    # An empty array for an anonymous user
+    assert label_text("", ()) == ":  false 0"
+
+    # Restored after the request
+    assert project.customVariables() == custom_variables
+    # Only in the private clone of the layout
+    assert "lizmap_user" not in project.layoutManager().layoutByName("layout1-atlas").customProperty(
+        "variableNames", []
+    )
+
+
+def test_expression_cache_projects(data, tmp_path):
+    """Test an expression prepared for a layer is not shared with the same layer ID in another project."""
+    import shutil
+
+    from qgis.core import QgsExpressionContext, QgsProject
+
+    from atlasprint.expressions import ExpressionCache
+
+    layers = []
+    for name in ("a", "b"):
+        project_dir = tmp_path.joinpath(name)
+        project_dir.mkdir()
+        shutil.copy(data.joinpath("atlas_simple.qgs"), project_dir)
+        shutil.copy(data.joinpath("lines.geojson"), project_dir)
+        project = QgsProject()
+        assert project.read(str(project_dir.joinpath("atlas_simple.qgs")))
+        layers.append((project.fileName(), project.layoutManager().layoutByName("layout1-atlas").atlas()))
+
+    (path_a, atlas_a), (path_b, atlas_b) = layers
+    layer_a, layer_b = atlas_a.coverageLayer(), atlas_b.coverageLayer()
+    assert layer_a.id() == layer_b.id()
+
+    cache = ExpressionCache()
+    cached = cache.prepare(path_a, layer_a, "$id = 1", QgsExpressionContext)
+    assert cache.prepare(path_a, layer_a, "$id = 1", QgsExpressionContext) is cached
+    assert cache.prepare(path_b, layer_b, "$id = 1", QgsExpressionContext) is not cached
+    assert len(cache) == 2